@@ -38,6 +38,7 @@ from res import frmActiChampConfig
 from operator import itemgetter
 import textwrap
 from devices.devcontainer import DeviceContainer
+from tools.linearmontage import LinearMontage
 
 # enable active shielding mode
 AMP_SHIELD_MODE = False
@@ -416,14 +417,16 @@ class AMP_ActiChamp(ModuleBase):
     def _create_channel_selection(self):
         ''' Create index arrays of selected channels and prepare EEG_DataBlock 
         '''
+        config = channel_table(self.channel_config)
+
         # get all active eeg channel indices (including reference channel)
-        mask = lambda x: (x.group == ChannelGroup.EEG) and (x.enable | x.isReference) and (x.input <= self.amp.properties.CountEeg)
-        eeg_map = np.array(map(mask, self.channel_config))
+        eeg_map = (config["group"] == ChannelGroup.EEG) & (config["enable"] | config["isReference"]) & \
+                  (config["input"] <= self.amp.properties.CountEeg)
         self.eeg_indices = np.nonzero(eeg_map)[0]     # indices of all eeg channels
 
         # get all active aux channel indices
-        mask = lambda x: (x.group == ChannelGroup.AUX) and x.enable and (x.input <= self.amp.properties.CountAux)
-        eeg_map = np.array(map(mask, self.channel_config))
+        eeg_map = (config["group"] == ChannelGroup.AUX) & config["enable"] & \
+                  (config["input"] <= self.amp.properties.CountAux)
         self.aux_indices = np.nonzero(eeg_map)[0]     # indices of all aux channels
         self.property_indices = np.append(self.eeg_indices, self.aux_indices) 
         
@@ -438,15 +441,12 @@ class AMP_ActiChamp(ModuleBase):
 
         # get the reference channel indices
         #mask = lambda x: (x.group == ChannelGroup.EEG) and x.isReference and (x.input <= self.amp.properties.CountEeg)
-        eeg_ref = np.array(map(lambda x: x.isReference, self.eeg_data.channel_properties))
+        eeg_ref = config["isReference"][self.property_indices]
         self.ref_index = np.nonzero(eeg_ref)[0]     # indices of reference channel(s)
         if len(self.ref_index) and not AMP_MULTIPLE_REF:
             # use only the first reference channel
             self.ref_index = self.ref_index[0:1]    
-            idx = np.nonzero(map(lambda x: x not in self.ref_index, 
-                                 range(0, len(self.eeg_indices)) 
-                                 ) 
-                             )[0]
+            idx = np.setdiff1d(np.arange(len(self.eeg_indices)), self.ref_index)
             for prop in self.eeg_data.channel_properties[idx]:
                 prop.isReference = False
 
@@ -468,10 +468,7 @@ class AMP_ActiChamp(ModuleBase):
         self.ref_remove_index = self.ref_index
         if (self.recording_mode != CHAMP_MODE_IMPEDANCE) and len(self.ref_index):
             # set reference channel names for all other electrodes
-            idx = np.nonzero(map(lambda x: x not in self.ref_index, 
-                                 range(0, len(self.eeg_indices)) 
-                                 ) 
-                             )[0]
+            idx = np.setdiff1d(np.arange(len(self.eeg_indices)), self.ref_index)
             for prop in self.eeg_data.channel_properties[idx]:
                 prop.refname = "REF"
 
@@ -482,11 +479,17 @@ class AMP_ActiChamp(ModuleBase):
                 self.eeg_data.eeg_channels = np.delete(self.eeg_data.eeg_channels, self.ref_index, 0)
             '''
             # remove all disabled reference channels
-            ref_dis = np.array(map(lambda x: x.isReference and not x.enable, 
-                                   self.eeg_data.channel_properties))
+            properties = channel_table(self.eeg_data.channel_properties)
+            ref_dis = properties["isReference"] & ~properties["enable"]
             self.ref_remove_index = np.nonzero(ref_dis)[0]     # indices of disabled reference channels
             self.eeg_data.channel_properties = np.delete(self.eeg_data.channel_properties, self.ref_remove_index, 0)
             self.eeg_data.eeg_channels = np.delete(self.eeg_data.eeg_channels, self.ref_remove_index, 0)
+
+        # compile reference subtraction and removal of the disabled reference channels
+        self.montage_op = LinearMontage(len(self.channel_indices),
+                                        np.delete(np.arange(len(self.channel_indices)), self.ref_remove_index),
+                                        self.ref_index,
+                                        np.arange(len(self.eeg_indices)))
         
         # prepare recording mode and anti aliasing filters
         self._prepare_mode_and_filters()
@@ -495,14 +498,14 @@ class AMP_ActiChamp(ModuleBase):
     def _create_all_channel_selection(self):
         ''' Create index arrays of all available channels and prepare EEG_DataBlock 
         '''
+        config = channel_table(self.channel_config)
+
         # get all eeg channel indices
-        mask = lambda x: (x.group == ChannelGroup.EEG) and (x.input <= self.amp.properties.CountEeg)
-        eeg_map = np.array(map(mask, self.channel_config))
+        eeg_map = (config["group"] == ChannelGroup.EEG) & (config["input"] <= self.amp.properties.CountEeg)
         self.eeg_indices = np.nonzero(eeg_map)[0]     # indices of all eeg channels
 
         # get all aux channel indices
-        mask = lambda x: (x.group == ChannelGroup.AUX) and (x.input <= self.amp.properties.CountAux)
-        eeg_map = np.array(map(mask, self.channel_config))
+        eeg_map = (config["group"] == ChannelGroup.AUX) & (config["input"] <= self.amp.properties.CountAux)
         self.aux_indices = np.nonzero(eeg_map)[0]     # indices of all aux channels
         self.property_indices = np.append(self.eeg_indices, self.aux_indices) 
         
@@ -519,6 +522,7 @@ class AMP_ActiChamp(ModuleBase):
         self.ref_index = np.array([])           # indices of reference channel(s)
         self.eeg_data.ref_channel_name = ""
         self.ref_remove_index = self.ref_index
+        self.montage_op = LinearMontage(len(self.channel_indices))
 
         # prepare recording mode and anti aliasing filters
         self._prepare_mode_and_filters()
@@ -633,6 +637,9 @@ class AMP_ActiChamp(ModuleBase):
                                     EventType.STATUS,
                                     info = "%.0f Hz"%(self.eeg_data.sample_rate),
                                     status_field = "Rate"))
+
+        # data blocks share the channel properties until the next update
+        self.eeg_data.share_properties()
         return copy.copy(self.eeg_data)
         
     def process_impedance(self):
@@ -789,30 +796,8 @@ class AMP_ActiChamp(ModuleBase):
             self.eeg_data.sample_channel = d[2]
             self.eeg_data.sample_counter += self.eeg_data.sample_channel.shape[1]
 
-        # average, subtract and remove the reference channels
-        if len(self.ref_index):
-            '''
-            # subtract
-            for ref_channel in self.eeg_data.eeg_channels[self.ref_index]:
-                self.eeg_data.eeg_channels[:len(self.eeg_indices)] -= ref_channel
-                # restore reference channel
-                self.eeg_data.eeg_channels[self.ref_index[0]] = ref_channel
-                
-            # remove single reference channel if not enabled
-            if not (len(self.eeg_data.channel_properties) > self.ref_index[0] and
-                    self.eeg_data.channel_properties[self.ref_index[0]].isReference ):
-                self.eeg_data.eeg_channels = np.delete(self.eeg_data.eeg_channels, self.ref_index, 0)
-            '''
-            # average reference channels
-            reference = np.mean(self.eeg_data.eeg_channels[self.ref_index], 0)
-
-            # subtract reference
-            self.eeg_data.eeg_channels[:len(self.eeg_indices)] -= reference
-
-            # remove all disabled reference channels
-            if len(self.ref_remove_index) > 0:
-                self.eeg_data.eeg_channels = np.delete(self.eeg_data.eeg_channels, self.ref_remove_index, 0)
-            
+        # average, subtract and remove the reference channels in a single pass
+        self.eeg_data.eeg_channels = self.montage_op.apply(self.eeg_data.eeg_channels, inplace=True)
                 
         # calculate date and time for the first sample of this block in s
         sampletime = self.eeg_data.sample_channel[0][0] / self.eeg_data.sample_rate
@@ -1209,9 +1194,10 @@ class _ConfigurationPane(Qt.QFrame, frmActiChampConfig.Ui_frmActiChampConfig):
     def _fillChannelTables(self):
         ''' Create and fill channel tables
         '''
+        config = channel_table(self.amplifier.channel_config)
+
         # EEG channel table, show available channels only
-        mask = lambda x: (x.group == ChannelGroup.EEG) & (x.input <= self.amplifier.amp.properties.CountEeg)
-        ch_map = np.array(map(mask, self.amplifier.channel_config))
+        ch_map = (config["group"] == ChannelGroup.EEG) & (config["input"] <= self.amplifier.amp.properties.CountEeg)
         ch_indices = np.nonzero(ch_map)[0]     
         self.eeg_model = _ConfigTableModel(self.amplifier.channel_config[ch_indices])
         self.tableViewChannels.setModel(self.eeg_model)
@@ -1219,9 +1205,7 @@ class _ConfigurationPane(Qt.QFrame, frmActiChampConfig.Ui_frmActiChampConfig):
         self.tableViewChannels.setEditTriggers(Qt.QAbstractItemView.AllEditTriggers)
         
         # AUX channel table, show available channels only
-        mask = lambda x: (x.group == ChannelGroup.AUX) & (x.input <= self.amplifier.amp.properties.CountAux)
-        #mask = lambda x: x.group == ChannelGroup.AUX
-        ch_map = np.array(map(mask, self.amplifier.channel_config))
+        ch_map = (config["group"] == ChannelGroup.AUX) & (config["input"] <= self.amplifier.amp.properties.CountAux)
         ch_indices = np.nonzero(ch_map)[0]     
         self.aux_model = _ConfigTableModel(self.amplifier.channel_config[ch_indices])
         self.tableViewAux.setModel(self.aux_model)
@@ -85,8 +85,8 @@ class HardwareInputDevice():
         and return an output property array and indices of processed channels
         '''
         # get the required channel indices
-        mask = lambda x: (x.inputgroup == self.inputGroup) and (x.input in self.inputChannels)
-        ch_map = np.array(map(mask, params.channel_properties))
+        table = channel_table(params.channel_properties)
+        ch_map = (table["inputgroup"] == self.inputGroup) & np.in1d(table["input"], self.inputChannels)
         indices = np.nonzero(ch_map)[0]     # indices of required channels
         # dictionary with channel number as key and its index in the input data array as value
         idx = dict((x.input, indices[i]) for i, x in enumerate(params.channel_properties[indices]))
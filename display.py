@@ -37,7 +37,7 @@ from PyQt4 import Qwt5 as Qwt
 from modbase import *
 from res import frmScopeOnline
 from operator import itemgetter
-from collections import defaultdict
+from collections import defaultdict, deque
 
 '''
 ------------------------------------------------------------
@@ -45,6 +45,14 @@ DISPLAY MODULE
 ------------------------------------------------------------
 '''
     
+#: display update interval limits in ms
+FRAME_INTERVAL_MIN = 30
+FRAME_INTERVAL_MAX = 1000
+#: display status interval in seconds
+FRAME_STATUS_INTERVAL = 2.0
+#: number of background rendering threads
+RASTER_THREADS = 4
+
 class DISP_Scope(Qwt.QwtPlot, ModuleBase):
     """ EEG signal display widget.
     """
@@ -62,7 +70,11 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         # 4: timebase values changed from per division to screen (factor 10)
         #    Type of timebase, scale and groupsize changed from string to float
         # 5: separate scale values for EEG and AUX channels 
-        self.xmlVersion = 5
+        # 6: min/max envelope flag added
+        # 7: display CPU budget added
+        # 8: history length added
+        # 9: background rendering flag added
+        self.xmlVersion = 9
         
         #self.setTitle('ActiChamp');
         self.setCanvasBackground(Qt.Qt.white)
@@ -79,6 +91,12 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
                      self.baselineNowClicked)
         self.connect(self.online_cfg.checkBoxBaseline, Qt.SIGNAL("stateChanged()"),
                      self.baselineNowClicked)
+        self.connect(self.online_cfg.checkBoxEnvelope, Qt.SIGNAL("toggled(bool)"),
+                     self.envelopeToggled)
+        self.connect(self.online_cfg.checkBoxRaster, Qt.SIGNAL("toggled(bool)"),
+                     self.rasterToggled)
+        self.connect(self.online_cfg.spinBoxDelay, Qt.SIGNAL("valueChanged(double)"),
+                     self.historyDelayChanged)
 
         # legend
         legend = _ScopeLegend()
@@ -122,7 +140,7 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         self.traces = []
 
         # reset marker buffer
-        self.plot_markers = []      # list of QwtPlotMarker()
+        self.plot_markers = deque() # QwtPlotMarker() objects, oldest first
         self.input_markers = []     # list of EEG markers
         
         # EEG data block backup
@@ -138,6 +156,18 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         self.channel_slice = slice(0,0,1)       # channel group selection      
         self.baseline_request = False
         self.selectedChannel = None
+        self.envelope = False                   # min/max envelope instead of sample picking
+        self.envelope_carry = None              # samples of the incomplete envelope bin
+        self.envelope_sc_carry = None
+        self.display_refresh = True             # transform the whole ring buffer on next update
+        self.display_key = None                 # scale and baseline settings of the display buffer
+        self.history = None                     # min/max history (_MinMaxPyramid)
+        self.history_length = 300.0             # history length in seconds
+        self.history_delay = 0.0                # scroll back in history in seconds, 0 = live display
+        self.raster = False                     # draw traces by background threads
+        self.rasterizer = None                  # _TraceRasterizer
+        self.raster_item = _RasterItem()        # plot item showing the rasterized traces
+        self.blit_time = 0.0                    # time in seconds to show the last rasterized frame
         
         # set default display
         self.eeg = EEG_DataBlock()
@@ -147,8 +177,16 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         self.ttime = -1.0
         self.tcount = 10.0
                 
+        # frame rate governor
+        self.display_budget = 30.0              # % of GUI thread time available for display updates
+        self.frame_interval = FRAME_INTERVAL_MIN    # display update interval in ms
+        self.render_time = 0.0                  # averaged display update time in ms
+        self.frames = 0                         # number of display updates since last status
+        self.frames_skipped = 0                 # number of skipped display updates since last status
+        self.frame_statustime = time.clock()
+
         # start self.timerEvent() to update display asynchronously
-        self.startTimer(30)
+        self.timer_id = self.startTimer(self.frame_interval)
         self.update_display = False
         self.dataavailable = False
 
@@ -160,6 +198,10 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         self.timebase = self.online_cfg.set_timebase(10.0)      # 10s / Screen
         self.online_cfg.set_groupsize(16)                       # group size 16 channels
         self.online_cfg.checkBoxBaseline.setChecked(True)       # baseline correction enabled                    
+        self.online_cfg.checkBoxEnvelope.setChecked(False)      # min/max envelope disabled
+        self.online_cfg.checkBoxRaster.setChecked(False)        # draw traces in GUI thread
+        self.display_budget = 30.0                              # 30% display CPU budget
+        self.history_length = 300.0                             # 5 minutes display history
         
         # update display
         self.process_update(self.eeg)
@@ -173,6 +215,9 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         if params != None:
             self.eeg = params
             self.online_cfg.update_content(self.eeg)
+            # sample counter and channels may have changed, restart the history
+            self.history = None
+            self.history_delay = self.online_cfg.set_delay(0.0)
             self.arrangeTraces()
             self.replot()
         return params
@@ -246,6 +291,10 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
                            E.auxscale(aux_scale),
                            E.groupsize(self.online_cfg.get_groupsize()),
                            E.baseline(self.online_cfg.checkBoxBaseline.isChecked()),
+                           E.envelope(self.online_cfg.checkBoxEnvelope.isChecked()),
+                           E.cpubudget(self.display_budget),
+                           E.history(self.history_length),
+                           E.raster(self.online_cfg.checkBoxRaster.isChecked()),
                            version=str(self.xmlVersion),
                            instance=str(self._instance),
                            module="display")
@@ -303,6 +352,22 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
             if version > 2:
                 # get baseline correction flag
                 self.online_cfg.checkBoxBaseline.setChecked(cfg.baseline.pyval)                    
+
+            if version > 5:
+                # get min/max envelope flag
+                self.online_cfg.checkBoxEnvelope.setChecked(cfg.envelope.pyval)
+
+            if version > 6:
+                # get display CPU budget
+                self.display_budget = min(100.0, max(1.0, float(cfg.cpubudget.pyval)))
+
+            if version > 7:
+                # get history length
+                self.history_length = max(0.0, float(cfg.history.pyval))
+
+            if version > 8:
+                # get background rendering flag
+                self.online_cfg.checkBoxRaster.setChecked(cfg.raster.pyval)
        
         except Exception as e:
             self.send_exception(e, severity=ErrorSeverity.NOTIFY)
@@ -354,6 +419,7 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
             pc.setPen(Qt.QPen(color, 0))
             pc.setYAxis(Qwt.QwtPlot.yLeft)
             pc.setPaintAttribute(Qwt.QwtPlotCurve.PaintFiltered)
+            pc.setVisible(not self.raster)
             pc.attach(self)
             self.traces.append(pc)
 
@@ -364,8 +430,24 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         # update Y axis scale
         self.setAxisScale(Qwt.QwtPlot.yLeft, -1.0, len(self.traces), 1.0)
 
-        # update sample buffer
-        self.setTimebase(self.timebase)
+        # move the existing markers to the new bottom margin
+        margin = float(len(self.traces) + 1) / 10.0 / 3.0
+        for marker in self.plot_markers:
+            marker.setYValue(-1.0 + margin)
+
+        # ring buffer and history hold all channels, reset them only if the channels have changed
+        channels = self.eeg.eeg_channels.shape[0]
+        if self.history == None or self.history.channels != channels:
+            self.history = _MinMaxPyramid(channels, self.eeg.sample_rate,
+                                          self.history_length, self.xsize)
+            self.online_cfg.set_history_length(self.history_length)
+            self.setTimebase(self.timebase)
+        else:
+            # show the selected group immediately
+            self.displaybuffer = np.zeros((len(self.traces), self.buffer.shape[1]), 'd')
+            self.display_refresh = False
+            self._transform(slice(None))
+            self.update_display = True
         
     def addPlotMarker(self, xPosition, label, samplecounter):    
         ''' Create and add trigger event marker
@@ -391,59 +473,80 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
     def setDisplay(self):
         ''' Copy all traces from input buffer to display transfer buffer
         '''
-        # select the requested channel group
-        self.channel_group = self.eeg.eeg_channels[self.channel_slice]
-        self.channel_group_properties = self.eeg.channel_properties[self.channel_slice]
+        # the ring buffer holds all channels, the channel group is selected by the display transformation
+        channels = self.eeg.eeg_channels
         
-        # anything to display?
-        if self.channel_group.shape[0] == 0:
+        # channels and ring buffer out of sync, wait for arrangeTraces()
+        if channels.shape[0] == 0 or channels.shape[0] != self.buffer.shape[0]:
             return
-        
-        # calculate downsampling size
-        points = self.channel_group.shape[1]
-        down = int(points / (self.eeg.sample_rate * self.dtX))
-
-        # down sample and copy raw data to ring buffer
-        offset = 0
-        for buf in self.buffer:
-            if self.channel_group.shape[0] > offset:
-                #r = self.rebin(self.channel_group[offset], tuple([down]))
-                r = -self.channel_group[offset][self.binningoffset::self.binning]
-                bufindex = np.arange(self.writePointer, self.writePointer + len(r)) 
-                buf.put(bufindex, r, mode='wrap')
-            offset += 1
-        # down sample and copy sample counter buffer
-        r = self.eeg.sample_channel[0][self.binningoffset::self.binning]
-        bufindex = np.arange(self.writePointer, self.writePointer + len(r)) 
-        self.sc_buffer[0].put(bufindex, r, mode='wrap')
-
-        # update write pointer
-        self.writePointer += len(r)
-        # wrap around occurred?
-        if self.writePointer >= self.buffer.shape[1]:
-            # yes, adjust write pointer
-            while self.writePointer >= self.buffer.shape[1]:
-                self.writePointer -= self.buffer.shape[1]
-
-            # request new baseline values 
-            self.baseline_request = True
-            
-            # and calculate new time axis offset
-            sc = self.eeg.sample_channel[0][self.binningoffset::self.binning]   # down sample the sample counter buffer
-            scLeft = sc[len(sc)-self.writePointer-1] / self.eeg.sample_rate     # sample counter at the leftmost screen position
-            #self.TimeScale.setOffset(scLeft)
-            #self.update()
-
-        # calculate signal baselines for display baseline correction
-        if self.baseline_request and (self.writePointer > 10):
-            self.baseline_request = False
-            self.baselines = np.mean(self.buffer[:,5:10], axis=1).reshape(-1,1)
 
-        # calculate new binning offset
-        self.binningoffset = self.binning - (points - self.binningoffset - (len(r)-1) * self.binning)
+        # update display history
+        self.history.put(-channels, self.eeg.sample_channel[0])
+
+        if self.history_delay > 0:
+            # scrolled back in history, the display is frozen
+            bufindex = slice(0, 0)
+        else:
+            points = channels.shape[1]
+            if self.envelope:
+                # min/max envelope
+                r, sc = self._envelope(channels, self.eeg.sample_channel[0])
+            else:
+                # down sample by picking every binning-th value
+                r = -channels[:, self.binningoffset::self.binning]
+                sc = self.eeg.sample_channel[0][self.binningoffset::self.binning]
+                # calculate new binning offset
+                self.binningoffset = self.binning - (points - self.binningoffset - (len(sc)-1) * self.binning)
+
+            # copy down sampled data and sample counter to ring buffer, all channels at once
+            bufindex = np.arange(self.writePointer, self.writePointer + len(sc)) % self.buffer.shape[1]
+            self.buffer[:, bufindex] = r
+            self.sc_buffer[0, bufindex] = sc
+
+            # update write pointer
+            self.writePointer += len(sc)
+            # wrap around occurred?
+            if self.writePointer >= self.buffer.shape[1]:
+                # yes, adjust write pointer
+                while self.writePointer >= self.buffer.shape[1]:
+                    self.writePointer -= self.buffer.shape[1]
+
+                # request new baseline values 
+                self.baseline_request = True
+
+            # calculate signal baselines for display baseline correction
+            if self.baseline_request and (self.writePointer > 10):
+                self.baseline_request = False
+                self.baselines = np.mean(self.buffer[:,5:10], axis=1).reshape(-1,1)
+                self.display_refresh = True
+
+        # transform the whole ring buffer only if scale or baseline settings have changed,
+        # otherwise only the new columns
+        key = (self.scale, self.online_cfg.checkBoxBaseline.isChecked())
+        if self.display_refresh or key != self.display_key:
+            self.display_refresh = False
+            self.display_key = key
+            self._transform(slice(None))
+        else:
+            self._transform(bufindex)
+        
+        # add EEG marker to marker transfer list
+        if self.history_delay == 0:
+            self.input_markers.extend(self.eeg.markers)
         
-        # normalize and offset ring buffer values
+        # redisplay everything
+        if self.receive_data_available() < 3:
+            self.update_display = True
+
+
+    def _transform(self, columns):
+        ''' Normalize, offset and clip ring buffer values into the display transfer buffer
+        @param columns: ring buffer columns to transform (slice or index array)
+        '''
         channels = len(self.traces)
+        group = self.buffer[self.channel_slice]
+        if channels == 0 or group.shape[0] != channels:
+            return
         bottomMargin = -2.0             # no margin, clip below window
         topMargin = channels + 1.0      # no margin, clip above window
         scale = self.axisScaleDiv(Qwt.QwtPlot.yLeft).range() / self.scale / 10.0
@@ -451,31 +554,65 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         
         # baseline correction
         if self.online_cfg.checkBoxBaseline.isChecked():
-            buffer = (self.buffer - self.baselines) * scale + offset
+            buffer = (group[:, columns] - self.baselines[self.channel_slice]) * scale + offset
         else:
-            buffer = self.buffer * scale + offset
+            buffer = group[:, columns] * scale + offset
 
         # clip to visible area
-        buffer.clip(bottomMargin, topMargin, out=self.displaybuffer)
-        
-        # add EEG marker to marker transfer list
-        self.input_markers.extend(self.eeg.markers)
-        
-        # redisplay everything
-        if self.receive_data_available() < 3:
-            self.update_display = True
-
+        self.displaybuffer[:, columns] = buffer.clip(bottomMargin, topMargin)
+
+    def _envelope(self, data, samplecounter):
+        ''' Get the min/max envelope of the channel data. Each bin of 2 * binning samples
+        is reduced to its minimum and maximum value, so the number of display points
+        is the same as for sample picking.
+        @param data: channel data (channels x samples)
+        @param samplecounter: sample counter values
+        @return: interleaved min/max values (channels x points) and their sample counter values
+        '''
+        # prepend the samples of the incomplete bin from last block
+        if self.envelope_carry != None and self.envelope_carry.shape[0] == data.shape[0]:
+            data = np.hstack((self.envelope_carry, data))
+            samplecounter = np.hstack((self.envelope_sc_carry, samplecounter))
+        width = 2 * self.binning
+        bins = data.shape[1] // width
+        used = bins * width
+        self.envelope_carry = data[:, used:]
+        self.envelope_sc_carry = samplecounter[used:]
+
+        # reduce all channels at once
+        d = -data[:, :used].reshape(data.shape[0], bins, width)
+        r = np.empty((data.shape[0], 2 * bins), data.dtype)
+        r[:, 0::2] = d.min(axis=2)
+        r[:, 1::2] = d.max(axis=2)
+        return r, samplecounter[:used:self.binning]
 
     def timerEvent(self, e):
         ''' Timer event to update display
         '''
+        # show a finished background rendered frame
+        if self.raster:
+            images = self.rasterizer.take_frame()
+            if images != None:
+                t = time.clock()
+                self.raster_item.images = images
+                self.replot()
+                self.blit_time = time.clock() - t
+
         if self.update_display:
+            # skip this frame while the input queue has a backlog
+            # or the last frame is still being rendered
+            if self.receive_data_available() > 1 or \
+               (self.raster and self.rasterizer.busy()):
+                self.frames_skipped += 1
+                return
+
+            t = time.clock()
             # acquire thread lock 
             self._thLock.acquire()
             self.update_display = False
 
             # check color attributes
-            for pccount in xrange(self.channel_group.shape[0]):
+            for pccount in xrange(len(self.traces)):
                 if self.selectedChannel == self.channel_group_properties[pccount].name:
                     color = Qt.Qt.green
                 else:
@@ -486,33 +623,98 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
                     title.setColor(color)
                     self.traces[pccount].setTitle(title)
                     
-            # copy ring buffer to display
-            idx = 0
-            for pc in self.traces:
-                pc.setData(self.xValues, self.displaybuffer[idx])
-                idx += 1
+            if self.raster:
+                # copy display buffer for the rasterizer
+                data = self.displaybuffer.copy()
+                colors = [Qt.QColor(pc.pen().color()) for pc in self.traces]
+            else:
+                # copy ring buffer to display
+                idx = 0
+                for pc in self.traces:
+                    pc.setData(self.xValues, self.displaybuffer[idx])
+                    idx += 1
             
             # add trigger markers
             for marker in self.input_markers:
-                diffpos = np.int64(self.sc_buffer[0] - marker.position)
-                idx = np.abs(diffpos).argmin(0)
+                idx = self._markerIndex(marker.position)
                 self.addPlotMarker(self.xValues[idx], marker.description, marker.position)
             # remove processed markers
             self.input_markers = []
             
-            # remove old markers
-            min_sc = self.sc_buffer[0].min()
-            for marker in self.plot_markers[:]:
-                if marker.sampleCounter < min_sc:
-                    marker.detach()
-                    self.plot_markers.remove(marker)
+            # remove old markers, the oldest sample is at the write pointer position
+            min_sc = self.sc_buffer[0, self.writePointer]
+            while len(self.plot_markers) and self.plot_markers[0].sampleCounter < min_sc:
+                self.plot_markers.popleft().detach()
 
             # release thread lock 
             self._thLock.release()
 
-            t = time.clock()
-            self.replot()
-            displayTime = time.clock() - t
+            if self.raster:
+                # draw the traces in background, the frame is shown by a later timer event
+                xmap = self.canvasMap(Qwt.QwtPlot.xBottom)
+                ymap = self.canvasMap(Qwt.QwtPlot.yLeft)
+                self.rasterizer.render(data, self.xValues, colors, self.canvas().size(),
+                                       (xmap.s1(), xmap.s2(), xmap.p1(), xmap.p2()),
+                                       (ymap.s1(), ymap.s2(), ymap.p1(), ymap.p2()))
+                self._adjustFrameRate(time.clock() - t + self.blit_time)
+            else:
+                self.replot()
+                self._adjustFrameRate(time.clock() - t)
+
+    def _rasterInfo(self):
+        ''' Get the background rendering time as status text
+        '''
+        if not self.raster:
+            return ""
+        return ", %.1fms background rendering"%(self.rasterizer.render_time)
+
+    def _markerIndex(self, position):
+        ''' Get the ring buffer index closest to a sample position.
+        The sample counters are ascending from the write pointer to the end
+        and from the start to the write pointer.
+        @param position: sample counter value
+        @return: ring buffer index
+        '''
+        sc = self.sc_buffer[0]
+        wp = self.writePointer
+        position = np.uint64(position)
+        if wp > 0 and position >= sc[0]:
+            segment, offset = sc[:wp], 0
+        else:
+            segment, offset = sc[wp:], wp
+        idx = segment.searchsorted(position)
+        if idx == len(segment) or (idx > 0 and position - segment[idx-1] < segment[idx] - position):
+            idx -= 1
+        return offset + idx
+
+    def _adjustFrameRate(self, rendertime):
+        ''' Adjust the display update interval to keep the display update time within the CPU budget
+        @param rendertime: time in seconds used for the last display update
+        '''
+        self.render_time = 0.8 * self.render_time + 0.2 * rendertime * 1000.0
+        interval = int(self.render_time * 100.0 / self.display_budget)
+        interval = min(FRAME_INTERVAL_MAX, max(FRAME_INTERVAL_MIN, interval))
+        # restart timer only on significant changes
+        if abs(interval - self.frame_interval) > self.frame_interval / 5:
+            self.killTimer(self.timer_id)
+            self.frame_interval = interval
+            self.timer_id = self.startTimer(self.frame_interval)
+
+        # send effective frame rate and render time
+        self.frames += 1
+        elapsed = time.clock() - self.frame_statustime
+        if elapsed >= FRAME_STATUS_INTERVAL:
+            if self._instance == 0:
+                self.send_event(ModuleEvent(self._object_name,
+                                            EventType.STATUS,
+                                            info = "Display: %.1f fps, %.1fms render time, %d frames skipped%s"%(self.frames / elapsed,
+                                                                                                                   self.render_time,
+                                                                                                                   self.frames_skipped,
+                                                                                                                   self._rasterInfo()),
+                                            status_field = "Display"))
+            self.frames = 0
+            self.frames_skipped = 0
+            self.frame_statustime = time.clock()
     
        
     def setTimebase(self, timebase):
@@ -525,20 +727,33 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         inputsize = self.eeg.sample_rate * self.timebase
         self.binning = max([1,int(inputsize / self.xsize)])
         self.binningoffset = 0
+        self.envelope_carry = None
         
         # calculate new ring buffer size
         self.dtX = self.binning / self.eeg.sample_rate 
         self.xValues = np.arange(0.0, self.timebase, self.dtX)
-        self.buffer = np.zeros((len(self.traces), len(self.xValues)), 'd' ) # channel buffer
+        channels = self.eeg.eeg_channels.shape[0]
+        self.buffer = np.zeros((channels, len(self.xValues)), 'd' )         # channel buffer, all channels
         self.sc_buffer = np.zeros((1, len(self.xValues)), np.uint64 )        # sample counter buffer
-        self.displaybuffer = np.zeros((len(self.traces), len(self.xValues)), 'd' ) # channel display transfer buffer
-        self.baselines = np.zeros((len(self.traces), 1), 'd')                    # baseline correction buffer
+        self.displaybuffer = np.zeros((len(self.traces), len(self.xValues)), 'd' ) # channel group display transfer buffer
+        self.baselines = np.zeros((channels, 1), 'd')                        # baseline correction buffer
         
         # reset buffer pointer
         self.writePointer = 0 
+        self.display_refresh = True
+
+        # show the history at the new timebase
+        self._restoreHistory()
         
-        # request new baseline values
-        self.baseline_request = True
+        if self.history_delay > 0:
+            # frozen display, setDisplay() will not transform the ring buffer
+            self.baselines = np.mean(self.buffer[:,5:10], axis=1).reshape(-1,1)
+            self.display_refresh = False
+            self._transform(slice(None))
+            self.update_display = True
+        else:
+            # request new baseline values
+            self.baseline_request = True
 
         # update X axis scale
         self.grid.setMinPen(Qt.QPen(Qt.Qt.gray, 0, Qt.Qt.DotLine))
@@ -557,12 +772,33 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         # remove all markers
         for marker in self.plot_markers:
             marker.detach()
-        self.plot_markers = []
+        self.plot_markers = deque()
         self.input_markers = []
         
         self.replot()
         
         
+    def _restoreHistory(self):
+        ''' Fill the ring buffer with the min/max envelope from the display history,
+        going back by the selected scroll back delay
+        '''
+        if self.history == None or self.history.samples == 0 or \
+           self.history.channels != self.buffer.shape[0]:
+            return
+        count = self.buffer.shape[1] // 2
+        # don't go back further than a full screen before the oldest sample
+        delay = int(self.history_delay * self.eeg.sample_rate)
+        delay = min(delay, max(0, self.history.available() - 2 * self.binning * count))
+        mn, mx, sc = self.history.get(2 * self.binning, count, delay)
+        n = 2 * mn.shape[1]
+        if n == 0:
+            return
+        self.buffer[:, 0:n:2] = mn
+        self.buffer[:, 1:n:2] = mx
+        self.sc_buffer[0, 0:n:2] = sc
+        self.sc_buffer[0, 1:n:2] = sc + self.binning
+        self.writePointer = n % self.buffer.shape[1]
+
     def setScale(self, scale):
         ''' Change the display scaling
         @param scale: new scale value in µV/Div
@@ -571,6 +807,7 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         ticks = np.arange(0.0, scale*11.0, scale).tolist()
         yScaleDiv = Qwt.QwtScaleDiv(0.0, scale*10.0, [], ticks, [])
         self.plotscale.setScaleDiv(yScaleDiv)
+        self.display_refresh = True
         self.replot()
 
     def onlineCfgChanged(self):
@@ -626,10 +863,52 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
         self._thLock.acquire()
         # use channel values at current write pointer position as new baselines 
         self.baselines = self.buffer[:,self.writePointer].reshape(-1,1)
+        self.display_refresh = True
         # release thread lock 
         self._thLock.release()
         self.onlineCfgChanged()
 
+    def envelopeToggled(self, checked):
+        ''' SIGNAL Min/max envelope on/off
+        '''
+        # acquire thread lock 
+        self._thLock.acquire()
+        self.envelope = checked
+        self.envelope_carry = None
+        # release thread lock 
+        self._thLock.release()
+
+    def rasterToggled(self, checked):
+        ''' SIGNAL Background rendering on/off
+        '''
+        # acquire thread lock 
+        self._thLock.acquire()
+        self.raster = checked
+        if self.raster:
+            if self.rasterizer == None:
+                self.rasterizer = _TraceRasterizer()
+            self.raster_item.attach(self)
+        else:
+            self.raster_item.detach()
+            self.raster_item.images = []
+        for pc in self.traces:
+            pc.setVisible(not self.raster)
+        self.update_display = True
+        # release thread lock 
+        self._thLock.release()
+        self.replot()
+
+    def historyDelayChanged(self, value):
+        ''' SIGNAL Scroll back delay changed, 0 = back to live display
+        '''
+        # acquire thread lock 
+        self._thLock.acquire()
+        self.history_delay = value
+        # refill the ring buffer from history
+        self.setTimebase(self.timebase)
+        # release thread lock 
+        self._thLock.release()
+
     def channelItemClicked(self, plotitem):
         ''' SIGNAL Channel legend clicked
         '''
@@ -645,6 +924,248 @@ class DISP_Scope(Qwt.QwtPlot, ModuleBase):
 
 
 
+class _MinMaxPyramid(object):
+    ''' Multi-resolution min/max history of the display channels.
+    Level k holds minimum and maximum of 2^k consecutive samples in a ring buffer.
+    The levels are updated incrementally, each from the completed bins of the next finer level.
+    '''
+    def __init__(self, channels, sample_rate, history, points):
+        ''' Create the history levels
+        @param channels: number of channels
+        @param sample_rate: sample rate in Hz
+        @param history: history length in seconds
+        @param points: display width in points, minimum number of bins per level
+        '''
+        self.channels = channels
+        self.samples = 0            #: number of samples added
+        self.origin = 0             #: sample counter of the first sample
+        self.levels = []
+        total = max(1, int(history * sample_rate))
+        factor = 1
+        while True:
+            capacity = min(-(-total // factor), 2 * points)
+            self.levels.append(_PyramidLevel(channels, factor, capacity))
+            if factor * capacity >= total:
+                break
+            factor *= 2
+
+    def put(self, data, samplecounter):
+        ''' Add a data block to all levels
+        @param data: channel data (channels x samples)
+        @param samplecounter: sample counter values
+        '''
+        if data.shape[1] == 0:
+            return
+        if self.samples == 0:
+            self.origin = int(samplecounter[0])
+        self.samples += data.shape[1]
+        mn = mx = data
+        for level in self.levels:
+            mn, mx = level.put(mn, mx)
+            if mn.shape[1] == 0:
+                break
+
+    def get(self, binsize, count, delay=0):
+        ''' Get the envelope of consecutive bins, the last bin ends at the newest sample
+        @param binsize: number of samples per bin
+        @param count: number of bins
+        @param delay: number of samples to go back in history
+        @return: min and max values (channels x bins) and the sample counter of each bin.
+        Less than count bins are returned if the history is shorter.
+        '''
+        # the coarsest level with at least 2 level bins per requested bin has the best resolution,
+        # use the next coarser level if its ring buffer doesn't reach back far enough
+        first = 0
+        for idx, l in enumerate(self.levels):
+            if l.factor * 2 <= binsize:
+                first = idx
+        oldest = max(0, self.samples - delay - count * binsize)
+        level = self.levels[-1]
+        for l in self.levels[first:]:
+            if max(0, l.bins - l.capacity) * l.factor <= oldest:
+                level = l
+                break
+        f = level.factor
+        end = level.bins - delay // f
+        edges = end - (count - np.arange(count + 1, dtype=np.int64)) * binsize // f
+        # requested bins within a single level bin repeat that level bin
+        starts = np.minimum(edges[:-1], edges[1:] - 1)
+        # skip bins not available in the level ring buffer
+        skip = np.searchsorted(starts, max(0, level.bins - level.capacity))
+        starts = starts[skip:]
+        if len(starts) == 0:
+            empty = np.zeros((self.channels, 0), np.float32)
+            return empty, empty, np.zeros(0, np.uint64)
+        index = np.arange(starts[0], edges[-1]) % level.capacity
+        mn = np.minimum.reduceat(level.min[:, index], starts - starts[0], axis=1)
+        mx = np.maximum.reduceat(level.max[:, index], starts - starts[0], axis=1)
+        sc = end * f - (count - np.arange(skip, count, dtype=np.int64)) * binsize
+        sc = (self.origin + np.maximum(sc, 0)).astype(np.uint64)
+        return mn, mx, sc
+
+    def available(self):
+        ''' Get the number of samples held by the history
+        '''
+        level = self.levels[-1]
+        return min(self.samples, level.capacity * level.factor)
+
+
+class _PyramidLevel(object):
+    ''' Single level of the min/max history
+    '''
+    def __init__(self, channels, factor, capacity):
+        self.factor = factor        #: samples per bin
+        self.capacity = capacity    #: ring buffer size in bins
+        self.bins = 0               #: number of completed bins
+        self.min = np.zeros((channels, capacity), np.float32)
+        self.max = np.zeros((channels, capacity), np.float32)
+        self.carry_min = None       #: completed bin without partner for the next level
+        self.carry_max = None
+
+    def put(self, mn, mx):
+        ''' Add completed bins and reduce them pairwise for the next level
+        @return: min and max values of the next level bins
+        '''
+        n = mn.shape[1]
+        w = min(n, self.capacity)
+        index = np.arange(self.bins + n - w, self.bins + n) % self.capacity
+        self.min[:, index] = mn[:, n-w:]
+        self.max[:, index] = mx[:, n-w:]
+        self.bins += n
+
+        if self.carry_min is not None:
+            mn = np.hstack((self.carry_min, mn))
+            mx = np.hstack((self.carry_max, mx))
+        even = mn.shape[1] // 2 * 2
+        if even < mn.shape[1]:
+            self.carry_min = mn[:, even:].copy()
+            self.carry_max = mx[:, even:].copy()
+        else:
+            self.carry_min = None
+            self.carry_max = None
+        return (np.minimum(mn[:, 0:even:2], mn[:, 1:even:2]),
+                np.maximum(mx[:, 0:even:2], mx[:, 1:even:2]))
+
+
+class _RasterItem(Qwt.QwtPlotItem):
+    ''' Plot item showing the trace images drawn by the _TraceRasterizer
+    '''
+    def __init__(self):
+        Qwt.QwtPlotItem.__init__(self)
+        self.setZ(20.0)         # same level as the trace curves, below the markers
+        self.images = []
+
+    def draw(self, painter, xMap, yMap, rect):
+        for image in self.images:
+            painter.drawImage(0, 0, image)
+
+
+class _TraceRasterizer(object):
+    ''' Draws the display traces into images by worker threads.
+    The traces are split into channel groups, each group is drawn by its own worker.
+    '''
+    def __init__(self, threads=RASTER_THREADS):
+        self.results = Queue.Queue()
+        self.workers = [_RasterWorker(self.results) for n in range(threads)]
+        self.pending = 0            #: number of outstanding channel group images
+        self.images = []            #: finished channel group images of the current frame
+        self.frame_start = 0.0
+        self.render_time = 0.0      #: time in ms to draw the last frame
+
+    def render(self, data, x, colors, size, xmap, ymap):
+        ''' Start drawing a frame
+        @param data: display buffer copy (channels x points)
+        @param x: x values for each point
+        @param colors: list of trace colors
+        @param size: canvas size
+        @param xmap: x scale map as tuple (s1, s2, p1, p2)
+        @param ymap: y scale map as tuple (s1, s2, p1, p2)
+        '''
+        self.frame_start = time.time()
+        self.images = []
+        self.pending = 0
+        groups = np.array_split(np.arange(data.shape[0]), len(self.workers))
+        for worker, group in zip(self.workers, groups):
+            if len(group) == 0:
+                continue
+            worker.tasks.put((data[group], x, [colors[i] for i in group],
+                              size.width(), size.height(), xmap, ymap))
+            self.pending += 1
+
+    def busy(self):
+        ''' Collect finished channel group images
+        @return: True if the current frame is not finished
+        '''
+        while self.pending > 0:
+            try:
+                image = self.results.get_nowait()
+            except Queue.Empty:
+                return True
+            self.images.append(image)
+            self.pending -= 1
+            if self.pending == 0:
+                self.render_time = (time.time() - self.frame_start) * 1000.0
+        return False
+
+    def take_frame(self):
+        ''' Get the images of a finished frame
+        @return: list of QImage or None if no new frame is available
+        '''
+        if self.busy() or len(self.images) == 0:
+            return None
+        images = self.images
+        self.images = []
+        return images
+
+
+class _RasterWorker(threading.Thread):
+    ''' Worker thread drawing the traces of a channel group
+    '''
+    def __init__(self, results):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.tasks = Queue.Queue()
+        self.results = results
+        self.start()
+
+    def run(self):
+        while True:
+            data, x, colors, width, height, xmap, ymap = self.tasks.get()
+            self.results.put(_rasterize(data, x, colors, width, height, xmap, ymap))
+
+
+def _scale_values(values, scalemap):
+    ''' Vectorized QwtScaleMap.transform()
+    @param scalemap: tuple (s1, s2, p1, p2)
+    '''
+    s1, s2, p1, p2 = scalemap
+    return p1 + (values - s1) * ((p2 - p1) / (s2 - s1))
+
+def _rasterize(data, x, colors, width, height, xmap, ymap):
+    ''' Draw traces into a transparent image
+    @return: QImage
+    '''
+    image = Qt.QImage(width, height, Qt.QImage.Format_ARGB32_Premultiplied)
+    image.fill(0)
+    n = len(x)
+    if n == 0:
+        return image
+    # fill the polygon points directly through the polygon memory
+    polygon = Qt.QPolygonF(n)
+    pointer = polygon.data()
+    pointer.setsize(2 * n * np.dtype(np.float64).itemsize)
+    points = np.frombuffer(pointer, np.float64).reshape(n, 2)
+    points[:, 0] = _scale_values(x, xmap)
+    y = _scale_values(data, ymap)
+    painter = Qt.QPainter(image)
+    for row, color in zip(y, colors):
+        points[:, 1] = row
+        painter.setPen(Qt.QPen(color, 0))
+        painter.drawPolyline(polygon)
+    painter.end()
+    return image
+
+
 class _TimeScaleDraw(Qwt.QwtScaleDraw):
     ''' Draw custom time values for x-axis
     '''
@@ -730,6 +1251,31 @@ class _OnlineCfgPane(Qt.QFrame, frmScopeOnline.Ui_frmScopeOnline):
             self.group_size = 32
         self.checkBoxBaseline.setChecked(False)
         self.pushButton_Now.setEnabled(False)
+
+        # display options
+        self.checkBoxEnvelope = Qt.QCheckBox("Min/Max Envelope", self.groupBox)
+        self.checkBoxEnvelope.setToolTip("Show minimum and maximum values instead of single samples")
+        self.horizontalLayoutOptions = Qt.QHBoxLayout()
+        self.checkBoxRaster = Qt.QCheckBox("Background Rendering", self.groupBox)
+        self.checkBoxRaster.setToolTip("Draw the traces by worker threads, the GUI thread only shows the finished image")
+        self.horizontalLayoutOptions.addWidget(self.checkBoxEnvelope)
+        self.horizontalLayoutOptions.addWidget(self.checkBoxRaster)
+        self.gridLayout_2.addLayout(self.horizontalLayoutOptions, 2, 0, 1, 1)
+
+        # scroll back in the display history
+        self.labelDelay = Qt.QLabel("Scroll Back", self.groupBox)
+        self.spinBoxDelay = Qt.QDoubleSpinBox(self.groupBox)
+        self.spinBoxDelay.setToolTip("Show the display history, the display is frozen until set back to live")
+        self.spinBoxDelay.setDecimals(1)
+        self.spinBoxDelay.setSingleStep(1.0)
+        self.spinBoxDelay.setRange(0.0, 300.0)
+        self.spinBoxDelay.setSuffix(" s")
+        self.spinBoxDelay.setSpecialValueText("Live")
+        self.spinBoxDelay.setKeyboardTracking(False)
+        self.horizontalLayoutDelay = Qt.QHBoxLayout()
+        self.horizontalLayoutDelay.addWidget(self.labelDelay)
+        self.horizontalLayoutDelay.addWidget(self.spinBoxDelay)
+        self.gridLayout_2.addLayout(self.horizontalLayoutDelay, 3, 0, 1, 1)
         
         self.eeg_scale,ok = self.comboBoxScale.currentText().toFloat()
         self.aux_scale = self.eeg_scale
@@ -845,6 +1391,27 @@ class _OnlineCfgPane(Qt.QFrame, frmScopeOnline.Ui_frmScopeOnline):
             self.comboBoxGroupSize.setCurrentIndex(idx)
         return self.get_groupsize()
         
+    def set_history_length(self, length):
+        ''' Limit the scroll back delay to the display history length
+        @param length: history length in seconds
+        '''
+        self.spinBoxDelay.setMaximum(length)
+
+    def set_delay(self, delay):
+        ''' Update scroll back delay without notification
+        @return: selected value
+        '''
+        self.spinBoxDelay.blockSignals(True)
+        self.spinBoxDelay.setValue(delay)
+        self.spinBoxDelay.blockSignals(False)
+        return self.get_delay()
+
+    def get_delay(self):
+        ''' Get current scroll back delay
+        @return: float delay in seconds, 0 = live display
+        '''
+        return self.spinBoxDelay.value()
+
     def get_timebase(self):
         ''' Get current selected timebase value from combobox
         @return: float timebase
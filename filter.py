@@ -53,6 +53,9 @@ class FLT_Eeg(ModuleBase):
         self.data = None
         self.dataavailable = False
         self.params = None
+        self.input_properties_version = None    # version id of the last shared input channel properties
+        self.output_properties = None           # shared output channel properties with our filter configuration
+        self.output_properties_version = 0
         
         self.notchFilter = []           # notch filter array
         self.lpFilter = []              # lowpass filter array
@@ -134,6 +137,9 @@ class FLT_Eeg(ModuleBase):
             self.params = params
             
 
+        # filter configuration may have changed, recreate the shared output channel properties
+        self.input_properties_version = None
+
         # reset filter
         self.samplefreq = params.sample_rate
         self.lpFilter = []
@@ -213,10 +219,17 @@ class FLT_Eeg(ModuleBase):
             return
 
         # replace channel filter configuration within the data block with our modified configuration
-        for channel in range(len(self.data.channel_properties)):
-            self.data.channel_properties[channel].lowpass = self.params.channel_properties[channel].lowpass
-            self.data.channel_properties[channel].highpass = self.params.channel_properties[channel].highpass
-            self.data.channel_properties[channel].notchfilter = self.params.channel_properties[channel].notchfilter
+        if self.data.properties_version == 0:
+            self._set_filter_properties(self.data.channel_properties)
+        else:
+            # shared properties, create our configuration once for each input version
+            if self.data.properties_version != self.input_properties_version:
+                self.output_properties = copy.deepcopy(self.data.channel_properties)
+                self._set_filter_properties(self.output_properties)
+                self.output_properties_version = share_channel_properties(self.output_properties)
+                self.input_properties_version = self.data.properties_version
+            self.data.channel_properties = self.output_properties
+            self.data.properties_version = self.output_properties_version
         
         # highpass filter
         for flt in self.hpFilter:
@@ -238,6 +251,15 @@ class FLT_Eeg(ModuleBase):
             
             
     
+    def _set_filter_properties(self, properties):
+        ''' Replace the filter configuration of channel properties with our configuration
+        @param properties: modifiable channel property array
+        '''
+        for channel in range(len(properties)):
+            properties[channel].lowpass = self.params.channel_properties[channel].lowpass
+            properties[channel].highpass = self.params.channel_properties[channel].highpass
+            properties[channel].notchfilter = self.params.channel_properties[channel].notchfilter
+
     def process_output(self):
         if not self.dataavailable:
             return None
@@ -390,8 +412,7 @@ class _ConfigurationPane(Qt.QFrame, frmFilterConfig.Ui_frmFilterConfig):
         ''' Create and fill channel tables
         '''
         # AUX channel table
-        mask = lambda x: x.group != ChannelGroup.EEG
-        ch_map = np.array(map(mask, self.filter.params.channel_properties))
+        ch_map = channel_table(self.filter.params.channel_properties)["group"] != ChannelGroup.EEG
         ch_indices = np.nonzero(ch_map)[0]     
         self.table_model = _ConfigTableModel(self.filter.params.channel_properties[ch_indices])
         self.tableView.setModel(self.table_model)
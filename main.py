@@ -35,6 +35,8 @@ B{Default Module Configuration:}
 								- L{Configuration Pane<storage._ConfigurationPane>}
 								- L{Online Configuration Pane<storage._OnlineCfgPane>}
 						- Remote Data Access Server L{RDA_Server}
+						- Shared Memory Output L{SHM_Output}
+						- Remote Data Access Aggregator L{RDA_Aggregator}
 						- Digital Filter (Low-Cut, High-Cut and Notch) L{FLT_Eeg}
 								- L{Configuration Pane<filter._ConfigurationPane>}
 						- Impedance Display Dialog L{IMP_Display}
@@ -136,6 +138,8 @@ from impedance import IMP_Display
 from display import DISP_Scope
 from rda_server import RDA_Server
 from rda_client import RDA_Client
+from shm_output import SHM_Output
+from rda_aggregator import RDA_Aggregator
 from montage import MNT_Recording
 from modbase import *
 
@@ -162,6 +166,12 @@ def InstantiateModules(run_as):
 									 FLT_Eeg(),
 									 IMP_Display(),
 									 DISP_Scope(instance=0)]
+		elif 'RM' in run_as:
+				# run as merging client of several remote servers
+				modules = [RDA_Aggregator(),
+									 TRG_Eeg(),
+									 FLT_Eeg(),
+									 DISP_Scope(instance=0)]
 		else:
 				# run as actiCHamp recorder
 				modules = [AMP_ActiChamp(),
@@ -174,6 +184,9 @@ def InstantiateModules(run_as):
 									 IMP_Display(),
 									 DISP_Scope(instance=0)
 									 ]
+				if 'SM' in run_as:
+						# publish the data into a shared memory ring buffer for local consumers
+						modules.insert(7, SHM_Output())
 		return modules
 
 
@@ -662,14 +675,14 @@ class MainWindow(Qt.QMainWindow, frmMain.Ui_MainWindow):
 								cmd_value = ""
 
 						# check for supported commands
-						if cmd not in ["1", "2", "3", "4", "M", "I", "S", "Q", "X", "F"]:
+						if cmd not in ["1", "2", "3", "4", "M", "I", "S", "Q", "X", "F", "G"]:
 								error_message = u"command not supported: '%s'"%(cmd_string)
 
 						# check the recording state and if the requested command can be applied
 						elif cmd in ["S", "I", "M", "X", "Q"] and self.topmodule.isRunning() and not self.RC.remoteRecording:
 								error_message = u"recording is in progress and was not started remote: '%s'"%(cmd_string)
 
-						elif cmd not in ["Q", "X"] and not self.topmodule.query("RemoteStop"):
+						elif cmd not in ["Q", "X", "G"] and not self.topmodule.query("RemoteStop"):
 								error_message = u"recording is still in progress, stop it first with 'X': '%s'"%(cmd_string)
 
 						elif cmd in ["1", "2", "3", "4"] and self.topmodule.isRunning():
@@ -740,6 +753,12 @@ class MainWindow(Qt.QMainWindow, frmMain.Ui_MainWindow):
 																						EventType.COMMAND,
 																						info="StopSaving"))
 
+						# Trigger event-gated recording
+						elif cmd == "G":
+								self.sendEvent(ModuleEvent("RemoteControl",
+																						EventType.COMMAND,
+																						info="GateTrigger"))
+
 						# enable / disable feedback
 						elif cmd == "F":
 								self.RC.feedbackEnabled = (cmd_value == "1")
@@ -1167,6 +1186,8 @@ class StatusBarWidget(Qt.QWidget, frmMainStatusBar.Ui_frmStatusBar):
 								self.labelStatus_4.setPalette(palette)
 						elif event.status_field == "Utilization":
 								self.updateUtilization(event.info)
+						elif event.status_field == "Display":
+								self.progressBarUtilization.setToolTip(event.info)
 						return
 
 				# lock an error display until LogView is shown
@@ -38,6 +38,7 @@ import time
 import datetime
 import Queue
 import threading
+import itertools
 import copy
 import os, sys, traceback
 from lxml import etree
@@ -146,10 +147,17 @@ class ChannelGroup:
 class EEG_ChannelProperties(object):
     ''' Properties of EEG channels
     '''
+    # no instance dictionary, property arrays hold one object per channel
+    __slots__ = ("xmlVersion", "input", "inputgroup", "enable", "name", "refname", "group",
+                 "lowpass", "highpass", "notchfilter", "isReference", "color", "unit",
+                 "_frozen")
+
     def __init__(self, name):
         ''' Set default property values
         @param name: channel label
         '''
+        object.__setattr__(self, "_frozen", False)  #: shared and read-only, see L{share_channel_properties}
+
         # XML parameter version
         # 1: initial version
         # 2: added notchfilter and reference
@@ -169,6 +177,32 @@ class EEG_ChannelProperties(object):
         self.color = Qt.Qt.darkBlue         #: display color
         self.unit = ""                      #: channel unit string (use uV if empty)
         
+    def __setattr__(self, name, value):
+        ''' Shared channel properties are read-only, see L{share_channel_properties}
+        '''
+        if self._frozen:
+            raise Exception, "channel %s: shared channel properties are read-only"%(self.name)
+        object.__setattr__(self, name, value)
+
+    def __copy__(self):
+        ''' Copies are always modifiable, even if this object is shared
+        '''
+        copy_obj = self.__class__.__new__(self.__class__)
+        for key in EEG_ChannelProperties.__slots__:
+            object.__setattr__(copy_obj, key, getattr(self, key))
+        object.__setattr__(copy_obj, "_frozen", False)
+        return copy_obj
+
+    def __deepcopy__(self, memo):
+        ''' Deep copies are always modifiable, even if this object is shared
+        '''
+        copy_obj = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copy_obj
+        for key in EEG_ChannelProperties.__slots__:
+            object.__setattr__(copy_obj, key, copy.deepcopy(getattr(self, key), memo))
+        object.__setattr__(copy_obj, "_frozen", False)
+        return copy_obj
+
     def __cmp__(self, other):
         ''' Compare two channels by name and group
         @param other: channel to compare with
@@ -230,6 +264,28 @@ class EEG_ChannelProperties(object):
             self.inputgroup = self.group
 
 
+#: fields of the columnar channel property table, named like the EEG_ChannelProperties attributes
+CHANNEL_TABLE_DTYPE = np.dtype([("input", np.int32),
+                                ("inputgroup", np.int8),
+                                ("group", np.int8),
+                                ("enable", np.bool_),
+                                ("isReference", np.bool_),
+                                ("lowpass", np.float64),
+                                ("highpass", np.float64),
+                                ("notchfilter", np.bool_),
+                                ("name", object)])
+
+def channel_table(properties):
+    ''' Get channel properties as columnar table for vectorized channel selections, e.g.
+    np.nonzero((table["group"] == ChannelGroup.EEG) & table["enable"])[0]
+    @param properties: sequence of EEG_ChannelProperties objects
+    @return: numpy structured array with CHANNEL_TABLE_DTYPE fields, one row per channel
+    '''
+    return np.array([(ch.input, ch.inputgroup, ch.group, ch.enable, ch.isReference,
+                      ch.lowpass, ch.highpass, ch.notchfilter, ch.name) for ch in properties],
+                    dtype=CHANNEL_TABLE_DTYPE)
+
+
 class EEG_Marker(object):
     ''' Recording marker position and description
     '''
@@ -245,6 +301,22 @@ class EEG_Marker(object):
         self.date = date                #: If true, write date / time to file
              
 
+#: version ids of shared channel property arrays
+_channel_property_versions = itertools.count(1)
+
+def share_channel_properties(properties):
+    ''' Make a channel property array read-only for sharing by reference between data blocks.
+    Neither the array nor its EEG_ChannelProperties objects can be modified afterwards,
+    changes need a (deep) copy and a new version id.
+    @param properties: numpy array of EEG_ChannelProperties objects
+    @return: new version id
+    '''
+    for ch in properties:
+        object.__setattr__(ch, "_frozen", True)
+    properties.flags.writeable = False
+    return _channel_property_versions.next()
+
+
 class EEG_DataBlock(object):
     ''' Block of EEG data, channel properties, marker and impedance values 
     '''
@@ -266,9 +338,11 @@ class EEG_DataBlock(object):
         self.performance_timer_max = 0      #: maximum module processing time for this block
         self.recording_mode = RecordingMode.NORMAL #: recording mode of this block
         self.ref_channel_name = ""          #: combined name of reference channels
+        self.properties_version = 0         #: version id of shared channel properties, 0 = private properties
 
     def __copy__(self):
-        ''' We always need a deep copy of channel properties, markers and impedance values
+        ''' We always need a deep copy of channel properties, markers and impedance values.
+        Shared channel properties are read-only and passed by reference.
         '''
         copy_obj = EEG_DataBlock(1,1)
         copy_obj.sample_counter = self.sample_counter
@@ -276,7 +350,11 @@ class EEG_DataBlock(object):
         copy_obj.eeg_channels = self.eeg_channels
         copy_obj.trigger_channel = self.trigger_channel
         copy_obj.sample_channel = self.sample_channel
-        copy_obj.channel_properties = copy.deepcopy(self.channel_properties)
+        if self.properties_version:
+            copy_obj.channel_properties = self.channel_properties
+        else:
+            copy_obj.channel_properties = copy.deepcopy(self.channel_properties)
+        copy_obj.properties_version = self.properties_version
         copy_obj.markers = copy.deepcopy(self.markers)
         copy_obj.impedances = copy.deepcopy(self.impedances)
         copy_obj.block_time = copy.deepcopy(self.block_time)
@@ -286,6 +364,32 @@ class EEG_DataBlock(object):
         copy_obj.ref_channel_name = self.ref_channel_name
         return copy_obj 
 
+    def __deepcopy__(self, memo):
+        ''' Deep copy of all values, except shared channel properties
+        '''
+        copy_obj = EEG_DataBlock.__new__(EEG_DataBlock)
+        memo[id(self)] = copy_obj
+        for key, value in self.__dict__.items():
+            if key == "channel_properties" and self.properties_version:
+                copy_obj.__dict__[key] = value
+            else:
+                copy_obj.__dict__[key] = copy.deepcopy(value, memo)
+        return copy_obj
+
+    def share_properties(self):
+        ''' Share the current channel properties by reference with all copies of this block
+        @return: new version id
+        '''
+        self.properties_version = share_channel_properties(self.channel_properties)
+        return self.properties_version
+
+    def unshare_properties(self):
+        ''' Replace shared channel properties by a private, modifiable copy
+        '''
+        if self.properties_version:
+            self.channel_properties = copy.deepcopy(self.channel_properties)
+            self.properties_version = 0
+
     def __cmp__(self, other):
         ''' Compare settings of two data blocks
         '''
@@ -459,7 +563,11 @@ class ModuleBase(Qt.QObject):
         if not propagate_only:
             # let derived class objects process parameter update
             try:
-                params = self.process_update(copy.copy(params))
+                params = copy.copy(params)
+                if params != None:
+                    # modules may change the channel properties during update, keep the shared ones untouched
+                    params.unshare_properties()
+                params = self.process_update(params)
             except Exception as e:
                 self.send_exception(e, ErrorSeverity.STOP)
                 return
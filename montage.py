@@ -37,6 +37,7 @@ import textwrap
 
 from modbase import *
 from tools.modview import GenericTableWidget
+from tools.linearmontage import LinearMontage, bipolar, common_average, laplacian, weight_matrix
 
 
 class MNT_Recording(ModuleBase):
@@ -52,7 +53,8 @@ class MNT_Recording(ModuleBase):
 
         # XML parameter version
         # 1: initial version
-        self.xmlVersion = 1 
+        # 2: added derivations
+        self.xmlVersion = 2 
 
         # initialize module variables
         self.data = None                # hold the data block we got from previous module
@@ -60,7 +62,12 @@ class MNT_Recording(ModuleBase):
         self.current_input_params = None         # backup of last received properties
         
         self.montage_channel_properties = np.array([])
+        self.output_channel_properties = np.array([])
+        self.output_properties_version = 0     # version id of the shared output channel properties
         self.montage = Montage()
+        self.montage_op = LinearMontage(0)      # compiled reference subtraction, output selection and derivations
+        self.derivations = []                   # linear derivations of the output channels
+        self.keepDerivationInputs = True        # output the montage channels in front of the derived channels
         
         self.hideRefChannels = True     # always hide or show reference channels
         self.refChannelNames = "none"
@@ -73,6 +80,8 @@ class MNT_Recording(ModuleBase):
         '''
         self.needs_conversion = True
         self.montage.reset()
+        self.derivations = []
+        self.keepDerivationInputs = True
 
     def getMontageList(self):
         return self.montage.get_configuration_table(self.current_input_params.channel_properties)
@@ -105,32 +114,39 @@ class MNT_Recording(ModuleBase):
         ''' Create index arrays for module data output 
         '''
         properties = params.channel_properties
+        table = channel_table(properties)
+        eeg_map = table["group"] == ChannelGroup.EEG
+        ref_map = eeg_map & table["isReference"]
         
         # get all active eeg channel indices (excluding reference channels)
-        mask = lambda x: (x.group == ChannelGroup.EEG) and x.enable and not x.isReference
-        channel_map = np.array(map(mask, properties))
+        channel_map = eeg_map & table["enable"] & ~table["isReference"]
         self.eeg_indices = np.nonzero(channel_map)[0]     # indices of all eeg channels
 
         # get the reference channel indices
-        mask = lambda x: (x.group == ChannelGroup.EEG) and x.isReference
-        channel_map = np.array(map(mask, properties))
-        self.ref_indices = np.nonzero(channel_map)[0]     # indices of reference channel(s)
+        self.ref_indices = np.nonzero(ref_map)[0]     # indices of reference channel(s)
         
         # get output channel indices, depending on recording mode
         if params.recording_mode == RecordingMode.IMPEDANCE or params.recording_mode == RecordingMode.TEST:
             # get all enabled channel indices, including reference channels
-            mask = lambda x: (x.enable == True) or ((x.group == ChannelGroup.EEG) and x.isReference)
+            channel_map = table["enable"] | ref_map
         else:
             if self.hideRefChannels:
                 # get all enabled channel indices, excluding reference channels
-                mask = lambda x: (x.enable == True) and not ((x.group == ChannelGroup.EEG) and x.isReference)
+                channel_map = table["enable"] & ~ref_map
             else:
                 # get all enabled channel indices, including enabled reference channels
-                mask = lambda x: (x.enable == True)
+                channel_map = table["enable"]
                 
-        channel_map = np.array(map(mask, properties))
         self.output_channel_indices = np.nonzero(channel_map)[0]     # indices of all enabled channels
 
+        # compile reference subtraction and output selection into a single operator
+        if params.recording_mode == RecordingMode.IMPEDANCE or params.recording_mode == RecordingMode.TEST:
+            ref_indices = []
+        else:
+            ref_indices = self.ref_indices
+        self.montage_op = LinearMontage(len(properties), self.output_channel_indices, 
+                                        ref_indices, self.eeg_indices)
+
         # append "REF" to the reference channel name and create the combined reference channel name
         refnames = []
         for prop in properties[self.ref_indices]:
@@ -162,6 +178,40 @@ class MNT_Recording(ModuleBase):
         else:
             self.refChannelNames = "none"
 
+    def _create_derivations(self, params):
+        ''' Append the derived channels to the output channels and
+        combine the derivation weights with the montage operator
+        '''
+        if len(self.derivations) == 0:
+            return
+        if params.recording_mode == RecordingMode.IMPEDANCE or params.recording_mode == RecordingMode.TEST:
+            return
+
+        weights = []
+        properties = []
+        for derivation in self.derivations:
+            try:
+                w, derived = derivation.compile(self.output_channel_properties)
+            except Exception as e:
+                self.send_exception(e, severity=ErrorSeverity.NOTIFY)
+                continue
+            weights.append(w)
+            for name, refname, source in derived:
+                prop = copy.copy(self.output_channel_properties[source])
+                prop.name = name
+                prop.refname = refname
+                prop.enable = True
+                prop.isReference = False
+                properties.append(prop)
+        if len(weights) == 0:
+            return
+
+        # a single sparse-dense product per block for the montage and all derivations
+        self.montage_op = self.montage_op.derive(weights, self.keepDerivationInputs)
+        if self.keepDerivationInputs:
+            properties = list(self.output_channel_properties) + properties
+        self.output_channel_properties = np.array(properties)
+
     def _validateChannelLabels(self):
         # search for duplicate channel labels
         labelList = [ch.name.lower() for ch in self.output_channel_properties if ch.enable ]
@@ -185,14 +235,16 @@ class MNT_Recording(ModuleBase):
         # select output channels
         self._create_output_selection(params)
         self.output_channel_properties = np.array(params.channel_properties)[self.output_channel_indices]
+        self._create_derivations(params)
         params.channel_properties = copy.deepcopy(self.output_channel_properties)
+        self.output_properties_version = share_channel_properties(self.output_channel_properties)
         if params.eeg_channels.size > 0:
-            params.eeg_channels = params.eeg_channels[self.output_channel_indices]
+            params.eeg_channels = self.montage_op.apply(params.eeg_channels)
 
         # send number of enabled channels for status display
         self.send_event(ModuleEvent(self._object_name,
                                     EventType.STATUS,
-                                    info = "%d ch"%(len(self.output_channel_indices)),
+                                    info = "%d ch"%(len(self.output_channel_properties)),
                                     status_field="Channels"))
 
         # send reference channel names for status display
@@ -245,21 +297,12 @@ class MNT_Recording(ModuleBase):
         self.dataavailable = True       # signal data availability
         self.data = datablock           # get a local reference
 
-        if datablock.recording_mode != RecordingMode.IMPEDANCE and datablock.recording_mode != RecordingMode.TEST:
-            # average and subtract the reference channels
-            if self.ref_indices.size > 0:
-                # average reference channels
-                reference = np.mean(self.data.eeg_channels[self.ref_indices], 0)
-                # subtract reference
-                self.data.eeg_channels[self.eeg_indices] -= reference
-    
-        # simple copy is three times faster than deepcopy
-        #self.data.channel_properties = copy.deepcopy(self.output_channel_properties)
-        self.data.channel_properties = self.output_channel_properties.copy()
-        for idx in range(self.data.channel_properties.size):
-            self.data.channel_properties[idx] = copy.copy(self.output_channel_properties[idx])
+        # output channel properties change with process_update only, share them by reference
+        self.data.channel_properties = self.output_channel_properties
+        self.data.properties_version = self.output_properties_version
         
-        self.data.eeg_channels = self.data.eeg_channels[self.output_channel_indices]
+        # average and subtract the reference channels and select the output channels in a single pass
+        self.data.eeg_channels = self.montage_op.apply(self.data.eeg_channels)
 
 
     
@@ -297,6 +340,13 @@ class MNT_Recording(ModuleBase):
         try:
             # setup montage channel configuration from xml
             self.montage.setXML(cfg)
+            # linear derivations
+            if version > 1:
+                self.keepDerivationInputs = cfg.Derivations.keepchannels.pyval
+                for d in cfg.Derivations.iterchildren(tag="derivation"):
+                    derivation = Derivation()
+                    derivation.setXML(d)
+                    self.derivations.append(derivation)
         except Exception as e:
             self.send_exception(e, severity=ErrorSeverity.NOTIFY)
 
@@ -309,7 +359,10 @@ class MNT_Recording(ModuleBase):
             raise Exception("configuration contains duplicate channel names")
         E = objectify.E
         channels = self.montage.getXML()
+        derivations = E.Derivations(E.keepchannels(self.keepDerivationInputs),
+                                    *[d.getXML() for d in self.derivations])
         montage = E.MNT_Recording( channels, 
+                                   derivations,
                                    version=str(self.xmlVersion),
                                    instance=str(self._instance),
                                    module="montage")
@@ -415,6 +468,132 @@ class Montage():
         return channels
 
 
+class DerivationType():
+    ''' Linear derivation types
+    @ivar BIPOLAR: difference of two channels
+    @ivar CAR: channels minus the common average
+    @ivar LAPLACIAN: center channel minus the average of its neighbours
+    @ivar CUSTOM: weighted sum of channels
+    '''
+    (BIPOLAR, CAR, LAPLACIAN, CUSTOM) = range(4)
+    Name = ["bipolar", "car", "laplacian", "custom"]
+
+
+class Derivation():
+    ''' Linear derivation of recording montage output channels
+    '''
+    def __init__(self, type=DerivationType.BIPOLAR, name="", channels=[], weights=[]):
+        ''' Create a derivation
+        @param type: DerivationType
+        @param name: output channel label, name suffix for CAR, empty = automatic label
+        @param channels: input channel labels, 
+        BIPOLAR: positive and negative channel, 
+        CAR: channels to re-reference, empty = all EEG channels,
+        LAPLACIAN: center channel followed by the neighbours,
+        CUSTOM: weighted channels
+        @param weights: CUSTOM: channel weights, LAPLACIAN: optional neighbour weights
+        '''
+        # XML parameter version
+        # 1: initial version
+        self.xmlVersion = 1
+
+        self.type = type
+        self.name = name
+        self.channels = list(channels)
+        self.weights = list(weights)
+
+    def _label(self):
+        return self.name or DerivationType.Name[self.type]
+
+    def compile(self, properties):
+        ''' Get the weight matrix and the output channels
+        @param properties: channel properties of the recording montage output channels
+        @return: sparse weight matrix (derived channels x input channels), 
+        list of (label, reference name, index of the property source channel)
+        '''
+        inputs = len(properties)
+        labels = {}
+        for idx, ch in enumerate(properties):
+            labels.setdefault(ch.name.strip().lower(), idx)
+        missing = [c for c in self.channels if c.strip().lower() not in labels]
+        if len(missing):
+            raise Exception("Derivation %s: channel %s not available"%(self._label(), ", ".join(missing)))
+        indices = [labels[c.strip().lower()] for c in self.channels]
+        
+        if self.type == DerivationType.BIPOLAR:
+            if len(indices) != 2:
+                raise Exception("Derivation %s: bipolar derivations need two channels"%(self._label()))
+            name = self.name or "%s-%s"%(self.channels[0], self.channels[1])
+            return bipolar([indices], inputs), [(name, self.channels[1], indices[0])]
+        
+        if self.type == DerivationType.CAR:
+            if len(indices) == 0:
+                indices = [idx for idx, ch in enumerate(properties) 
+                           if ch.group == ChannelGroup.EEG and not ch.isReference]
+            if len(indices) < 2:
+                raise Exception("Derivation %s: common average needs at least two channels"%(self._label()))
+            suffix = self.name or "CAR"
+            derived = [("%s_%s"%(properties[idx].name, suffix), "CAR", idx) for idx in indices]
+            return common_average(indices, inputs), derived
+        
+        if self.type == DerivationType.LAPLACIAN:
+            if len(indices) < 2:
+                raise Exception("Derivation %s: Laplacian needs a center channel and neighbours"%(self._label()))
+            weights = None
+            if len(self.weights):
+                if len(self.weights) != len(indices) - 1:
+                    raise Exception("Derivation %s: one weight per neighbour required"%(self._label()))
+                weights = self.weights
+            name = self.name or "%s_Lap"%(self.channels[0])
+            refname = "AVG(" + "+".join(self.channels[1:]) + ")"
+            return laplacian(indices[0], indices[1:], inputs, weights), [(name, refname, indices[0])]
+        
+        if self.type == DerivationType.CUSTOM:
+            if len(indices) == 0 or len(self.weights) != len(indices):
+                raise Exception("Derivation %s: one weight per channel required"%(self._label()))
+            row = {}
+            for idx, w in zip(indices, self.weights):
+                row[idx] = row.get(idx, 0.0) + w
+            name = self.name or "Custom"
+            return weight_matrix([row], inputs), [(name, "", indices[0])]
+        
+        raise Exception("Derivation %s: unknown type"%(self._label()))
+
+    def setXML(self, xml):
+        ''' Setup derivation from XML configuration file
+        @param xml: objectify XML derivation configuration
+        '''
+        # check version, has to be lower or equal than current version
+        version = xml.get("version")
+        if (version == None) or (int(version) > self.xmlVersion):
+            raise Exception, "derivation wrong version > %d"%(self.xmlVersion)
+        version = int(version)
+        
+        # get the values
+        self.type = DerivationType.Name.index(str(xml.type.text).strip().lower())
+        self.name = (xml.name.text or "").strip()
+        self.channels = [c.strip() for c in (xml.channels.text or "").split(",") if c.strip()]
+        self.weights = [float(w) for w in (xml.weights.text or "").split(",") if w.strip()]
+
+    def getXML(self):
+        ''' Get derivation for XML configuration file
+        @return: objectify XML element::
+            <derivation version="1">
+                <type>bipolar</type>
+                <name>Fp1-F3</name>
+                <channels>Fp1,F3</channels>
+                <weights></weights>
+            </derivation>
+        '''
+        E = objectify.E
+        d = E.derivation(E.type(DerivationType.Name[self.type]),
+                         E.name(self.name),
+                         E.channels(",".join(self.channels)),
+                         E.weights(",".join(["%g"%w for w in self.weights])))
+        d.attrib["version"] = str(self.xmlVersion)
+        return d
+
+
 
 
 
@@ -0,0 +1,662 @@
+# -*- coding: utf-8 -*-
+'''
+Remote Data Access (RDA) Aggregator Module
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Receives the data streams of several RDA servers and merges them into one
+stream, the channels of all servers are concatenated in the configured
+server order.
+
+A single event loop thread serves all server connections. The streams start
+aligned at their first block after the merged start, the following blocks are
+placed by their block numbers, missing blocks are filled with zeros. If a sync
+marker description is configured, the streams are shifted so that the sync
+markers of all servers are at the same merged sample position. A stream
+lagging more than the jitter window behind the others is filled with zeros
+so the merged output never waits longer than the window.
+
+Test against local stand-ins::
+
+    python -m tools.rdastandin --ports 51244,51245 --delay 0,0.3
+    python main.py -r RM
+
+@version: 1.0
+'''
+
+from modbase import *
+from socket import *
+from select import *
+from struct import *
+from binascii import unhexlify
+import errno
+import collections
+
+from rda_client import RDAMessageType, _MSG_GUID
+
+#: interval for reconnection attempts in seconds
+RECONNECT_INTERVAL = 1.0
+#: maximum time for a connection attempt in seconds
+CONNECT_TIMEOUT = 2.0
+#: interval for buffering latency reports in seconds
+REPORT_INTERVAL = 10.0
+
+_HEADER = Struct("<16sLL")
+_WOULDBLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK))
+_INPROGRESS = (errno.EINPROGRESS, errno.EALREADY, getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK))
+
+
+class _ConnectionState:
+    DISCONNECTED = 0
+    CONNECTING = 1
+    CONNECTED = 2
+
+
+class _ServerMessage(object):
+    ''' Control message from the event loop to the main thread
+    '''
+    def __init__(self, index, type):
+        self.index = index      #: server index
+        self.type = type        #: RDAMessageType
+
+
+class _StreamBlock(object):
+    ''' Decoded data message of a single server
+    '''
+    def __init__(self, index, block, data, markers):
+        self.index = index      #: server index
+        self.block = block      #: block number
+        self.data = data        #: channel data (channels, points) in µV
+        self.markers = markers  #: list of EEG_Marker, position relative to the block
+        self.time = time.time() #: time of arrival
+
+
+class _ServerConnection(object):
+    ''' Non-blocking connection to a single RDA server
+    '''
+    def __init__(self, index, host, port):
+        self.index = index
+        self.addr = (host, port)
+        self.sock = None
+        self.state = _ConnectionState.DISCONNECTED
+        self.timer = 0.0            #: next connection attempt or connection timeout
+        self.header = bytearray(_HEADER.size)
+        self.buffer = memoryview(self.header)   #: buffer of the message part being received
+        self.received = 0
+        self.data = None            #: data buffer of the message being received
+        self.type = 0
+        # stream configuration from the START message
+        self.started = False
+        self.channels = 0
+        self.sample_rate = 0.0
+        self.resolutions = None
+        self.names = []
+
+    def name(self):
+        return "%s:%d"%self.addr
+
+    def connect(self):
+        ''' Start a non-blocking connection attempt
+        '''
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.setblocking(0)
+        err = self.sock.connect_ex(self.addr)
+        if err == 0:
+            self.state = _ConnectionState.CONNECTED
+        elif err in _INPROGRESS:
+            self.state = _ConnectionState.CONNECTING
+            self.timer = time.time() + CONNECT_TIMEOUT
+        else:
+            self.close()
+
+    def connected(self):
+        ''' Check the result of a connection attempt, the socket is writable
+        @return: True if connected
+        '''
+        if self.sock.getsockopt(SOL_SOCKET, SO_ERROR) == 0:
+            self.state = _ConnectionState.CONNECTED
+            self.buffer = memoryview(self.header)
+            self.received = 0
+            self.data = None
+            return True
+        self.close()
+        return False
+
+    def close(self):
+        if self.sock != None:
+            self.sock.close()
+            self.sock = None
+        self.state = _ConnectionState.DISCONNECTED
+        self.started = False
+        self.timer = time.time() + RECONNECT_INTERVAL
+
+    def receive(self):
+        ''' Receive available data
+        @return: list of complete messages (type, data) or None if the connection is closed
+        '''
+        messages = []
+        try:
+            nbytes = self.sock.recv_into(self.buffer[self.received:])
+            if nbytes == 0:
+                return None
+        except Exception as e:
+            if getattr(e, "errno", None) in _WOULDBLOCK:
+                return messages
+            return None
+        self.received += nbytes
+        if self.received == len(self.buffer):
+            self.received = 0
+            if self.data == None:
+                guid, size, self.type = _HEADER.unpack_from(self.header)
+                if guid != unhexlify(_MSG_GUID):
+                    return None
+                if size > _HEADER.size:
+                    self.data = bytearray(size - _HEADER.size)
+                    self.buffer = memoryview(self.data)
+                else:
+                    messages.append((self.type, ""))
+            else:
+                messages.append((self.type, self.data))
+                self.data = None
+                self.buffer = memoryview(self.header)
+        return messages
+
+
+class _StreamState(object):
+    ''' Alignment state of a single server stream
+    '''
+    def __init__(self, channels):
+        self.channels = channels
+        self.offset = 0         #: merged position of the first stream sample
+        self.position = 0       #: received stream samples, including missing blocks
+        self.block = None       #: last block number
+        self.chunks = collections.deque()   #: [merged position, data, time of arrival]
+        self.end = 0            #: merged position behind the last chunk
+        self.markers = []       #: list of (merged position, EEG_Marker)
+        self.sync = None        #: merged position of the last unmatched sync marker
+        self.missing = 0        #: points of missing blocks
+
+    def shift(self, delta):
+        ''' Move the stream relative to the merged stream
+        @param delta: shift in points
+        '''
+        self.offset += delta
+        self.end += delta
+        for chunk in self.chunks:
+            chunk[0] += delta
+        self.markers = [(position + delta, marker) for position, marker in self.markers]
+
+
+class RDA_Aggregator(ModuleBase):
+    ''' Receive and merge the EEG data of several RDA servers
+    '''
+
+    def __init__(self, *args, **keys):
+        ''' Initialize module and create the event loop thread
+        '''
+        ModuleBase.__init__(self, name="RDA Aggregator", **keys)
+        self.dataavailable = False
+        self.data = EEG_DataBlock(0, 0)
+
+        # XML parameter version
+        # 1: initial version
+        self.xmlVersion = 1
+
+        # configuration
+        self.servers = ["localhost:51244"]  #: list of "host[:port]"
+        self.sync_marker = ""               #: description of the sync markers, empty = block alignment only
+        self.jitter = 200.0                 #: maximum buffering of a stream in ms
+
+        # server connections, served by the event loop
+        self._thLoopLock = threading.Lock()
+        self.connections = []
+        self.new_connections = None         #: connections to be installed by the event loop
+        self.streaming = False              #: forward data messages to the input queue
+        self.connect(self, Qt.SIGNAL('serverMsg(PyQt_PyObject)'), self._server_message)
+        self._set_servers(self.servers)
+        self.loop_running = True
+        self.loop_thread = threading.Thread(target=self._event_loop)
+        self.loop_thread.start()
+
+        # alignment state
+        self.streams = []
+        self.window = 0                     #: jitter window in points
+        self.merged = 0                     #: merged points
+        self.late = 0                       #: points of lagging streams filled with zeros
+        self.dropped = 0                    #: points arriving after their merged position has been sent
+        self.latency = []                   #: buffering latency since the last report in s
+        self.latency_max = 0.0
+        self.report_time = 0.0
+
+    def terminate(self):
+        ''' Stop the event loop and close the server connections
+        '''
+        self.loop_running = False
+        self.loop_thread.join(5.0)
+        self._thLoopLock.acquire()
+        for conn in self.connections + (self.new_connections or []):
+            conn.close()
+        self.new_connections = None
+        self._thLoopLock.release()
+
+    def setDefault(self):
+        ''' Set all module parameters to default values
+        '''
+        self.servers = ["localhost:51244"]
+        self.sync_marker = ""
+        self.jitter = 200.0
+        self._set_servers(self.servers)
+
+    def _set_servers(self, servers):
+        ''' Replace the server connections. The event loop closes the old connections,
+        they may be in use by the loop right now.
+        @param servers: list of "host[:port]"
+        '''
+        connections = []
+        for index, server in enumerate(servers):
+            host, sep, port = server.partition(":")
+            connections.append(_ServerConnection(index, host, int(port) if sep else 51244))
+        self._thLoopLock.acquire()
+        self.new_connections = connections
+        self._thLoopLock.release()
+
+    def getXML(self):
+        ''' Get module properties for XML configuration file
+        @return: objectify XML element::
+            e.g.
+            <RDA_Aggregator instance="0" version="1">
+                <servers>
+                    <item>localhost:51244</item>
+                </servers>
+                ...
+            </RDA_Aggregator>
+        '''
+        E = objectify.E
+        servers = E.servers()
+        for server in self.servers:
+            servers.append(E.item(server))
+        cfg = E.RDA_Aggregator(servers,
+                               E.syncmarker(self.sync_marker),
+                               E.jitter(self.jitter),
+                               version=str(self.xmlVersion),
+                               instance=str(self._instance),
+                               module="rdaagg")
+        return cfg
+
+    def setXML(self, xml):
+        ''' Set module properties from XML configuration file
+        @param xml: complete objectify XML configuration tree,
+        module will search for matching values
+        '''
+        # search my configuration data
+        configs = xml.xpath("//RDA_Aggregator[@module='rdaagg' and @instance='%i']"%(self._instance))
+        if len(configs) == 0:
+            # configuration data not found, set default values
+            self.setDefault()
+            return
+
+        # we should have only one instance from this type
+        cfg = configs[0]
+
+        # check version, has to be lower or equal than current version
+        version = cfg.get("version")
+        if (version == None) or (int(version) > self.xmlVersion):
+            self.send_event(ModuleEvent(self._object_name, EventType.ERROR, "XML Configuration: wrong version"))
+            return
+        version = int(version)
+
+        # get the values
+        try:
+            self.servers = [str(item.pyval) for item in cfg.servers.iterchildren()]
+            self.sync_marker = str(cfg.syncmarker.text or "")
+            self.jitter = float(cfg.jitter.pyval)
+            if len(self.servers) == 0 or self.jitter <= 0.0:
+                raise Exception("RDA Aggregator: at least one server and a jitter window are required")
+            self._set_servers(self.servers)
+        except Exception as e:
+            self.setDefault()
+            self.send_exception(e, severity=ErrorSeverity.NOTIFY)
+
+    def _event_loop(self):
+        ''' Server connection event loop, connects to all configured servers and receives their messages
+        '''
+        while self.loop_running:
+            self._thLoopLock.acquire()
+            if self.new_connections != None:
+                # server list changed, replace the connections
+                for conn in self.connections:
+                    conn.close()
+                self.connections = self.new_connections
+                self.new_connections = None
+            connections = self.connections[:]
+            self._thLoopLock.release()
+
+            # (re)connect
+            now = time.time()
+            for conn in connections:
+                if conn.state == _ConnectionState.DISCONNECTED and now >= conn.timer:
+                    conn.connect()
+                elif conn.state == _ConnectionState.CONNECTING and now >= conn.timer:
+                    conn.close()
+            socks = dict([(conn.sock, conn) for conn in connections if conn.sock != None])
+            readers = [sock for sock, conn in socks.items() if conn.state == _ConnectionState.CONNECTED]
+            writers = [sock for sock, conn in socks.items() if conn.state == _ConnectionState.CONNECTING]
+            if len(socks) == 0:
+                time.sleep(0.1)
+                continue
+            try:
+                rd, wr, err = select(readers, writers, [], 0.1)
+            except Exception:
+                continue
+
+            for sock in wr:
+                conn = socks[sock]
+                if conn.connected():
+                    self.emit(Qt.SIGNAL('serverMsg(PyQt_PyObject)'),
+                              _ServerMessage(conn.index, RDAMessageType.CONNECTED))
+            for sock in rd:
+                conn = socks[sock]
+                messages = conn.receive()
+                if messages == None:
+                    conn.close()
+                    self.emit(Qt.SIGNAL('serverMsg(PyQt_PyObject)'),
+                              _ServerMessage(conn.index, RDAMessageType.DISCONNECTED))
+                    continue
+                for type, data in messages:
+                    self._handle_message(conn, type, data)
+
+    def _handle_message(self, conn, type, data):
+        ''' Evaluate a server message in the event loop thread
+        @param conn: _ServerConnection
+        @param type: RDAMessageType
+        @param data: message data
+        '''
+        if type == RDAMessageType.START:
+            # stream configuration
+            conn.channels, interval = unpack_from('<Ld', data)
+            conn.sample_rate = 1e6 / interval
+            conn.resolutions = np.frombuffer(data, np.float64, conn.channels, 12).copy()
+            conn.names = bytes(data[12 + 8 * conn.channels:]).split('\x00')[:conn.channels]
+            conn.started = True
+            self.emit(Qt.SIGNAL('serverMsg(PyQt_PyObject)'), _ServerMessage(conn.index, type))
+
+        elif (type == RDAMessageType.DATA32 or type == RDAMessageType.DATA16) and conn.started:
+            if not self.streaming:
+                return
+            block, points, markerCount = unpack_from('<LLL', data)
+            if type == RDAMessageType.DATA16:
+                dtype = np.int16
+            else:
+                dtype = np.float32
+            samples = np.frombuffer(data, dtype, points * conn.channels, 12).reshape(points, conn.channels)
+            eeg = np.empty((conn.channels, points))
+            np.multiply(samples.T, conn.resolutions[:, np.newaxis], eeg)
+            markers = []
+            index = 12 + np.dtype(dtype).itemsize * points * conn.channels
+            for m in range(markerCount):
+                markersize, = unpack_from('<L', data, index)
+                ma = EEG_Marker()
+                ma.position, ma.points, ma.channel = unpack_from('<lLl', data, index + 4)
+                typedesc = bytes(data[index + 16:index + markersize]).split('\x00')
+                ma.type = typedesc[0].decode("utf-8")
+                ma.description = typedesc[1].decode("utf-8")
+                markers.append(ma)
+                index += markersize
+            self._transmit_data(_StreamBlock(conn.index, block, eeg, markers))
+
+        elif type == RDAMessageType.STOP:
+            conn.started = False
+            self.emit(Qt.SIGNAL('serverMsg(PyQt_PyObject)'), _ServerMessage(conn.index, type))
+
+    def _server_message(self, message):
+        ''' Evaluate control messages in the main thread
+        @param message: _ServerMessage
+        '''
+        conn = self.connections[message.index] if message.index < len(self.connections) else None
+        if conn == None:
+            return
+        if message.type == RDAMessageType.CONNECTED:
+            self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
+                                        "RDA Aggregator: connected to %s"%(conn.name())))
+        elif message.type == RDAMessageType.DISCONNECTED:
+            self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
+                                        "RDA Aggregator: disconnected from %s"%(conn.name())))
+        elif message.type == RDAMessageType.START:
+            # a restarted server begins with new block numbers, restart the merged stream
+            if self.isRunning():
+                ModuleBase.stop(self)
+            self._start_merged()
+        elif message.type == RDAMessageType.STOP:
+            if self.isRunning():
+                ModuleBase.stop(self)
+
+    def _start_merged(self):
+        ''' Start acquisition when all servers have sent their configuration
+        '''
+        connections = self.connections[:]
+        if len([conn for conn in connections if conn.started]) < len(connections):
+            return
+        rates = set([conn.sample_rate for conn in connections])
+        if len(rates) > 1:
+            self.send_event(ModuleEvent(self._object_name, EventType.ERROR,
+                                        "RDA Aggregator: different sample rates %s"%(
+                                            ", ".join(["%.0fHz"%(rate) for rate in sorted(rates)])),
+                                        severity=ErrorSeverity.NOTIFY))
+            return
+
+        # merged channel configuration, channels concatenated in server order
+        names = []
+        for conn in connections:
+            names += conn.names
+        self.data = EEG_DataBlock(len(names), 0)
+        for ch, name in zip(self.data.channel_properties, names):
+            ch.name = name.decode("cp1252")
+            ch.lowpass = 0.0
+            ch.highpass = 0.0
+            ch.notchfilter = False
+            ch.isReference = False
+        self.data.sample_rate = connections[0].sample_rate
+        self.data.recording_mode = RecordingMode.NORMAL
+        self.streams = [_StreamState(conn.channels) for conn in connections]
+        self.start()
+
+    def process_start(self):
+        ''' Start acquisition
+        '''
+        self.data.sample_counter = 0
+        self.data.markers = []
+        self.update_receivers(self.data)
+        self.window = max(1, int(self.jitter / 1000.0 * self.data.sample_rate))
+        self.merged = 0
+        self.late = 0
+        self.dropped = 0
+        self.latency = []
+        self.latency_max = 0.0
+        self.report_time = time.time()
+        self.start_time = datetime.datetime.now()
+        self.streaming = True
+
+        info = "Start merged recording with %.0fHz and %d channels from %d servers"%(self.data.sample_rate,
+                                                                                    len(self.data.channel_properties),
+                                                                                    len(self.streams))
+        self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE, info))
+        self.send_event(ModuleEvent(self._object_name,
+                                    EventType.STATUS,
+                                    info = self.data.recording_mode,
+                                    status_field="Mode"))
+
+    def process_stop(self):
+        ''' Stop acquisition
+        '''
+        self.streaming = False
+        self._report()
+        self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE, "Stop merged recording"))
+        self.send_event(ModuleEvent(self._object_name,
+                                    EventType.STATUS,
+                                    info = -1,                  # stop
+                                    status_field="Mode"))
+
+    def process_update(self, params):
+        ''' Propagate the merged channel configuration
+        '''
+        self.send_event(ModuleEvent(self._object_name,
+                                    EventType.STATUS,
+                                    info = "%.0f Hz"%(self.data.sample_rate),
+                                    status_field = "Rate"))
+        self.send_event(ModuleEvent(self._object_name,
+                                    EventType.STATUS,
+                                    info = "%d ch"%(len(self.data.channel_properties)),
+                                    status_field="Channels"))
+        return copy.copy(self.data)
+
+    def _report(self):
+        ''' Log the alignment state and the buffering latency
+        '''
+        if len(self.latency):
+            latency = "buffering latency mean %.1fms, max %.1fms"%(np.mean(self.latency) * 1000.0,
+                                                                  self.latency_max * 1000.0)
+        else:
+            latency = "no data"
+        offsets = ", ".join(["%d"%(stream.offset) for stream in self.streams])
+        missing = sum([stream.missing for stream in self.streams])
+        self.send_event(ModuleEvent(self._object_name, EventType.LOG,
+                                    "RDA Aggregator: %s, offsets [%s] points, %d missing, %d late, %d dropped"%(
+                                        latency, offsets, missing, self.late, self.dropped)))
+        self.latency = []
+        self.latency_max = 0.0
+        self.report_time = time.time()
+
+    def _align(self, stream):
+        ''' Shift the streams when all of them have an unmatched sync marker
+        @param stream: stream with a new sync marker
+        '''
+        # a sync marker of another stream outside the jitter window doesn't belong to this one
+        for other in self.streams:
+            if other.sync != None and stream.sync - other.sync > self.window:
+                other.sync = None
+        if len([s for s in self.streams if s.sync == None]):
+            return
+        reference = self.streams[0].sync
+        for index, other in enumerate(self.streams):
+            delta = reference - other.sync
+            other.sync = None
+            if delta != 0:
+                other.shift(delta)
+                self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
+                                            "RDA Aggregator: %s shifted by %d points"%(self.connections[index].name(),
+                                                                                       delta)))
+
+    def process_input(self, block):
+        ''' Add a server data block to its stream and merge the aligned points
+        @param block: _StreamBlock
+        '''
+        self.dataavailable = False
+        if block.index >= len(self.streams) or block.data.shape[0] != self.streams[block.index].channels:
+            return
+        stream = self.streams[block.index]
+        points = block.data.shape[1]
+
+        # a stream starts at the current merged position, missing blocks are filled with zeros
+        if stream.block == None:
+            stream.shift(self.merged - stream.offset)
+        elif block.block > stream.block + 1:
+            missing = (block.block - stream.block - 1) * points
+            stream.position += missing
+            stream.missing += missing
+        stream.block = block.block
+        start = stream.offset + stream.position
+        stream.chunks.append([start, block.data, block.time])
+        stream.position += points
+        stream.end = start + points
+        for marker in block.markers:
+            position = start + marker.position
+            stream.markers.append((position, marker))
+            if len(self.sync_marker) and marker.description == self.sync_marker:
+                stream.sync = position
+                self._align(stream)
+
+        self._merge()
+        if time.time() - self.report_time >= REPORT_INTERVAL:
+            self._report()
+
+    def _merge(self):
+        ''' Build the merged data block from the points available in all streams,
+        lagging streams are filled with zeros if they are behind the jitter window
+        '''
+        ends = [stream.end for stream in self.streams]
+        end = min(ends)
+        if max(ends) - end > self.window:
+            end = max(ends) - self.window
+        first = self.merged
+        if end <= first:
+            return
+        eeg = np.zeros((len(self.data.channel_properties), end - first))
+        markers = []
+        now = time.time()
+        row = 0
+        for stream in self.streams:
+            if stream.end < end:
+                self.late += end - max(stream.end, first)
+            while len(stream.chunks):
+                start, data, arrival = stream.chunks[0]
+                stop = start + data.shape[1]
+                if start >= end:
+                    break
+                a = max(start, first)
+                b = min(stop, end)
+                if b > a:
+                    eeg[row:row+stream.channels, a-first:b-first] = data[:, a-start:b-start]
+                    self.latency.append(now - arrival)
+                    self.latency_max = max(self.latency_max, now - arrival)
+                if start < first:
+                    self.dropped += min(stop, first) - start
+                if stop <= end:
+                    stream.chunks.popleft()
+                else:
+                    # keep the remaining part for the next block
+                    stream.chunks[0] = [b, data[:, b-start:], arrival]
+                    break
+            pending = []
+            for position, marker in stream.markers:
+                if position < end:
+                    marker = copy.copy(marker)
+                    marker.position = max(position, first)
+                    markers.append(marker)
+                else:
+                    pending.append((position, marker))
+            stream.markers = pending
+            row += stream.channels
+
+        self.data.eeg_channels = eeg
+        self.data.trigger_channel = np.zeros((1, end - first), dtype=np.uint32)
+        self.data.sample_channel = np.arange(first, end, dtype=np.uint64).reshape(1, -1)
+        self.data.sample_counter = end
+        self.data.block_time = self.start_time + datetime.timedelta(seconds=first / self.data.sample_rate)
+        self.data.markers = markers
+        self.merged = end
+        self.dataavailable = True
+
+    def process_output(self):
+        if not self.dataavailable:
+            return None
+        self.dataavailable = False
+        return copy.copy(self.data)
@@ -104,12 +104,11 @@ class RDA_Client(ModuleBase):
         self.client_thread = None
         
         # define data buffer
+        self.sample_buffer = None   #: preallocated sample buffer (points, channels), server data type
         self.resetBuffers()
 
     def resetBuffers(self):
-        # string buffer for samples
-        self.data_buffer = []
-        # buffer sizes
+        # number of samples in the sample buffer
         self.data_count = 0
         # calculate block size in samples for a 50ms block
         self.block_size = max(self.data.sample_rate * 0.05, 5)
@@ -201,8 +200,10 @@ class RDA_Client(ModuleBase):
         sendToQueue = [RDAMessageType.DATA16,
                        RDAMessageType.DATA32,
                        ] 
+        # messages are received into preallocated buffers, the header buffer is reused
+        header = bytearray(24)
         readheader = True
-        requested = 24
+        buf = memoryview(header)
         received = 0
         msg = RDAMessage()
         
@@ -222,7 +223,8 @@ class RDA_Client(ModuleBase):
                     self.emit(Qt.SIGNAL('clientMsg(PyQt_PyObject)'), msg)   # connected
                     self.client_thread_state = 2
                     readheader = True
-                    requested = 24
+                    buf = memoryview(header)
+                    received = 0
                     msg = RDAMessage()
                 except:
                     time.sleep(0.2)
@@ -237,29 +239,29 @@ class RDA_Client(ModuleBase):
                     self.emit(Qt.SIGNAL('clientMsg(PyQt_PyObject)'), msg)   # disconnected
                     self.client_thread_state = 0
                 elif len(rd) > 0:
-                    # data received
-                    data = self.clientsock.recv(requested - len(msg.Data))
-                    if len(data) == 0:
+                    # data received, fill the remaining part of the current buffer
+                    nbytes = self.clientsock.recv_into(buf[received:])
+                    if nbytes == 0:
                         # connection error
                         msg.Type = RDAMessageType.DISCONNECTED
                         self.emit(Qt.SIGNAL('clientMsg(PyQt_PyObject)'), msg)   # disconnected
                         self.client_thread_state = 0
                     else:
-                        # collect data
-                        msg.Data += data
-                        if requested == len(msg.Data):
+                        received += nbytes
+                        if received == len(buf):
+                            received = 0
                             if readheader:
                                 # header received
-                                msg.GUID, msg.Size, msg.Type = unpack(self.hdr, msg.Data)
+                                msg.GUID, msg.Size, msg.Type = unpack_from(self.hdr, header)
 
                                 # prepare to read data or next header
                                 if msg.Size > 24:
+                                    # the data buffer is passed on with the message, 
+                                    # so it is allocated for each message
                                     readheader = False
-                                    requested = msg.Size - 24
-                                    msg.Data = ""
+                                    msg.Data = bytearray(msg.Size - 24)
+                                    buf = memoryview(msg.Data)
                                 else:
-                                    readheader = True
-                                    requested = 24
                                     # Header only, no data
                                     self.emit(Qt.SIGNAL('clientMsg(PyQt_PyObject)'), msg)
                                     msg = RDAMessage()
@@ -272,7 +274,7 @@ class RDA_Client(ModuleBase):
                                 
                                 # prepare to read next header
                                 readheader = True
-                                requested = 24
+                                buf = memoryview(header)
                                 msg = RDAMessage()
                             
                     
@@ -302,7 +304,7 @@ class RDA_Client(ModuleBase):
             return
 
         if message.Type == RDAMessageType.NEWSTATE:
-            state, = unpack('<i', message.Data[:4])
+            state, = unpack_from('<i', message.Data)
             return
 
         if (message.Type == RDAMessageType.STOP) or (message.Type == RDAMessageType.IMP_STOP):
@@ -314,12 +316,13 @@ class RDA_Client(ModuleBase):
 
         if message.Type == RDAMessageType.START:
             # Extract channel configuration
-            (channelCount, samplingInterval) = unpack('<Ld', message.Data[:12])
+            (channelCount, samplingInterval) = unpack_from('<Ld', message.Data)
         
             # Extract resolutions
-            self.resolutions = np.fromstring(message.Data[12:], 
+            self.resolutions = np.frombuffer(message.Data, 
                                              dtype=np.float64, 
-                                             count=channelCount)
+                                             count=channelCount,
+                                             offset=12).copy()
         
             # Extract channel names
             channelNames = self.splitString(message.Data[12 + 8 * channelCount:])
@@ -357,10 +360,9 @@ class RDA_Client(ModuleBase):
                 return
 
             if self.impedanceStartPending:
-                # extract numerical data
-                channels, = unpack('<L', message.Data[:4])
-                raw = message.Data[4:]
                 # extract impedance values
+                impedances = self.parseImpedances(message.Data)
+                channels = len(impedances)
                 self.data = EEG_DataBlock(channels, 0)
                 self.data.recording_mode = RecordingMode.IMPEDANCE
                 self.data.block_time = datetime.datetime.now()
@@ -370,10 +372,7 @@ class RDA_Client(ModuleBase):
                 self.data.eeg_channels[:,ImpedanceIndex.DATA] = 1
             
                 # setup channel names
-                for ch in range(channels):
-                    posx, posy, impedance = unpack('<ffi', raw[:12])
-                    raw = raw[12:]
-                    name, raw = self.parseUnicodeZ(raw)
+                for ch, (name, impedance) in enumerate(impedances):
                     self.data.channel_properties[ch].name = name
     
                 # start impedance measurement
@@ -392,6 +391,7 @@ class RDA_Client(ModuleBase):
         self.data.sample_counter = 0
         self.update_receivers(self.data)
         self.lastBlockNumber = -1
+        self.sample_buffer = None
         self.resetBuffers()
         self.data.markers = []
 
@@ -451,23 +451,29 @@ class RDA_Client(ModuleBase):
         if not self.serverDataValid:
             return
         
-        # process 32bit server data
+        # process 32bit float or 16bit integer server data
         if (self.data.recording_mode != RecordingMode.IMPEDANCE) and \
-           (serverData.Type == RDAMessageType.DATA32):
-            # extract numerical data
-            block, points, markerCount = unpack('<LLL', serverData.Data[:12])
+           (serverData.Type == RDAMessageType.DATA32 or serverData.Type == RDAMessageType.DATA16):
+            # extract numerical data, all values are read at their offset in the message buffer
+            raw = serverData.Data
+            block, points, markerCount = unpack_from('<LLL', raw)
             channels = self.data.eeg_channels.shape[0]
+            if serverData.Type == RDAMessageType.DATA16:
+                self.data_type = np.int16
+            else:
+                self.data_type = np.float32
+            itemsize = np.dtype(self.data_type).itemsize
             
             # extract markers
             if self.data_count == 0:
                 self.data.markers = []
-            index = 12 + 4 * points * channels
+            index = 12 + itemsize * points * channels
             for m in range(markerCount):
-                markersize, = unpack('<L', serverData.Data[index:index+4])
+                markersize, = unpack_from('<L', raw, index)
         
                 ma = EEG_Marker()
-                ma.position, ma.points, ma.channel = unpack('<lLl', serverData.Data[index+4:index+16])
-                typedesc = self.splitString(serverData.Data[index+16:index + markersize])
+                ma.position, ma.points, ma.channel = unpack_from('<lLl', raw, index + 4)
+                typedesc = self.splitString(raw[index+16:index + markersize])
                 ma.type = typedesc[0].decode("utf-8")
                 ma.description = typedesc[1].decode("utf-8")
                 # position is realative to data block, make it absolute
@@ -476,19 +482,19 @@ class RDA_Client(ModuleBase):
                 self.data.markers.append(ma)
                 index = index + markersize
             
-            # buffer data until required block size is reached
-            self.data_buffer.append(serverData.Data[12:12+(points*channels*np.float32(0).itemsize)])
+            # decode the samples directly into the sample buffer until required block size is reached
+            samples = self._reserveSamples(points, channels)
+            samples[self.data_count:self.data_count+points] = np.frombuffer(raw,
+                                                                            dtype = self.data_type,
+                                                                            count = points * channels,
+                                                                            offset = 12).reshape(points, channels)
             self.data_count += points
             
             if self.data_count >= self.block_size:
-                # concatenate data buffer
-                data = "".join(self.data_buffer)
-                
-                # extract channel data
-                eeg = np.fromstring(data,
-                                    dtype = np.float32,
-                                    count = self.data_count * channels)
-                self.data.eeg_channels = np.transpose(np.reshape(eeg, (self.data_count, -1))) * self.resolutions[:,np.newaxis]
+                # extract channel data, scaling and transposing in one pass
+                eeg = np.empty((channels, self.data_count))
+                np.multiply(samples[:self.data_count].T, self.resolutions[:,np.newaxis], eeg)
+                self.data.eeg_channels = eeg
                 # create sample counter channel
                 self.data.sample_channel = np.arange(self.data.sample_counter,
                                                      self.data.sample_counter + self.data_count,
@@ -521,17 +527,13 @@ class RDA_Client(ModuleBase):
         # process impedance data
         if (self.data.recording_mode == RecordingMode.IMPEDANCE) and \
            (serverData.Type == RDAMessageType.IMP_DATA):
-            # extract numerical data
-            channels, = unpack('<L', serverData.Data[:4])
-            raw = serverData.Data[4:]
             # extract impedance values
+            impedances = self.parseImpedances(serverData.Data)
+            channels = len(impedances)
             self.data = EEG_DataBlock(channels, 0)
             self.data.recording_mode = RecordingMode.IMPEDANCE
             self.data.block_time = datetime.datetime.now()
-            for ch in range(channels):
-                posx, posy, impedance = unpack('<ffi', raw[:12])
-                raw = raw[12:]
-                name, raw = self.parseUnicodeZ(raw)
+            for ch, (name, impedance) in enumerate(impedances):
                 self.data.channel_properties[ch].name = name
                 # put the impedance values into the eeg data array
                 if impedance < 0:
@@ -547,39 +549,61 @@ class RDA_Client(ModuleBase):
         self.dataavailable = False
         return copy.copy(self.data)
 
-    def parseUnicodeZ(self, uRaw):
+    def _reserveSamples(self, points, channels):
+        ''' Get the sample buffer with space for additional points. The buffer is
+        reused for all blocks and only reallocated if the server configuration or block size changes.
+        @param points: number of points to add
+        @param channels: number of channels
+        @return: sample buffer (points, channels) of the server data type
+        '''
+        size = self.data_count + points
+        samples = self.sample_buffer
+        if samples is None or samples.shape[1] != channels or samples.dtype != self.data_type or \
+           samples.shape[0] < size:
+            capacity = max(size, int(self.block_size) + points)
+            if samples is not None and samples.shape[1] == channels:
+                capacity = max(capacity, 2 * samples.shape[0])
+            buf = np.empty((capacity, channels), dtype=self.data_type)
+            if samples is not None and samples.shape[1] == channels and self.data_count > 0:
+                buf[:self.data_count] = samples[:self.data_count]
+            self.sample_buffer = samples = buf
+        return samples
+
+    def parseImpedances(self, raw):
+        ''' Parse impedance data messages
+        @param raw: message data
+        @return: list of tuples (channel name, impedance value)
+        '''
+        channels, = unpack_from('<L', raw)
+        index = 4
+        impedances = []
+        for ch in range(channels):
+            posx, posy, impedance = unpack_from('<ffi', raw, index)
+            name, index = self.parseUnicodeZ(raw, index + 12)
+            impedances.append((name, impedance))
+        return impedances
+
+    def parseUnicodeZ(self, uRaw, offset=0):
         ''' Parse zero terminated unicode string
         @param uRaw: unicode raw data
-        @return: string, remaining part of uRaw
+        @param offset: start of the string in uRaw
+        @return: string, offset behind the terminating zero
         '''
-        zpos = -1
-        for i in range(0,len(uRaw),2):
-            v, = unpack('<H', uRaw[i:i+2])
-            if v == 0:
-                zpos = i
-                break
-        if zpos > 0:
-            uString = uRaw[:zpos].decode("utf-16")
-            remainder = uRaw[zpos+2:] 
-        else:
-            uString = u""
-            remainder = uRaw
-        return uString, remainder
+        # the terminating zero has to be aligned to the 16-bit characters
+        zpos = uRaw.find('\x00\x00', offset)
+        while zpos >= 0 and (zpos - offset) % 2:
+            zpos = uRaw.find('\x00\x00', zpos + 1)
+        if zpos < 0:
+            return u"", len(uRaw)
+        return uRaw[offset:zpos].decode("utf-16"), zpos + 2
          
 
     def splitString(self, raw):
         ''' Helper function for splitting a raw array of
             zero terminated strings (C) into an array of python strings
         '''
-        stringlist = []
-        s = ""
-        for i in range(len(raw)):
-            if raw[i] != '\x00':
-                s = s + raw[i]
-            else:
-                stringlist.append(s)
-                s = ""
-        return stringlist
+        # the part behind the last terminating zero is not a complete string
+        return bytes(raw).split('\x00')[:-1]
 
     def getXML(self):
         ''' Get module properties for XML configuration file
@@ -30,11 +30,27 @@ along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from modbase import *
+from scipy import signal
 from socket import *
 from select import *
 from struct import *
 from binascii import *
 from ctypes import *
+import errno
+import collections
+
+#: interval for keep alive messages in seconds
+KEEP_ALIVE_INTERVAL = 1.0
+#: maximum number of messages in a client output buffer
+CLIENT_QUEUE_SIZE = 20
+#: time in seconds a new client can request a replay before live data is sent
+REPLAY_HOLD_TIME = 0.1
+#: maximum size of the replay buffer in bytes
+REPLAY_MAX_BYTES = 256 * 1024**2
+#: RDA message GUID
+_GUID = unhexlify("8E45584396C9864CAF4A98BBF6C91450")
+#: socket errors of non-blocking calls that have to be retried later
+_WOULDBLOCK = (errno.EWOULDBLOCK, errno.EAGAIN, getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK))
 
 class RDAMessageType:
     ''' RDA Message Types
@@ -49,6 +65,90 @@ class RDAMessageType:
     IMP_STOP = 8        #: Impedance measurement stop
     INFO = 9            #: Recorder info Header, sent after connection and when setup is changed
     KEEP_ALIVE = 10000  #: Sent periodically to check whether the connection is still alive
+    SUBSCRIBE = 10001   #: Sent by a client to request a channel subset and decimation (PyCorder only)
+    REPLAY = 10002      #: Sent by a new client to request the buffered history (PyCorder only)
+
+
+class RDAMessage(object):
+    ''' Message consisting of separately sent parts (e.g. header, sample data and markers).
+    The parts are not copied into a single buffer and are shared by all clients.
+    '''
+    def __init__(self, *parts):
+        ''' Create the message
+        @param parts: strings, bytearrays or 1-D numpy byte arrays
+        '''
+        self.parts = [memoryview(part) for part in parts if len(part) > 0]
+        self.block = None       #: block number of data messages
+
+    def __len__(self):
+        return sum([len(part) for part in self.parts])
+
+
+class _Subscription(object):
+    ''' Channel subset and decimation requested by RDA clients.
+    The data is computed once per block for all clients with the same request.
+    '''
+    def __init__(self, channels, decimation, params):
+        ''' Create the subscription
+        @param channels: tuple of channel indices
+        @param decimation: decimation factor
+        @param params: EEG_DataBlock with the channel configuration
+        '''
+        self.channels = list(channels)
+        self.decimation = decimation
+        self.offset = 0                 #: index of the first output sample in the next block
+        self.blockcount = 0             #: number of output blocks, blocks without samples are not counted
+        self.markers = []               #: markers of blocks without output samples
+        # channel configuration of the subscribed data
+        self.params = EEG_DataBlock(0, 0)
+        self.params.sample_rate = params.sample_rate / decimation
+        self.params.eeg_channels = params.eeg_channels[self.channels]
+        self.params.channel_properties = params.channel_properties[self.channels]
+        self.params.recording_mode = params.recording_mode
+        self.params.ref_channel_name = params.ref_channel_name
+        # anti-aliasing low pass filter at 80% of the new Nyquist frequency
+        if decimation > 1:
+            self.b, self.a = signal.butter(4, 0.8 / decimation)
+            zi = signal.lfiltic(self.b, self.a, (0.0,))
+            self.zi = np.resize(zi, (len(self.channels), len(zi)))
+
+    def process(self, datablock):
+        ''' Select channels, filter and decimate a data block
+        @param datablock: EEG_DataBlock with all channels
+        @return: EEG_DataBlock with the subscribed data or None if there are no output samples
+        '''
+        data = datablock.eeg_channels[self.channels]
+        sc = datablock.sample_channel
+        markers = self.markers + datablock.markers
+        if self.decimation > 1:
+            data, self.zi = signal.lfilter(self.b, self.a, data, zi=self.zi)
+            points = data.shape[1]
+            data = data[:, self.offset::self.decimation]
+            sc = sc[:, self.offset::self.decimation]
+            self.offset = (self.offset - points) % self.decimation
+            if sc.shape[1] == 0:
+                self.markers = markers
+                return None
+            # marker positions relative to the first output sample in decimated points,
+            # markers of previous blocks without output samples are moved to the first sample
+            first = long(sc[0][0])
+            decimated = []
+            for marker in markers:
+                m = copy.copy(marker)
+                m.position = first + max(0, (long(marker.position) - first) // self.decimation)
+                decimated.append(m)
+            markers = decimated
+        self.markers = []
+        self.blockcount += 1
+        block = EEG_DataBlock(0, 0)
+        block.sample_counter = datablock.sample_counter
+        block.sample_rate = self.params.sample_rate
+        block.eeg_channels = data
+        block.sample_channel = sc
+        block.channel_properties = self.params.channel_properties
+        block.markers = markers
+        block.recording_mode = datablock.recording_mode
+        return block
 
 
 class RDA_Server(ModuleBase):
@@ -56,7 +156,7 @@ class RDA_Server(ModuleBase):
     '''
 
     def __init__(self, *args, **keys):
-        ''' Initialize module and create the accept thread
+        ''' Initialize module and create the server event loop thread
         '''
         ModuleBase.__init__(self, name="RDA Server", **keys)
         self.data = None
@@ -66,11 +166,29 @@ class RDA_Server(ModuleBase):
         
         self.params = None          #: last channel configuration
         self.clients = []           #: list of connected clients
+        self.subscriptions = {}     #: _Subscription objects by (channels, decimation)
         self.blockcount = 0         #: number of received data blocks
         self.showClientErrors = False   #: we don't want to see client performance problems  
+
+        # XML parameter version
+        # 1: initial version, 16-bit data format and resolutions
+        # 2: replay buffer length added
+        self.xmlVersion = 2
+
+        # data format
+        self.data16 = False             #: send 16-bit data (DATA16) instead of float (DATA32)
+        self.eeg_resolution = 0.1       #: 16-bit resolution of EEG channels in µV
+        self.aux_resolution = 100.0     #: 16-bit resolution of AUX channels in µV
+        self.saturated = 0              #: number of saturated 16-bit values since start
+        self.saturation_reported = False
+
+        # replay buffer for late joining clients
+        self.replay_length = 0.0        #: replay buffer length in seconds (0 = off)
+        self.replay = collections.deque()   #: (time, RDAMessage) of the last data messages
+        self.replay_bytes = 0           #: size of the replay buffer in bytes
         
         # define message header structures
-        self.GUID = unhexlify("8E45584396C9864CAF4A98BBF6C91450") 
+        self.GUID = _GUID
         self.hdr = "<16sLL"     # generic header: GUID, nSize, nType
         
         # create server socket
@@ -89,9 +207,12 @@ class RDA_Server(ModuleBase):
                             "or BrainVision Recoder.")
             
 
-        # create server thread
+        # the module thread wakes up the event loop through a loopback socket pair
+        self._wakeup_rd, self._wakeup_wr = _socket_pair()
+
+        # create server thread, a single event loop serves all clients
         self.serverthread_running = True
-        self.serverthread = threading.Thread(target=self._accept_thread)
+        self.serverthread = threading.Thread(target=self._event_loop)
         self.serverthread.start()
         
         
@@ -99,75 +220,329 @@ class RDA_Server(ModuleBase):
         ''' Shut down server socket
         '''
         self.serverthread_running = False
+        self._wakeup()
         self.serverthread.join(5.0)
         # close client sockets
         for client in self.clients[:]:
             client.terminate()
             self.clients.remove(client)
         self.serversock.close()
+        self._wakeup_rd.close()
+        self._wakeup_wr.close()
         
         
-    def _accept_thread(self):
-        ''' Server socket accept client connections
+    def setDefault(self):
+        ''' Set all module parameters to default values
+        '''
+        self.data16 = False
+        self.eeg_resolution = 0.1
+        self.aux_resolution = 100.0
+        self.replay_length = 0.0        # replay buffer off, it holds data without clients too
+
+    def getXML(self):
+        ''' Get module properties for XML configuration file
+        @return: objectify XML element::
+            e.g.
+            <RDA_Server instance="0" version="1">
+                <data16>False</data16>
+                ...
+            </RDA_Server>
+        '''
+        E = objectify.E
+        cfg = E.RDA_Server(E.data16(self.data16),
+                           E.eegresolution(self.eeg_resolution),
+                           E.auxresolution(self.aux_resolution),
+                           E.replaylength(self.replay_length),
+                           version=str(self.xmlVersion),
+                           instance=str(self._instance),
+                           module="rda")
+        return cfg
+
+    def setXML(self, xml):
+        ''' Set module properties from XML configuration file
+        @param xml: complete objectify XML configuration tree, 
+        module will search for matching values
+        '''
+        # search my configuration data
+        servers = xml.xpath("//RDA_Server[@module='rda' and @instance='%i']"%(self._instance))
+        if len(servers) == 0:
+            # configuration data not found, leave everything unchanged
+            return      
+        
+        # we should have only one instance from this type
+        cfg = servers[0]   
+        
+        # check version, has to be lower or equal than current version
+        version = cfg.get("version")
+        if (version == None) or (int(version) > self.xmlVersion):
+            self.send_event(ModuleEvent(self._object_name, EventType.ERROR, "XML Configuration: wrong version"))
+            return
+        version = int(version)
+        
+        # get the values
+        try:
+            self.data16 = cfg.data16.pyval
+            self.eeg_resolution = float(cfg.eegresolution.pyval)
+            self.aux_resolution = float(cfg.auxresolution.pyval)
+            if self.eeg_resolution <= 0.0 or self.aux_resolution <= 0.0:
+                raise Exception("RDA Server: resolution has to be greater than 0")
+            if version > 1:
+                self.replay_length = max(0.0, float(cfg.replaylength.pyval))
+        except Exception as e:
+            self.setDefault()
+            self.send_exception(e, severity=ErrorSeverity.NOTIFY)
+
+    def _get_resolutions(self, data):
+        ''' Get the channel resolutions for the configured data format
+        @param data: EEG_DataBlock with channel properties
+        @return: resolution in µV for each channel as numpy array
+        '''
+        if not self.data16:
+            return np.ones(len(data.channel_properties))
+        groups = np.array([channel.group for channel in data.channel_properties])
+        return np.where(groups == ChannelGroup.AUX, self.aux_resolution, self.eeg_resolution)
+
+    def _wakeup(self):
+        ''' Wake up the event loop, e.g. if new messages are in the client output buffers
+        '''
+        try:
+            self._wakeup_wr.send("\0")
+        except:
+            pass    # wake up is already pending
+        
+        
+    def _event_loop(self):
+        ''' Server event loop, accepts client connections and
+        sends the client output buffers without blocking
         '''
         aliveMsg = self.build_message(RDAMessageType.KEEP_ALIVE)
+        alivetime = time.time()
         while self.serverthread_running:
+            # get sockets to watch
+            self._thServerLock.acquire()
+            clients = dict([(client.sock, client) for client in self.clients])
+            writers = [client.sock for client in self.clients if client.pending()]
+            self._thServerLock.release()
+            readers = [self._wakeup_rd] + clients.keys()
+            # accept connections after module initialization
+            if self.params != None:
+                readers.append(self.serversock)
 
-            # wait until module is initialized
-            if self.params == None:
-                time.sleep(0.05)
+            # wait for socket events, wake up, end of a client hold time or next keep alive message
+            timeout = alivetime + KEEP_ALIVE_INTERVAL
+            for client in clients.values():
+                if client.holding:
+                    timeout = min(timeout, client.hold_until)
+            timeout = max(0.0, timeout - time.time())
+            try:
+                rd, wr, err = select(readers, writers, [], timeout)
+            except Exception:
                 continue
-             
-            # waiting for connection
-            rd, wr, err = select([self.serversock],[],[], 0.05)
-            if len(rd) > 0:
-                # get the client socket and create a connection object
-                clientsock, addr = self.serversock.accept()
-                client = ClientConnection(clientsock, addr)
-                # init client
+
+            if self._wakeup_rd in rd:
                 try:
-                    sm = self.build_message(0)
-                    client.send(sm)
-                    si = self.build_message(RDAMessageType.INFO, self.params)
-                    client.send(si)
-    
-                    if self.isRunning():
-                        if self.params.recording_mode == RecordingMode.IMPEDANCE:
-                            sm = self.build_message(RDAMessageType.IMP_START)
-                            st = self.build_message(RDAMessageType.NEWSTATE, 3)
-                        else:
-                            sm = self.build_message(RDAMessageType.START, self.params)
-                            st = self.build_message(RDAMessageType.NEWSTATE, 1)
-                        client.send(st)
-                        client.send(sm)
-                    else:
-                        st = self.build_message(RDAMessageType.NEWSTATE, 0)
-                        client.send(st)
+                    self._wakeup_rd.recv(4096)
                 except:
                     pass
-                
-                if client.connected:
-                    self._thServerLock.acquire()
-                    self.clients.append(client)
-                    self._thServerLock.release()
-                    self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
-                                                "RDA Client connected: %s"%(str(addr))))
 
-            # check connections
+            if self.serversock in rd:
+                self._accept_client()
+
             self._thServerLock.acquire()
+            # clients send only requests, otherwise a readable socket is closed or broken
+            for sock in rd:
+                if sock in clients:
+                    for type, request in clients[sock].receive():
+                        if type == RDAMessageType.SUBSCRIBE:
+                            self._subscribe(clients[sock], request)
+                        elif type == RDAMessageType.REPLAY:
+                            self._replay(clients[sock], request)
+            for sock in wr:
+                clients[sock].flush()
+
+            # start sending live data to new clients without replay request
+            now = time.time()
+            for client in self.clients:
+                if client.holding and now >= client.hold_until:
+                    client.holding = False
+
+            # check connections
+            if time.time() >= alivetime + KEEP_ALIVE_INTERVAL:
+                alivetime = time.time()
+                if not self.isRunning() or self.params.recording_mode == RecordingMode.IMPEDANCE:
+                    for client in self.clients:
+                        try:
+                            client.send(aliveMsg)
+                        except:
+                            pass
             for client in self.clients[:]:
-                if not self.isRunning() or  self.params.recording_mode == RecordingMode.IMPEDANCE:
-                    try:
-                        client.send(aliveMsg)
-                    except:
-                        pass
                 if not client.connected:
                     client.terminate()
                     self.clients.remove(client)
                     self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
                                                 "RDA Client disconnected: %s"%(str(client.addr))))
             self._thServerLock.release()
-                
+
+
+    def _accept_client(self):
+        ''' Accept a client connection and queue the init messages
+        '''
+        try:
+            clientsock, addr = self.serversock.accept()
+        except:
+            return
+        clientsock.setblocking(0)
+        # messages are sent in several parts, don't let the last part wait for the previous ACK
+        clientsock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        client = ClientConnection(clientsock, addr)
+        # init client
+        try:
+            sm = self.build_message(0)
+            client.send(sm)
+            si = self.build_message(RDAMessageType.INFO, self.params)
+            client.send(si)
+
+            if self.isRunning():
+                if self.params.recording_mode == RecordingMode.IMPEDANCE:
+                    sm = self.build_message(RDAMessageType.IMP_START)
+                    st = self.build_message(RDAMessageType.NEWSTATE, 3)
+                else:
+                    sm = self.build_message(RDAMessageType.START, self.params)
+                    st = self.build_message(RDAMessageType.NEWSTATE, 1)
+                client.send(st)
+                client.send(sm)
+            else:
+                st = self.build_message(RDAMessageType.NEWSTATE, 0)
+                client.send(st)
+        except:
+            pass
+
+        self._thServerLock.acquire()
+        self.clients.append(client)
+        self._thServerLock.release()
+        self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
+                                    "RDA Client connected: %s"%(str(addr))))
+
+
+    def _subscribe(self, client, request):
+        ''' Set the client subscription and send the matching channel configuration.
+        Has to be called with the server lock held.
+        @param client: ClientConnection
+        @param request: tuple (list of channel indices, decimation factor)
+        '''
+        client.holding = False
+        if self.params == None:
+            return
+        channels, decimation = request
+        count = len(self.params.channel_properties)
+        channels = tuple([c for c in channels if c < count])
+        if len(channels) == 0:
+            channels = tuple(range(count))
+        client.subscription = (channels, max(1, decimation))
+        subscription = self._get_subscription(client.subscription)
+        try:
+            client.send(self.build_message(RDAMessageType.INFO, subscription.params))
+            if self.isRunning() and self.params.recording_mode != RecordingMode.IMPEDANCE:
+                client.send(self.build_message(RDAMessageType.NEWSTATE, 1))
+                client.send(self.build_message(RDAMessageType.START, subscription.params))
+        except:
+            pass
+        self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
+                                    "RDA Client %s subscribed to %d channels, decimation %d"%(str(client.addr),
+                                                                                             len(channels),
+                                                                                             client.subscription[1])))
+
+    def _replay(self, client, seconds):
+        ''' Send the buffered data messages to a new client, before the live data.
+        Has to be called with the server lock held.
+        @param client: ClientConnection
+        @param seconds: requested history in seconds
+        '''
+        if not client.holding or client.subscription != None:
+            client.holding = False
+            self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
+                                        "RDA Client %s: replay is only available for new clients "
+                                        "without subscription"%(str(client.addr))))
+            return
+        client.holding = False
+        # the first data message already queued for this client continues the replay
+        first = client.first_block()
+        start = time.time() - seconds
+        messages = [message for t, message in self.replay
+                    if t >= start and (first == None or message.block < first)]
+        client.insert(messages)
+        self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
+                                    "RDA Client %s: replay of %d blocks"%(str(client.addr), len(messages))))
+
+    def _add_replay(self, message):
+        ''' Add a data message to the replay buffer and remove expired messages.
+        Has to be called with the server lock held.
+        '''
+        now = time.time()
+        self.replay.append((now, message))
+        self.replay_bytes += len(message)
+        while len(self.replay) and (self.replay[0][0] < now - self.replay_length or
+                                    self.replay_bytes > REPLAY_MAX_BYTES):
+            t, m = self.replay.popleft()
+            self.replay_bytes -= len(m)
+
+    def _clear_replay(self):
+        self._thServerLock.acquire()
+        self.replay.clear()
+        self.replay_bytes = 0
+        self._thServerLock.release()
+
+    def _get_subscription(self, key):
+        ''' Get the subscription object for a client subscription
+        @param key: tuple (channels, decimation) or None for all channels at full rate
+        @return: _Subscription or None
+        '''
+        if key == None:
+            return None
+        if key not in self.subscriptions:
+            self.subscriptions[key] = _Subscription(key[0], key[1], self.params)
+        return self.subscriptions[key]
+
+    def _broadcast_subscriptions(self, build, replay=None):
+        ''' Build messages once for each distinct subscription and send them to the subscribed clients
+        @param build: function(subscription) returning a list of messages,
+        subscription is None for clients receiving all channels at full rate
+        @param replay: data message for the replay buffer. It is added in the same critical section
+        as the broadcast, so a replay request can't queue the message a second time.
+        '''
+        self._thServerLock.acquire()
+        if replay != None:
+            self._add_replay(replay)
+        groups = {}
+        for client in self.clients:
+            groups.setdefault(client.subscription, []).append(client)
+        for key, clients in groups.items():
+            messages = build(self._get_subscription(key))
+            for client in clients:
+                try:
+                    for message in messages:
+                        client.send(message)
+                except:
+                    if self.showClientErrors:
+                        self.send_event(ModuleEvent(self._object_name, EventType.ERROR,
+                                                    "RDA Client input queue FULL, overrun!", severity=ErrorSeverity.NOTIFY))
+        self._thServerLock.release()
+        self._wakeup()
+
+    def _broadcast(self, *messages):
+        ''' Put messages into the output buffers of all attached clients and wake up the event loop
+        '''
+        self._thServerLock.acquire()
+        for client in self.clients:
+            try:
+                for message in messages:
+                    client.send(message)
+            except:
+                if self.showClientErrors:
+                    self.send_event(ModuleEvent(self._object_name, EventType.ERROR,
+                                                "RDA Client input queue FULL, overrun!", severity=ErrorSeverity.NOTIFY))
+        self._thServerLock.release()
+        self._wakeup()
 
         
     def process_input(self, datablock):
@@ -177,9 +552,10 @@ class RDA_Server(ModuleBase):
         self.data = datablock
         self.blockcount += 1
 
-        # check for attached clients
+        # check for attached clients, the replay buffer is filled without clients too
+        replay = self.replay_length > 0 and self.data.recording_mode != RecordingMode.IMPEDANCE
         self._thServerLock.acquire()
-        if len(self.clients) == 0:
+        if len(self.clients) == 0 and not replay:
             self._thServerLock.release()
             return
         self._thServerLock.release()
@@ -188,20 +564,35 @@ class RDA_Server(ModuleBase):
         if self.data.recording_mode == RecordingMode.IMPEDANCE:
             # build impedance message
             dm = self.build_message(RDAMessageType.IMP_DATA, datablock)
+            # send data to attached clients
+            self._broadcast(dm)
         else:
-            # build data message
-            dm = self.build_message(RDAMessageType.DATA32, datablock)
-        
-        # send data to attached clients
-        self._thServerLock.acquire()
-        for client in self.clients:
-            try:
-                client.send(dm)
-            except:
-                if self.showClientErrors:
-                    self.send_event(ModuleEvent(self._object_name, EventType.ERROR,
-                                                "RDA Client input queue FULL, overrun!", severity=ErrorSeverity.NOTIFY))
-        self._thServerLock.release()
+            # build data messages for each subscription and send them to attached clients
+            if self.data16:
+                datatype = RDAMessageType.DATA16
+            else:
+                datatype = RDAMessageType.DATA32
+            # the full data message is shared by the replay buffer and the clients
+            dm = None
+            if replay:
+                dm = self.build_message(datatype, datablock)
+            def build(subscription):
+                if subscription == None:
+                    if replay:
+                        return [dm]
+                    return [self.build_message(datatype, datablock)]
+                block = subscription.process(datablock)
+                if block == None:
+                    return []
+                return [self.build_message(datatype, block, subscription.blockcount)]
+            self._broadcast_subscriptions(build, dm)
+
+            # 16-bit value range exceeded?
+            if self.saturated > 0 and not self.saturation_reported:
+                self.saturation_reported = True
+                self.send_event(ModuleEvent(self._object_name, EventType.ERROR,
+                                            "RDA Server: 16-bit data saturated, increase the resolution",
+                                            severity=ErrorSeverity.NOTIFY))
 
 
     def process_output(self):
@@ -216,18 +607,22 @@ class RDA_Server(ModuleBase):
         # copy settings
         self.params = copy.deepcopy(params)
 
-        # notifiy attached clients
+        # notifiy attached clients, subscriptions are rebuilt for the new configuration
+        self._clear_replay()
         self._thServerLock.acquire()
-        if len(self.clients) > 0:
-            si = self.build_message(RDAMessageType.INFO, self.params)
-            for client in self.clients:
-                try:
-                    client.send(si)
-                except:
-                    if self.showClientErrors:
-                        self.send_event(ModuleEvent(self._object_name, EventType.ERROR,
-                                                    "RDA Client input queue FULL, overrun!", severity=ErrorSeverity.NOTIFY))
+        self.subscriptions = {}
+        for client in self.clients:
+            if client.subscription != None:
+                channels = tuple([c for c in client.subscription[0] if c < len(self.params.channel_properties)])
+                client.subscription = (channels or tuple(range(len(self.params.channel_properties))),
+                                       client.subscription[1])
         self._thServerLock.release()
+        if len(self.clients) > 0:
+            def build(subscription):
+                if subscription == None:
+                    return [self.build_message(RDAMessageType.INFO, self.params)]
+                return [self.build_message(RDAMessageType.INFO, subscription.params)]
+            self._broadcast_subscriptions(build)
         
         return params
 
@@ -236,23 +631,26 @@ class RDA_Server(ModuleBase):
         ''' Notify attached clients about state change
         '''
         self.blockcount = 0
+        self.saturated = 0
+        self.saturation_reported = False
+        # block numbers restart, old messages can't be replayed
+        self._clear_replay()
         # notifiy attached clients
         if self.params.recording_mode == RecordingMode.IMPEDANCE:
             sm = self.build_message(RDAMessageType.IMP_START)
             st = self.build_message(RDAMessageType.NEWSTATE, 3)
+            self._broadcast(st, sm)
         else:
-            sm = self.build_message(RDAMessageType.START, self.params)
+            # reset filter states and send the subscribed channel configurations
+            self._thServerLock.acquire()
+            self.subscriptions = {}
+            self._thServerLock.release()
             st = self.build_message(RDAMessageType.NEWSTATE, 1)
-        self._thServerLock.acquire()
-        for client in self.clients:
-            try:
-                client.send(st)
-                client.send(sm)
-            except:
-                if self.showClientErrors:
-                    self.send_event(ModuleEvent(self._object_name, EventType.ERROR,
-                                                "RDA Client input queue FULL, overrun!", severity=ErrorSeverity.NOTIFY))
-        self._thServerLock.release()
+            def build(subscription):
+                if subscription == None:
+                    return [st, self.build_message(RDAMessageType.START, self.params)]
+                return [st, self.build_message(RDAMessageType.START, subscription.params)]
+            self._broadcast_subscriptions(build)
         
     def process_stop(self):
         ''' Notify attached clients about state change
@@ -262,32 +660,27 @@ class RDA_Server(ModuleBase):
         else:
             sm = self.build_message(RDAMessageType.STOP)
         st = self.build_message(RDAMessageType.NEWSTATE, 0)
-        self._thServerLock.acquire()
-        for client in self.clients:
-            try:
-                client.send(st)
-                client.send(sm)
-            except:
-                if self.showClientErrors:
-                    self.send_event(ModuleEvent(self._object_name, EventType.ERROR,
-                                                "RDA Client input queue FULL, overrun!", severity=ErrorSeverity.NOTIFY))
-        self._thServerLock.release()
+        self._broadcast(st, sm)
+        if self.saturated > 0:
+            self.send_event(ModuleEvent(self._object_name, EventType.LOG,
+                                        "RDA Server: %d saturated 16-bit values"%(self.saturated)))
         
     
         
-    def build_message(self, type, data=None):
+    def build_message(self, type, data=None, block=None):
         ''' Build a message buffer according to message type
         @param type: RDAMessageType
         @param data: data object to send
-        @return: binary message blob
+        @param block: block number of data messages, None = number of received blocks
+        @return: binary message blob or RDAMessage
         '''
         if type == RDAMessageType.START:
             channels = len(data.channel_properties)
             samplingInterval = 1.0e6 / data.sample_rate     # sampling interval in us
             
-            # create resolution byte array (we have a resolution of 1uV for all channels)
-            res = [1.0] * channels
-            resbyte = pack("<" + "d" * channels, *res)
+            # create resolution byte array (1uV for float data, configured resolution for 16-bit data)
+            res = self._get_resolutions(data)
+            resbyte = res.astype("<f8").tostring()
             
             # create channel names byte array (null terminated strings)
             # use ansi code page 1252
@@ -313,13 +706,19 @@ class RDA_Server(ModuleBase):
             hdrbyte = bytearray(hdr_start.pack(self.GUID, blocksize, type))
             return hdrbyte
 
-        elif type == RDAMessageType.DATA32:
+        elif type == RDAMessageType.DATA32 or type == RDAMessageType.DATA16:
             # create data byte array
             nPoints = len(data.sample_channel[0])
-            # convert data to float and write to data file
-            d = data.eeg_channels.transpose()
-            f = d.flatten().astype(np.float32)
-            databyte = f.tostring()
+            if type == RDAMessageType.DATA16:
+                # scale to channel resolution, count and limit values out of 16-bit range
+                scaled = np.rint(data.eeg_channels.transpose() / self._get_resolutions(data))
+                self.saturated += np.count_nonzero((scaled > 32767.0) | (scaled < -32768.0))
+                np.clip(scaled, -32768.0, 32767.0, out=scaled)
+                f = np.ascontiguousarray(scaled, dtype=np.int16)
+            else:
+                # transpose and convert data to float in a single copy
+                f = np.ascontiguousarray(data.eeg_channels.transpose(), dtype=np.float32)
+            databyte = f.reshape(-1).view(np.uint8)
             
             # create marker byte array
             nMarkers = len(data.markers)
@@ -337,14 +736,16 @@ class RDA_Server(ModuleBase):
                 mkrbyte.extend(mkr)
 
             # create message header
-            hdr_start = Struct(self.hdr+ "LLL")      # data32: nBlock, nPoints, nMarkers + data + marker
+            if block == None:
+                block = self.blockcount
+            hdr_start = Struct(self.hdr+ "LLL")      # data32/data16: nBlock, nPoints, nMarkers + data + marker
             blocksize = hdr_start.size + len(databyte) + len(mkrbyte)
-            hdrbyte = bytearray(hdr_start.pack(self.GUID, blocksize, type, self.blockcount, nPoints, nMarkers))
+            hdrbyte = hdr_start.pack(self.GUID, blocksize, type, block, nPoints, nMarkers)
 
-            # add data part
-            hdrbyte.extend(databyte)
-            hdrbyte.extend(mkrbyte)
-            return hdrbyte 
+            # header, data and marker parts are sent separately
+            message = RDAMessage(hdrbyte, databyte, mkrbyte)
+            message.block = block
+            return message
 
         elif type == RDAMessageType.IMP_START:
             # create message header
@@ -426,9 +827,9 @@ class RDA_Server(ModuleBase):
             # recorder version
             version = 2.0
             
-            # create resolution byte array (we have a resolution of 1uV for all channels)
-            res = [1.0] * channels
-            resbyte = pack("<" + "d" * channels, *res)
+            # create resolution byte array (1uV for float data, configured resolution for 16-bit data)
+            res = self._get_resolutions(data)
+            resbyte = res.astype("<f8").tostring()
             
             # create channel names byte array (null terminated strings)
             chn =[]
@@ -488,58 +889,158 @@ class RDA_Server(ModuleBase):
         return imp
         
 class ClientConnection():
-    ''' Object holding a connected client
+    ''' Object holding a connected client and its output buffer.
+    The socket is non-blocking and served by the RDA_Server event loop.
     '''
     def __init__(self, clientsock, addr):
-        ''' Create data transmit thread
-        @param clientsock: client socket
+        ''' Create the output buffer
+        @param clientsock: non-blocking client socket
         @param addr: client IP address 
         '''
         self.sock = clientsock
         self.addr = addr
-        self.transmit_queue = Queue.Queue(20)
-        # start transmit thread
+        self.output = collections.deque()   #: messages (RDAMessage) waiting for transmission
+        self.part = 0                       #: parts of the first message already sent
+        self.offset = 0                     #: bytes of the current part already sent
+        self.input = ""                     #: received data of incomplete messages
+        self.subscription = None            #: (channels, decimation) or None for all channels at full rate
+        self.holding = True                 #: output held back until a replay request or hold time expired
+        self.hold_until = time.time() + REPLAY_HOLD_TIME
+        self.burst_start = 0                #: output buffer index of the first replay message
+        self.burst = 0                      #: number of replay messages in the output buffer
         self.connected = True
-        self.clientthread = threading.Thread(target=self._transmit_thread)
-        self.clientthread.start()
         
     def terminate(self):
         ''' Shut down client socket
         '''
-        if self.connected:
-            self.connected = False
-            self.clientthread.join(5.0)
+        self.connected = False
+        self.output.clear()
         self.sock.close()
         
     def send(self, message):
-        ''' Put the message into the transmit queue
+        ''' Put the message into the output buffer
+        @param message: RDAMessage or binary message blob
         '''
         if self.connected:
-            self.transmit_queue.put(message, False)
+            if len(self.output) - self.burst >= CLIENT_QUEUE_SIZE:
+                raise Queue.Full
+            if not isinstance(message, RDAMessage):
+                message = RDAMessage(message)
+            self.output.append(message)
+
+    def pending(self):
+        ''' Check for messages waiting for transmission
+        '''
+        return self.connected and not self.holding and len(self.output) > 0
+
+    def first_block(self):
+        ''' Get the block number of the first queued data message
+        @return: block number or None
+        '''
+        for message in self.output:
+            if message.block != None:
+                return message.block
+        return None
+
+    def insert(self, messages):
+        ''' Insert replay messages before the first queued data message,
+        they are not limited by the output buffer size
+        '''
+        output = list(self.output)
+        index = len(output)
+        for n, message in enumerate(output):
+            if message.block != None:
+                index = n
+                break
+        output[index:index] = messages
+        self.output = collections.deque(output)
+        self.burst_start = index
+        self.burst = len(messages)
     
-    def _transmit_thread(self):
-        ''' Get data from queue and send it over TCP/IP
+    def flush(self):
+        ''' Send as much of the output buffer as possible without blocking
         '''
-        while self.connected:
-            try:
-                # get data from queue
-                data = self.transmit_queue.get(False)
-                # send it to client
-                totalsent = 0
-                while totalsent < len(data):
-                    rd, wr, err = select([],[self.sock],[], 0.05)
-                    if len(wr) > 0:
-                        sent = self.sock.send(data[totalsent:])
-                        if sent == 0:
-                            raise RuntimeError, "socket connection broken"
-                        totalsent = totalsent + sent
-                
-            except Queue.Empty:
-                time.sleep(0.002)        # suspend thread (default = 2ms)
-            except Exception as e:
+        try:
+            while len(self.output):
+                parts = self.output[0].parts
+                while self.part < len(parts):
+                    # memoryview slices don't copy the message data
+                    data = parts[self.part]
+                    sent = self.sock.send(data[self.offset:])
+                    if sent == 0:
+                        raise RuntimeError, "socket connection broken"
+                    self.offset += sent
+                    if self.offset < len(data):
+                        return      # socket send buffer is full
+                    self.part += 1
+                    self.offset = 0
+                self.output.popleft()
+                self.part = 0
+                if self.burst_start > 0:
+                    self.burst_start -= 1
+                elif self.burst > 0:
+                    self.burst -= 1
+        except Exception as e:
+            if getattr(e, "errno", None) not in _WOULDBLOCK:
                 self.connected = False
-        
-        
-        
-        
-                
\ No newline at end of file
+
+    def receive(self):
+        ''' Receive client messages, detect closed connections
+        @return: list of requests as tuple (RDAMessageType, request), the SUBSCRIBE request is a
+        tuple (list of channel indices, decimation), the REPLAY request the history in seconds
+        '''
+        try:
+            data = self.sock.recv(4096)
+            if len(data) == 0:
+                self.connected = False
+                return []
+        except Exception as e:
+            if getattr(e, "errno", None) not in _WOULDBLOCK:
+                self.connected = False
+            return []
+        self.input += data
+
+        # parse complete messages, other messages than requests are ignored
+        requests = []
+        header = Struct("<16sLL")
+        while len(self.input) >= header.size:
+            guid, size, type = header.unpack_from(self.input)
+            if guid != _GUID or size < header.size:
+                self.input = ""     # not a valid RDA message
+                break
+            if len(self.input) < size:
+                break
+            if type == RDAMessageType.SUBSCRIBE:
+                try:
+                    decimation, count = unpack_from("<LL", self.input, header.size)
+                    channels = unpack_from("<%dL"%(count), self.input, header.size + 8)
+                    requests.append((type, (list(channels), decimation)))
+                except:
+                    pass
+            elif type == RDAMessageType.REPLAY:
+                try:
+                    seconds, = unpack_from("<d", self.input, header.size)
+                    requests.append((type, seconds))
+                except:
+                    pass
+            self.input = self.input[size:]
+        return requests
+
+
+def _socket_pair():
+    ''' Create a pair of connected non-blocking loopback sockets,
+    socket.socketpair() is not available on Windows
+    @return: receiving and sending socket
+    '''
+    listener = socket(AF_INET, SOCK_STREAM)
+    try:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        wr = socket(AF_INET, SOCK_STREAM)
+        wr.connect(listener.getsockname())
+        rd, addr = listener.accept()
+    finally:
+        listener.close()
+    rd.setblocking(0)
+    wr.setblocking(0)
+    return rd, wr
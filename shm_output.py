@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+'''
+Shared Memory Output Module
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Publishes the data blocks into a shared memory ring buffer for consumers
+running on the same host. Consumers read the ring with L{tools.shmring.ShmRingReader}
+without TCP/IP, serialization or per consumer copies.
+
+@version: 1.0
+'''
+
+from modbase import *
+from tools.shmring import ShmRingWriter
+
+#: maximum size of the data ring in bytes
+RING_MAX_BYTES = 256 * 1024**2
+
+
+class SHM_Output(ModuleBase):
+    ''' Write EEG data into a shared memory ring buffer
+    '''
+
+    def __init__(self, *args, **keys):
+        ''' Initialize module
+        '''
+        ModuleBase.__init__(self, name="Shared Memory Output", **keys)
+        self.data = None
+        self.dataavailable = False
+        self.params = None          #: last channel configuration
+        self.ring = None            #: ShmRingWriter
+
+        # XML parameter version
+        # 1: initial version
+        self.xmlVersion = 1
+
+        # ring configuration
+        self.ring_name = "pycorder"     #: ring name, file name is pycorder_<name>.shm
+        self.ring_length = 5.0          #: ring length in seconds
+
+    def terminate(self):
+        ''' Remove the ring buffer file
+        '''
+        if self.ring != None:
+            self.ring.close()
+            self.ring = None
+
+    def setDefault(self):
+        ''' Set all module parameters to default values
+        '''
+        self.ring_name = "pycorder"
+        self.ring_length = 5.0
+
+    def getXML(self):
+        ''' Get module properties for XML configuration file
+        @return: objectify XML element::
+            e.g.
+            <SHM_Output instance="0" version="1">
+                <name>pycorder</name>
+                ...
+            </SHM_Output>
+        '''
+        E = objectify.E
+        cfg = E.SHM_Output(E.name(self.ring_name),
+                           E.length(self.ring_length),
+                           version=str(self.xmlVersion),
+                           instance=str(self._instance),
+                           module="shm")
+        return cfg
+
+    def setXML(self, xml):
+        ''' Set module properties from XML configuration file
+        @param xml: complete objectify XML configuration tree,
+        module will search for matching values
+        '''
+        # search my configuration data
+        configs = xml.xpath("//SHM_Output[@module='shm' and @instance='%i']"%(self._instance))
+        if len(configs) == 0:
+            # configuration data not found, leave everything unchanged
+            return
+
+        # we should have only one instance from this type
+        cfg = configs[0]
+
+        # check version, has to be lower or equal than current version
+        version = cfg.get("version")
+        if (version == None) or (int(version) > self.xmlVersion):
+            self.send_event(ModuleEvent(self._object_name, EventType.ERROR, "XML Configuration: wrong version"))
+            return
+        version = int(version)
+
+        # get the values
+        try:
+            self.ring_name = str(cfg.name.pyval)
+            self.ring_length = float(cfg.length.pyval)
+            if self.ring_length <= 0.0:
+                raise Exception("Shared Memory Output: ring length has to be greater than 0")
+        except Exception as e:
+            self.setDefault()
+            self.send_exception(e, severity=ErrorSeverity.NOTIFY)
+
+    def _create_ring(self):
+        ''' Replace the ring buffer for the current channel configuration
+        '''
+        # readers of the old ring see the closed flag, the new file has already replaced it.
+        # Windows can't replace a mapped file, the old ring has to be closed first.
+        old = self.ring
+        self.ring = None
+        if old != None and os.name == "nt":
+            old.close()
+            old = None
+        channels = [(unicode(ch.name), ch.group, ch.input, unicode(ch.unit) or u"µV")
+                    for ch in self.params.channel_properties]
+        framesize = max(1, len(channels)) * 4
+        capacity = min(int(self.ring_length * self.params.sample_rate), RING_MAX_BYTES // framesize)
+        try:
+            self.ring = ShmRingWriter(self.ring_name, channels, self.params.sample_rate, max(capacity, 1024))
+        except Exception as e:
+            self.send_exception(e, severity=ErrorSeverity.NOTIFY)
+        if old != None:
+            old.close(remove=(self.ring == None))
+        if self.ring != None:
+            self.send_event(ModuleEvent(self._object_name, EventType.LOGMESSAGE,
+                                        "Shared Memory Output: %s, %d channels, %d points"%(self.ring.filename,
+                                                                                            len(channels),
+                                                                                            self.ring.capacity)))
+
+    def process_update(self, params):
+        ''' Create the ring buffer for the new channel configuration
+        '''
+        self.params = copy.copy(params)
+        if params.recording_mode != RecordingMode.IMPEDANCE:
+            self._create_ring()
+        return params
+
+    def process_start(self):
+        if self.ring != None:
+            self.ring.set_running(self.params.recording_mode != RecordingMode.IMPEDANCE)
+
+    def process_stop(self):
+        if self.ring != None:
+            self.ring.set_running(False)
+
+    def process_input(self, datablock):
+        ''' Copy the data block into the ring buffer
+        '''
+        self.dataavailable = True
+        self.data = datablock
+        if self.ring == None or datablock.recording_mode == RecordingMode.IMPEDANCE:
+            return
+        if datablock.eeg_channels.shape[0] != self.ring.channels:
+            return
+        self.ring.write(datablock.eeg_channels, datablock.sample_channel[0], datablock.markers)
+
+    def process_output(self):
+        if not self.dataavailable:
+            return None
+        self.dataavailable = False
+        return self.data
@@ -34,9 +34,14 @@ B{Revision:} $LastChangedRevision: 206 $
 import ctypes as ct
 import os
 import platform
+import fnmatch
+import collections
 from modbase import *
 from res import frmStorageVisionOnline
 from res import frmStorageVisionConfig
+from tools.journal import RecordingJournal, JournalFlags, journal_from_data_file, sync_file
+from tools.datawriter import ClibWriter
+from tools.checksum import BlockChecksum, checksum_from_data_file
 
 '''
 ------------------------------------------------------------
@@ -52,37 +57,20 @@ class StorageVision(ModuleBase):
     def __init__(self, *args, **keys):
         ''' Constructor
         '''
-        ModuleBase.__init__(self, queuesize=50, name="StorageVision", **keys)
+        queuesize = keys.pop("queuesize", 50)
+        ModuleBase.__init__(self, queuesize=queuesize, name="StorageVision", **keys)
         
         # XML parameter version
         # 1: initial version
         # 2: minimum required disk space added
-        self.xmlVersion = 2
-
-        # get OS architecture (32/64-bit)
-        self.x64 = ("64" in platform.architecture()[0])
-
-        # load C library 
-        try: 
-            self.libc = ct.cdll.msvcrt # Windows 
-        except: 
-            self.libc = ct.CDLL("libc.so.6") # Linux 
-
-        # set error handling for C library
-        def errcheck(res, func, args): 
-            if not res: 
-                raise IOError 
-            return res 
-        self.libc._wfopen.errcheck = errcheck 
-        if self.x64:
-            self.libc._wfopen.restype = ct.c_int64
-            self.libc.fwrite.argtypes = [ct.c_void_p, ct.c_size_t, ct.c_size_t, ct.c_int64] 
-            self.libc.fclose.argtypes = [ct.c_int64] 
-        else:
-            self.libc._wfopen.restype = ct.c_void_p 
-            self.libc.fwrite.argtypes = [ct.c_void_p, ct.c_size_t, ct.c_size_t, ct.c_void_p] 
-            self.libc.fclose.argtypes = [ct.c_void_p] 
-         
+        # 3: journal sync interval added
+        # 4: event-gated recording added
+        # 5: block checksums added
+        self.xmlVersion = 5
+
+        # data file writer class (tools.datawriter), the writer is created with the data file name
+        self.writer_factory = ClibWriter
+
         self.data = None
         self.dataavailable = False
         self.params = None
@@ -95,7 +83,7 @@ class StorageVision(ModuleBase):
         
         # output files
         self.file_name = None       #: output file name
-        self.data_file = 0          #: clib data file handle
+        self.data_file = 0          #: data file writer object
         self.header_file = 0        #: header file handle
         self.marker_file = 0        #: marker file handle
         self.marker_counter = 0     #: total number of markers written
@@ -108,6 +96,21 @@ class StorageVision(ModuleBase):
         self.write_error = False     #: write to disk failed
         self.min_disk_space = 1.0    #: minimum free disk space in GByte
 
+        self.journal = None             #: recording journal (RecordingJournal)
+        self.journal_interval = 1.0     #: journal sync interval in seconds (0 = journal off)
+        self.journal_timer = 0.0        #: time of last journal update
+        self.data_bytes_written = 0     #: data file size in bytes
+        self.recording_time = 0.0       #: time of recording start
+        self.checksum = None            #: data file block checksums (BlockChecksum)
+        self.checksum_enabled = True    #: write the block checksum file
+        self.file_samplecounter = 0     #: sample counter of the last sample written to file
+
+        self.gate_ring = None           #: pre-trigger ring buffer (_PreTriggerRing)
+        self.gate_intervals = []        #: pending gate intervals [first, last] sample counter
+        self.gate_request = False       #: gate trigger requested by remote command
+        self.gate_segments = 0          #: number of gated segments in current recording
+        self.gate_reference = (0, None) #: sample counter and time of the last received block
+
     def setDefault(self):
         ''' Set all module parameters to default values
         '''
@@ -115,6 +118,10 @@ class StorageVision(ModuleBase):
         self.default_prefix = ""        #: prefex for data files e.g. "EEG_"
         self.default_numbersize = 6     #: number of digits to append to file name
         self.default_autoname = False   #: create auto file name
+        self.gate_enabled = False       #: event-gated recording
+        self.gate_pretrigger = 2.0      #: gated recording, seconds before trigger
+        self.gate_posttrigger = 5.0     #: gated recording, seconds after trigger
+        self.gate_markers = u"Stimulus" #: gate trigger markers, "type/description" patterns separated by ";"
 
     
     def get_online_configuration(self):
@@ -148,6 +155,12 @@ class StorageVision(ModuleBase):
                               E.d_prefix(self.default_prefix),
                               E.d_numbersize(self.default_numbersize),
                               E.mindiskspace(self.min_disk_space),
+                              E.journalinterval(self.journal_interval),
+                              E.gated(self.gate_enabled),
+                              E.gatepre(self.gate_pretrigger),
+                              E.gatepost(self.gate_posttrigger),
+                              E.gatemarkers(self.gate_markers),
+                              E.checksum(self.checksum_enabled),
                               version=str(self.xmlVersion),
                               instance=str(self._instance),
                               module="storage")
@@ -185,6 +198,21 @@ class StorageVision(ModuleBase):
                 self.min_disk_space = cfg.mindiskspace.pyval
             else:
                 self.min_disk_space = 1.0
+            if version > 2:
+                self.journal_interval = cfg.journalinterval.pyval
+            else:
+                self.journal_interval = 1.0
+            if version > 3:
+                self.gate_enabled = cfg.gated.pyval
+                self.gate_pretrigger = cfg.gatepre.pyval
+                self.gate_posttrigger = cfg.gatepost.pyval
+                self.gate_markers = unicode(cfg.gatemarkers.text or u"")
+            else:
+                self.gate_enabled = False
+            if version > 4:
+                self.checksum_enabled = cfg.checksum.pyval
+            else:
+                self.checksum_enabled = True
             
         except Exception as e:
             self.send_exception(e, severity=ErrorSeverity.NOTIFY)
@@ -439,6 +467,12 @@ class StorageVision(ModuleBase):
                 
                 # reference channel names
                 h += u"Reference channel: %s"%(self.params.ref_channel_name) + crlf
+
+                # event-gated recording
+                if self.gate_enabled:
+                    h += u"Event-gated recording: %.3fs before / %.3fs after trigger markers '%s'"%(self.gate_pretrigger,
+                                                                                                      self.gate_posttrigger,
+                                                                                                      self.gate_markers) + crlf
                 
                 # impedance values if available
                 if self.last_impedance != None:
@@ -510,17 +544,49 @@ class StorageVision(ModuleBase):
                 self.header_file.close()
                 raise ModuleError(self._object_name, "failed to create %s\n%s"%(markername, str(e)))
             
+            # allocate the pre-trigger ring buffer
+            self.gate_intervals = []
+            self.gate_request = False
+            self.gate_segments = 0
+            if self.gate_enabled:
+                # additional space for the block containing the trigger
+                size = int((self.gate_pretrigger + 0.5) * self.params.sample_rate)
+                self.gate_ring = _PreTriggerRing(len(self.params.channel_properties), size)
+            else:
+                self.gate_ring = None
+
             # create EEG data file
             try:
                 self._thLock.acquire()
-                self.data_file = self.libc._wfopen(unicode(self.file_name), u"wb")
+                self.data_file = self.writer_factory(unicode(self.file_name))
                 self.write_error = False
+                self.data_bytes_written = 0
             except IOError as e:
                 self.header_file.close()
                 self.marker_file.close()
                 raise ModuleError(self._object_name, "failed to create %s"%(self.file_name))
             finally:
                 self._thLock.release()
+
+            # create the recording journal
+            if self.journal_interval > 0:
+                journalname = journal_from_data_file(self.file_name)
+                try:
+                    self.journal = RecordingJournal(journalname, len(self.params.channel_properties))
+                except Exception as e:
+                    self._close_recording()
+                    raise ModuleError(self._object_name, "failed to create %s\n%s"%(journalname, str(e)))
+                self.journal_timer = time.time()
+
+            # create the block checksum file
+            if self.checksum_enabled:
+                checksumname = checksum_from_data_file(self.file_name)
+                try:
+                    self.checksum = BlockChecksum(checksumname, len(self.params.channel_properties) * 4)
+                except Exception as e:
+                    self._close_recording()
+                    raise ModuleError(self._object_name, "failed to create %s\n%s"%(checksumname, str(e)))
+            self.recording_time = time.time()
             
             # show recording state
             self.online_cfg.set_recording_state(True) 
@@ -537,15 +603,53 @@ class StorageVision(ModuleBase):
         '''
         self._thLock.acquire()
         if self.data_file != 0:
+            # final journal update
+            if self.journal != None:
+                try:
+                    if not self.write_error:
+                        self._update_journal(JournalFlags.CLOSED)
+                    self.journal.close()
+                    self.send_event(ModuleEvent(self._object_name, EventType.LOG,
+                                                info=self.journal.get_statistics(time.time() - self.recording_time)))
+                except Exception as e:
+                    print "Failed to close recording journal: " + str(e)
+                self.journal = None
+            # write the last checksum
+            if self.checksum != None:
+                try:
+                    self.checksum.close()
+                    self.send_event(ModuleEvent(self._object_name, EventType.LOG,
+                                                info=self.checksum.get_statistics(time.time() - self.recording_time)))
+                except Exception as e:
+                    print "Failed to close checksum file: " + str(e)
+                self.checksum = None
             try:
-                self.libc.fclose(self.data_file)
+                self.data_file.close()
                 self.marker_file.close()
             except Exception as e:
                 print "Failed to close recording files: " + str(e)
             self.data_file = 0
             self.data_file = 0
+            self.gate_ring = None
             self.online_cfg.set_recording_state(False) 
         self._thLock.release() 
+
+    def _update_journal(self, flags=0):
+        ''' Sync data and marker file to disk and append a journal record
+        @param flags: JournalFlags
+        '''
+        t = time.time()
+        self.data_file.sync()
+        self.marker_file.flush()
+        sync_file(self.marker_file.fileno())
+        if self.checksum != None:
+            # the journal must not cover data with unsynced checksums
+            self.checksum.flush()
+            sync_file(self.checksum.file.fileno())
+        self.journal.update(self.samples_written, self.data_bytes_written,
+                            self.marker_counter, self.marker_file.tell(), flags)
+        self.journal.add_synctime(time.time() - t)
+        self.journal_timer = time.time()
    
    
     def _writeMarkerToFile(self, marker, blockdate):
@@ -641,6 +745,128 @@ class StorageVision(ModuleBase):
         return output_markers
 
 
+    def _write_data(self, eeg_channels, sample_channel, markers, blockdate):
+        ''' Write samples and markers to file
+        @param eeg_channels: 2-dimensional numpy array with channel data (channels x samples)
+        @param sample_channel: 1-dimensional numpy array with sample counter values
+        @param markers: list of marker objects (EEG_Marker) within this range of samples
+        @param blockdate: datetime object with time of the first sample
+        @return: list of output markers (EEG_Marker)
+        '''
+        # samples not written since the last write, missing or disregarded by the gate
+        samples = len(sample_channel)
+        if self.marker_counter == 0:
+            last_samplecounter = sample_channel[0] - 1
+        else:
+            last_samplecounter = self.file_samplecounter
+        if sample_channel[-1] - last_samplecounter != samples:
+            sct_check = np.append((last_samplecounter), sample_channel)
+            sctDiff = np.diff(sct_check) - 1
+            sctBreak = np.nonzero(sctDiff)[0]
+            sctBreakDiff = np.array([sct_check[sctBreak+1], sctDiff[sctBreak]]) # samplecounter / missing
+        else:
+            sctBreakDiff = np.array([[],[]],dtype=np.int64)
+
+        # convert data to float and write to data file
+        d = eeg_channels.transpose()
+        f = d.flatten().astype(np.float32)
+        nbytes = self.data_file.write(f)
+        if nbytes != f.nbytes:
+            raise ModuleError(self._object_name, "Write to file %s failed"%(self.file_name))
+        if self.checksum != None:
+            self.checksum.update(f)
+        # write marker
+        output_markers = self._write_marker(markers, blockdate, sample_channel[0], sctBreakDiff)
+
+        # update file sample counter
+        self.samples_written += samples
+        self.data_bytes_written += nbytes
+        self.total_missing += np.sum(sctBreakDiff[1])
+        self.file_samplecounter = sample_channel[-1]
+        return output_markers
+
+    def _get_gate_patterns(self):
+        ''' Get the gate trigger marker patterns from configuration
+        @return: list of "type/description" patterns
+        '''
+        patterns = []
+        for pattern in self.gate_markers.split(";"):
+            pattern = pattern.strip()
+            if len(pattern) == 0:
+                continue
+            # type only, any description
+            if "/" not in pattern:
+                pattern += "/*"
+            patterns.append(pattern)
+        return patterns
+
+    def _is_gate_marker(self, marker, patterns):
+        ''' Check if a marker triggers the event-gated recording
+        @param marker: EEG_Marker object
+        @param patterns: list of "type/description" patterns
+        '''
+        name = u"%s/%s"%(marker.type, marker.description)
+        for pattern in patterns:
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+    def _sample_time(self, samplecounter):
+        ''' Get the time of a sample, relative to the last received data block
+        @param samplecounter: sample counter value
+        @return: datetime object
+        '''
+        sc, blockdate = self.gate_reference
+        seconds = (float(samplecounter) - sc) / self.params.sample_rate
+        return blockdate + datetime.timedelta(seconds=seconds)
+
+    def _process_gated(self, datablock):
+        ''' Event-gated recording, keep the data block in the pre-trigger ring buffer
+        and write all samples within the gate intervals to file. Each gate interval
+        starts a new segment.
+        @param datablock: EEG_DataBlock object
+        '''
+        sct = datablock.sample_channel[0]
+        self.gate_ring.put(datablock.eeg_channels, sct, datablock.markers)
+        self.gate_reference = (long(sct[0]), datablock.block_time)
+
+        # get trigger positions from markers and remote commands
+        patterns = self._get_gate_patterns()
+        triggers = [long(m.position) for m in datablock.markers if self._is_gate_marker(m, patterns)]
+        if self.gate_request:
+            self.gate_request = False
+            triggers.append(long(sct[0]))
+
+        pretrigger = int(self.gate_pretrigger * self.params.sample_rate)
+        posttrigger = int(self.gate_posttrigger * self.params.sample_rate)
+        for trigger in sorted(triggers):
+            first = max(0, trigger - pretrigger)
+            last = trigger + posttrigger
+            if len(self.gate_intervals) and first <= self.gate_intervals[-1][1] + 1:
+                # retrigger, extend the current interval
+                self.gate_intervals[-1][1] = max(self.gate_intervals[-1][1], last)
+            else:
+                self.gate_intervals.append([first, last])
+                self.gate_segments += 1
+                self.send_event(ModuleEvent(self._object_name, EventType.LOG,
+                                            info="gated segment %d triggered at sample %d"%(self.gate_segments, trigger)))
+
+        # write the available part of all pending intervals
+        newest = long(sct[-1])
+        for interval in self.gate_intervals[:]:
+            first = interval[0]
+            if self.marker_counter > 0:
+                first = max(first, long(self.file_samplecounter) + 1)
+            last = min(interval[1], newest)
+            if last >= first:
+                chunk = self.gate_ring.get(first, last)
+                if chunk != None:
+                    d, sc, markers = chunk
+                    self._write_data(d, sc, markers, self._sample_time(sc[0]))
+            if interval[1] <= newest:
+                self.gate_intervals.remove(interval)
+
+
     def process_event(self, event):
         ''' Handle events from attached receivers
         @param event: ModuleEvent
@@ -667,6 +893,10 @@ class StorageVision(ModuleBase):
             # check for stop
             if event.info == "StopSaving":
                 self._close_recording()
+
+            # trigger event-gated recording
+            if event.info == "GateTrigger":
+                self.gate_request = True
         
 
     def process_update(self, params):
@@ -741,11 +971,9 @@ class StorageVision(ModuleBase):
             sct = self.data.sample_channel[0]
             sct_check = np.append((self.next_samplecounter), sct)
             sctDiff = np.diff(sct_check) - 1
-            sctBreak = np.nonzero(sctDiff)[0]
             missing_samples = np.sum(sctDiff)
             self.missing_interval += missing_samples
             self.missing_cumulated += missing_samples 
-            sctBreakDiff = np.array([sct_check[sctBreak+1], sctDiff[sctBreak]]) # samplecounter / missing
             if time.clock() - self.missing_timer > 30:            
                 self.missing_interval = missing_samples
             #print "samples missing = %i, interval = %i, cumulated = %i"%(missing_samples, self.missing_interval, self.missing_cumulated) 
@@ -759,7 +987,6 @@ class StorageVision(ModuleBase):
             self.missing_timer = time.clock()
         else:
             missing_samples = 0
-            sctBreakDiff = np.array([[],[]],dtype=np.int64)
                     
         # set counter to the expected start sample number of next data block
         self.next_samplecounter = self.data.sample_channel[0,-1]
@@ -768,20 +995,17 @@ class StorageVision(ModuleBase):
         if (self.data_file != 0) and not self.write_error:
             try:
                 t = time.clock()
-                # convert data to float and write to data file
-                d = datablock.eeg_channels.transpose()
-                f = d.flatten().astype(np.float32)
-                sizeof_item = f.dtype.itemsize # item size in bytes
-                write_items = len(f)    # number of items to write  
-                nitems  = self.libc.fwrite(f.tostring(), sizeof_item, write_items, self.data_file)
-                if nitems != write_items:
-                    raise ModuleError(self._object_name, "Write to file %s failed"%(self.file_name))
-                # write marker
-                #self._write_marker(self.data.markers, self.data.block_time, self.data.sample_channel[0,0])
-                self.data.markers = self._write_marker(self.data.markers, self.data.block_time, self.data.sample_channel[0,0], sctBreakDiff)
-                
-                # update file sample counter
-                self.samples_written += samples
+                if self.gate_ring != None:
+                    # write only the samples around trigger events
+                    self._process_gated(datablock)
+                else:
+                    # write data and marker
+                    self.data.markers = self._write_data(datablock.eeg_channels, self.data.sample_channel[0], 
+                                                         self.data.markers, self.data.block_time)
+
+                # sync files to disk and update the recording journal
+                if self.journal != None and (time.time() - self.journal_timer) >= self.journal_interval:
+                    self._update_journal()
                 
                 writetime = time.clock() - t
                 #print "Write file: %.0f ms / %d Bytes / QSize %d"%(writetime*1000.0, nitems, self._input_queue.qsize()) 
@@ -795,9 +1019,6 @@ class StorageVision(ModuleBase):
                                             str(e), 
                                             severity=ErrorSeverity.NOTIFY))
 
-        # update the global sample counter missing value 
-        self.total_missing += missing_samples
-
        
     def process_output(self):
         if not self.dataavailable:
@@ -807,6 +1028,81 @@ class StorageVision(ModuleBase):
     
 
 
+class _PreTriggerRing(object):
+    ''' Preallocated ring buffer, holding the most recent samples and markers
+    for the event-gated recording
+    '''
+    def __init__(self, channels, size):
+        ''' Constructor
+        @param channels: number of channels
+        @param size: buffer size in samples
+        '''
+        self.size = max(size, 1)
+        self.data = np.zeros((channels, self.size), np.float32)
+        self.samplecounter = np.zeros(self.size, np.uint64)
+        self.markers = collections.deque()
+        self.write_pos = 0      #: next write index
+        self.count = 0          #: number of valid samples
+
+    def put(self, eeg_channels, sample_channel, markers):
+        ''' Append a data block, overwrite the oldest samples
+        @param eeg_channels: 2-dimensional numpy array with channel data (channels x samples)
+        @param sample_channel: 1-dimensional numpy array with sample counter values
+        @param markers: list of marker objects (EEG_Marker)
+        '''
+        samples = len(sample_channel)
+        if samples > self.size:
+            eeg_channels = eeg_channels[:, -self.size:]
+            sample_channel = sample_channel[-self.size:]
+            samples = self.size
+        # copy in two parts, up to the end of the buffer and the wrapped remainder
+        first = min(samples, self.size - self.write_pos)
+        self.data[:, self.write_pos:self.write_pos+first] = eeg_channels[:, :first]
+        self.samplecounter[self.write_pos:self.write_pos+first] = sample_channel[:first]
+        if first < samples:
+            self.data[:, :samples-first] = eeg_channels[:, first:]
+            self.samplecounter[:samples-first] = sample_channel[first:]
+        self.write_pos = (self.write_pos + samples) % self.size
+        self.count = min(self.count + samples, self.size)
+
+        # keep the markers, remove markers older than the oldest sample 
+        self.markers.extend(sorted(markers, key=lambda m: m.position))
+        oldest = self.samplecounter[(self.write_pos - self.count) % self.size]
+        while len(self.markers) and self.markers[0].position < oldest:
+            self.markers.popleft()
+
+    def get(self, first, last):
+        ''' Get all samples and markers within a range of sample counter values
+        @param first: first sample counter value
+        @param last: last sample counter value (inclusive)
+        @return: tuple (data, sample counter, list of marker copies) or None if not available
+        '''
+        # the buffer content consists of up to two ascending parts
+        start = (self.write_pos - self.count) % self.size
+        if start + self.count <= self.size:
+            parts = [(start, start + self.count)]
+        else:
+            parts = [(start, self.size), (0, self.write_pos)]
+        slices = []
+        for p0, p1 in parts:
+            sct = self.samplecounter[p0:p1]
+            i0 = p0 + np.searchsorted(sct, first, side='left')
+            i1 = p0 + np.searchsorted(sct, last, side='right')
+            if i1 > i0:
+                slices.append(slice(i0, i1))
+        if len(slices) == 0:
+            return None
+        if len(slices) == 1:
+            data = self.data[:, slices[0]]
+            sct = self.samplecounter[slices[0]]
+        else:
+            data = np.concatenate([self.data[:, s] for s in slices], axis=1)
+            sct = np.concatenate([self.samplecounter[s] for s in slices])
+        # the marker positions will be modified while writing
+        markers = [copy.copy(m) for m in self.markers if first <= m.position <= last]
+        return data, sct, markers
+
+
 '''
 ------------------------------------------------------------
 STORAGE MODULE ONLINE GUI
@@ -952,6 +1248,46 @@ class _ConfigurationPane(Qt.QFrame, frmStorageVisionConfig.Ui_frmStorageVisionCo
         validator2 = Qt.QDoubleValidator(0.01, 500.0, 2,self)
         self.lineEditSpace.setValidator(validator2)
 
+        # journal sync interval
+        self.labelJournal = Qt.QLabel("Journal sync interval ", self)
+        self.lineEditJournal = Qt.QLineEdit(self)
+        self.lineEditJournal.setMaximumSize(Qt.QSize(60, 16777215))
+        self.lineEditJournal.setAlignment(Qt.Qt.AlignCenter)
+        self.lineEditJournal.setValidator(Qt.QDoubleValidator(0.0, 3600.0, 1, self))
+        self.labelJournalUnit = Qt.QLabel("[s] (0 = off)", self)
+        self.horizontalLayoutJournal = Qt.QHBoxLayout()
+        self.horizontalLayoutJournal.addWidget(self.labelJournal)
+        self.horizontalLayoutJournal.addWidget(self.lineEditJournal)
+        self.horizontalLayoutJournal.addWidget(self.labelJournalUnit)
+        self.horizontalLayoutJournal.addStretch()
+
+        # event-gated recording
+        self.groupBoxGate = Qt.QGroupBox("Event-gated recording", self)
+        self.groupBoxGate.setCheckable(True)
+        self.lineEditGatePre = Qt.QLineEdit(self.groupBoxGate)
+        self.lineEditGatePost = Qt.QLineEdit(self.groupBoxGate)
+        for lineEdit in [self.lineEditGatePre, self.lineEditGatePost]:
+            lineEdit.setMaximumSize(Qt.QSize(60, 16777215))
+            lineEdit.setAlignment(Qt.Qt.AlignCenter)
+            lineEdit.setValidator(Qt.QDoubleValidator(0.0, 3600.0, 3, self))
+        self.lineEditGateMarkers = Qt.QLineEdit(self.groupBoxGate)
+        self.lineEditGateMarkers.setToolTip("Trigger markers as type/description, separated by ';'\n"
+                                            "wildcards are allowed, e.g. 'Stimulus/S  1; Response'")
+        self.gridLayoutGate = Qt.QGridLayout(self.groupBoxGate)
+        self.gridLayoutGate.addWidget(Qt.QLabel("Pre-trigger [s]", self.groupBoxGate), 0, 0)
+        self.gridLayoutGate.addWidget(self.lineEditGatePre, 0, 1)
+        self.gridLayoutGate.addWidget(Qt.QLabel("Post-trigger [s]", self.groupBoxGate), 0, 2)
+        self.gridLayoutGate.addWidget(self.lineEditGatePost, 0, 3)
+        self.gridLayoutGate.addWidget(Qt.QLabel("Trigger markers", self.groupBoxGate), 1, 0)
+        self.gridLayoutGate.addWidget(self.lineEditGateMarkers, 1, 1, 1, 3)
+
+        self.verticalLayoutOptions = Qt.QVBoxLayout()
+        self.checkBoxChecksum = Qt.QCheckBox("Write data block checksums (.vcrc)", self)
+        self.verticalLayoutOptions.addLayout(self.horizontalLayoutJournal)
+        self.verticalLayoutOptions.addWidget(self.checkBoxChecksum)
+        self.verticalLayoutOptions.addWidget(self.groupBoxGate)
+        self.gridLayout_2.addLayout(self.verticalLayoutOptions, 6, 0, 1, 1)
+
         # setup content
         self.storage = storage
         
@@ -960,6 +1296,12 @@ class _ConfigurationPane(Qt.QFrame, frmStorageVisionConfig.Ui_frmStorageVisionCo
         self.lineEditCounterSize.setText(str(storage.default_numbersize))
         self.checkBoxAutoFile.setChecked(storage.default_autoname)
         self.lineEditSpace.setText(str(storage.min_disk_space))
+        self.lineEditJournal.setText(str(storage.journal_interval))
+        self.checkBoxChecksum.setChecked(storage.checksum_enabled)
+        self.groupBoxGate.setChecked(storage.gate_enabled)
+        self.lineEditGatePre.setText(str(storage.gate_pretrigger))
+        self.lineEditGatePost.setText(str(storage.gate_posttrigger))
+        self.lineEditGateMarkers.setText(storage.gate_markers)
         self._showExample()
         
         # actions
@@ -969,6 +1311,12 @@ class _ConfigurationPane(Qt.QFrame, frmStorageVisionConfig.Ui_frmStorageVisionCo
         self.connect(self.checkBoxAutoFile, Qt.SIGNAL("clicked()"), self._contentChanged)
         self.connect(self.pushButtonBrowse, Qt.SIGNAL("clicked()"), self._browse)
         self.connect(self.lineEditSpace, Qt.SIGNAL("editingFinished()"), self._contentChanged)
+        self.connect(self.lineEditJournal, Qt.SIGNAL("editingFinished()"), self._contentChanged)
+        self.connect(self.checkBoxChecksum, Qt.SIGNAL("clicked()"), self._contentChanged)
+        self.connect(self.groupBoxGate, Qt.SIGNAL("clicked()"), self._contentChanged)
+        self.connect(self.lineEditGatePre, Qt.SIGNAL("editingFinished()"), self._contentChanged)
+        self.connect(self.lineEditGatePost, Qt.SIGNAL("editingFinished()"), self._contentChanged)
+        self.connect(self.lineEditGateMarkers, Qt.SIGNAL("editingFinished()"), self._contentChanged)
         
     def _contentChanged(self):
         ''' Update parent object vars
@@ -979,6 +1327,12 @@ class _ConfigurationPane(Qt.QFrame, frmStorageVisionConfig.Ui_frmStorageVisionCo
         self.storage.default_numbersize = self.lineEditCounterSize.displayText().toInt()[0]
         self.storage.default_autoname = self.checkBoxAutoFile.isChecked()
         self.storage.min_disk_space = self.lineEditSpace.displayText().toDouble()[0]
+        self.storage.journal_interval = self.lineEditJournal.displayText().toDouble()[0]
+        self.storage.checksum_enabled = self.checkBoxChecksum.isChecked()
+        self.storage.gate_enabled = self.groupBoxGate.isChecked()
+        self.storage.gate_pretrigger = self.lineEditGatePre.displayText().toDouble()[0]
+        self.storage.gate_posttrigger = self.lineEditGatePost.displayText().toDouble()[0]
+        self.storage.gate_markers = unicode(self.lineEditGateMarkers.displayText())
         self._showExample()
         
     def _browse(self):
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+'''
+Data File Block Checksums and Verify Tool
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+The checksum file (.vcrc) holds a header and one 32 bit checksum for each
+block of the data file. A block contains a fixed number of complete samples,
+so a checksum mismatch maps to an exact range of data points. The checksum of
+the last, partial block is appended when the recording is closed.
+
+Verify recordings, e.g. during archive ingestion::
+
+    python -m tools.checksum [--jobs N] recording.vhdr ...
+
+Exit code 0: all files verified, 1: corrupted or incomplete files, 2: errors
+
+@version: 1.0
+'''
+
+import os
+import sys
+import time
+import zlib
+import multiprocessing
+from struct import Struct
+from optparse import OptionParser
+
+from tools.vision import VisionHeader, header_from_data_file
+
+
+# checksum file header: magic, algorithm, block size in bytes, frame size in bytes
+_HEADER = Struct("<8sLLL")
+_ENTRY = Struct("<L")
+_MAGIC = "PYCCRC01"
+
+class ChecksumAlgorithm:
+    ''' Checksum algorithms
+    '''
+    CRC32 = 0
+    ADLER32 = 1
+
+_FUNCTIONS = {ChecksumAlgorithm.CRC32: (zlib.crc32, 0),
+              ChecksumAlgorithm.ADLER32: (zlib.adler32, 1)}
+
+#: approximate block size in bytes
+BLOCK_SIZE = 1024**2
+
+
+class BlockChecksum(object):
+    ''' Calculates the checksums of the data file blocks while writing, used by the storage module
+    '''
+    def __init__(self, filename, frame_size, algorithm=ChecksumAlgorithm.CRC32):
+        ''' Create the checksum file
+        @param filename: checksum file name (.vcrc)
+        @param frame_size: number of bytes for one sample of all channels
+        @param algorithm: ChecksumAlgorithm
+        '''
+        self.filename = filename
+        self.block_size = max(1, BLOCK_SIZE // frame_size) * frame_size
+        self.function, self.initial = _FUNCTIONS[algorithm]
+        self.value = self.initial   #: checksum of the current block
+        self.fill = 0               #: bytes in the current block
+        self.bytes = 0              #: total number of bytes
+        self.time = 0.0             #: cumulated calculation time in seconds
+        self.file = open(filename, "wb")
+        self.file.write(_HEADER.pack(_MAGIC, algorithm, self.block_size, frame_size))
+
+    def update(self, data):
+        ''' Add data written to the data file
+        @param data: contiguous numpy array or string
+        '''
+        t = time.time()
+        data = buffer(data)
+        offset = 0
+        size = len(data)
+        while offset < size:
+            n = min(size - offset, self.block_size - self.fill)
+            self.value = self.function(buffer(data, offset, n), self.value)
+            self.fill += n
+            offset += n
+            if self.fill == self.block_size:
+                self._write_entry()
+        self.bytes += size
+        self.time += time.time() - t
+
+    def _write_entry(self):
+        self.file.write(_ENTRY.pack(self.value & 0xFFFFFFFF))
+        self.value = self.initial
+        self.fill = 0
+
+    def flush(self):
+        self.file.flush()
+
+    def get_statistics(self, duration):
+        ''' Get the checksum cost as log text
+        @param duration: recording duration in seconds
+        '''
+        if duration > 0:
+            load = self.time / duration * 100.0
+        else:
+            load = 0.0
+        return "checksum: %.1fMB in %.1fms, %.3f%% of recording time"%(self.bytes / 1024.0**2,
+                                                                      self.time * 1000.0, load)
+
+    def close(self):
+        ''' Write the checksum of the last partial block and close the file
+        '''
+        if self.fill > 0:
+            self._write_entry()
+        self.file.close()
+
+
+def checksum_from_data_file(filename):
+    ''' Get the checksum file name for a data, marker or header file name
+    '''
+    return os.path.splitext(filename)[0] + ".vcrc"
+
+
+def read_checksums(filename):
+    ''' Read a checksum file
+    @param filename: checksum file name
+    @return: tuple (algorithm, block size, frame size, list of checksums)
+    '''
+    f = open(filename, "rb")
+    try:
+        raw = f.read()
+    finally:
+        f.close()
+    if len(raw) < _HEADER.size:
+        raise Exception("%s is not a valid checksum file"%(filename))
+    magic, algorithm, block_size, frame_size = _HEADER.unpack(raw[:_HEADER.size])
+    if magic != _MAGIC or algorithm not in _FUNCTIONS or block_size == 0:
+        raise Exception("%s is not a valid checksum file"%(filename))
+    entries = (len(raw) - _HEADER.size) // _ENTRY.size
+    checksums = [_ENTRY.unpack_from(raw, _HEADER.size + n * _ENTRY.size)[0] for n in range(entries)]
+    return algorithm, block_size, frame_size, checksums
+
+
+def truncate_checksums(filename, size, original=None):
+    ''' Remove the checksums of blocks not completely within the data file, e.g. after recovery
+    @param filename: checksum file name
+    @param size: data file size in bytes
+    @param original: data file size before truncation, None = unknown
+    @return: number of removed checksums
+    '''
+    algorithm, block_size, frame_size, checksums = read_checksums(filename)
+    keep = size // block_size
+    if original != None and original <= size and original % block_size:
+        # the checksum of the last partial block ends within the data file
+        keep += 1
+    if keep >= len(checksums):
+        return 0
+    f = open(filename, "r+b")
+    try:
+        f.truncate(_HEADER.size + keep * _ENTRY.size)
+    finally:
+        f.close()
+    return len(checksums) - keep
+
+
+def _verify_blocks(task):
+    ''' Worker: verify a range of blocks
+    @param task: tuple (file index, data file, algorithm, block size, first block, checksums)
+    @return: file index, number of verified blocks, list of corrupted block numbers
+    '''
+    index, datafile, algorithm, block_size, first, checksums = task
+    function, initial = _FUNCTIONS[algorithm]
+    corrupted = []
+    f = open(datafile, "rb")
+    try:
+        f.seek(first * block_size)
+        for n, checksum in enumerate(checksums):
+            data = f.read(block_size)
+            if function(data, initial) & 0xFFFFFFFF != checksum:
+                corrupted.append(first + n)
+    finally:
+        f.close()
+    return index, len(checksums), corrupted
+
+
+class VerifyJob(object):
+    ''' Verification of a single recording
+    '''
+    def __init__(self, index, filename):
+        self.index = index
+        self.header = VisionHeader(header_from_data_file(filename))
+        self.algorithm, self.block_size, frame_size, self.checksums = read_checksums(checksum_from_data_file(self.header.data_file))
+        if frame_size != self.header.frame_size:
+            raise Exception("checksum frame size %d doesn't match header (%d)"%(frame_size, self.header.frame_size))
+        self.size = os.path.getsize(self.header.data_file)
+        self.blocks = -(-self.size // self.block_size)   #: number of blocks in the data file
+        self.verified = 0
+        self.corrupted = []
+
+    def get_tasks(self, blocks_per_task):
+        count = min(self.blocks, len(self.checksums))
+        return [(self.index, self.header.data_file, self.algorithm, self.block_size, first,
+                 self.checksums[first:min(first + blocks_per_task, count)])
+                for first in range(0, count, blocks_per_task)]
+
+    def _get_points(self, first_byte, last_byte):
+        ''' Get data points (starting at 1) for a byte range (last byte exclusive)
+        '''
+        frame = self.header.frame_size
+        return first_byte // frame + 1, -(-last_byte // frame)
+
+    def get_report(self):
+        ''' Get the verification result
+        @return: tuple (ok, list of text lines)
+        '''
+        report = []
+        # merge consecutive corrupted blocks to data point ranges
+        ranges = []
+        for block in sorted(self.corrupted):
+            if len(ranges) and ranges[-1][1] == block:
+                ranges[-1][1] = block + 1
+            else:
+                ranges.append([block, block + 1])
+        for first, last in ranges:
+            report.append("corrupted data points %d - %d"%self._get_points(first * self.block_size,
+                                                                           min(last * self.block_size, self.size)))
+        if len(self.checksums) < self.blocks:
+            report.append("no checksums for data points %d - %d (recording not closed?)"%self._get_points(len(self.checksums) * self.block_size,
+                                                                                                          self.size))
+        elif len(self.checksums) > self.blocks:
+            report.append("data file truncated, %d blocks missing"%(len(self.checksums) - self.blocks))
+        ok = len(report) == 0
+        if ok:
+            report.append("OK, %d data points in %d blocks verified"%(self.size // self.header.frame_size, self.verified))
+        return ok, report
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] recording.vhdr ...")
+    parser.add_option("-j", "--jobs", dest="Jobs", type="int", default=multiprocessing.cpu_count(),
+                      help="number of worker processes [default: %default]")
+    options, files = parser.parse_args(args[1:])
+    if len(files) == 0:
+        parser.print_help()
+        return 2
+
+    ret = 0
+    jobs = []
+    for filename in files:
+        try:
+            jobs.append(VerifyJob(len(jobs), filename))
+        except Exception as e:
+            print "%s\n    failed: %s"%(filename, str(e))
+            ret = 2
+
+    tasks = []
+    for job in jobs:
+        tasks += job.get_tasks(64)
+    workers = max(1, options.Jobs)
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(workers)
+        imap = pool.imap_unordered
+    else:
+        pool = None
+        imap = map
+    t = time.time()
+    try:
+        for index, verified, corrupted in imap(_verify_blocks, tasks):
+            jobs[index].verified += verified
+            jobs[index].corrupted += corrupted
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+    elapsed = time.time() - t
+
+    total = 0
+    for job in jobs:
+        ok, report = job.get_report()
+        print job.header.data_file
+        for line in report:
+            print "    " + line
+        if not ok:
+            ret = max(ret, 1)
+        total += job.size
+    print "%d files, %.1fMB verified in %.1fs"%(len(jobs), total / 1024.0**2, elapsed)
+    return ret
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
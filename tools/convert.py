@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+'''
+Channel-Major Conversion Tool
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Convert MULTIPLEXED recordings written by L{storage.StorageVision} into
+channel-major files, where each channel is a contiguous run of samples:
+
+    - npy: numpy array (channels x samples) and a .json file with channel
+      names, sample rate, resolution and markers
+    - vectorized: Vision files with DataOrientation=VECTORIZED
+
+The recordings are split into sample segments, converted by a process pool.
+Each segment is read in tiles of bounded size, so the memory per worker does
+not depend on the file size. Optionally the samples are decimated (boxcar
+average) and quantized to 16 or 32 bit integers::
+
+    python -m tools.convert [options] recording.vhdr ...
+
+@version: 1.0
+'''
+
+import os
+import sys
+import time
+import json
+import codecs
+import multiprocessing
+from optparse import OptionParser
+
+import numpy as np
+
+from tools.vision import VisionHeader, header_from_data_file
+
+#: output sample types and their Vision binary format
+SAMPLE_TYPES = {"float32": (np.float32, "IEEE_FLOAT_32"),
+                "int16": (np.int16, "INT_16"),
+                "int32": (np.int32, "INT_32")}
+
+#: samples per transposition block, keeps source and destination in the CPU cache
+_TRANSPOSE_BLOCK = 1024
+
+
+class _Segment(object):
+    ''' Sample range of a recording, processed by a single worker
+    '''
+    def __init__(self, job, first, last):
+        self.index = job.index              #: job index
+        self.infile = job.header.data_file  #: input data file
+        self.outfile = job.outfile          #: output data file
+        self.channels = job.header.channels #: number of channels
+        self.first = first                  #: first input sample
+        self.last = last                    #: last input sample (exclusive)
+        self.tile = job.tile                #: input samples per tile
+        self.decimation = job.decimation    #: decimation factor
+        self.offset = job.data_offset       #: output file data offset in bytes
+        self.out_samples = job.out_samples  #: output samples per channel
+        self.sample_type = job.sample_type  #: output sample type name
+        self.resolution = job.resolution    #: quantization resolution per channel
+
+
+class ConversionJob(object):
+    ''' Conversion of a single recording
+    '''
+    def __init__(self, index, filename, options):
+        ''' Prepare the conversion
+        @param index: job index
+        @param filename: header, data or marker file name of the recording
+        @param options: command line options
+        '''
+        self.index = index
+        self.header = VisionHeader(header_from_data_file(filename))
+        if self.header.orientation != "MULTIPLEXED":
+            raise Exception("%s is not MULTIPLEXED"%(self.header.filename))
+        self.format = options.Format
+        self.decimation = max(1, options.Decimation)
+        self.sample_type = options.Quantize
+        self.samples = self.header.get_samples()
+        self.out_samples = self.samples // self.decimation
+        self.resolution = None
+        if self.sample_type != "float32" and options.Resolution > 0:
+            self.resolution = np.ones(self.header.channels) * options.Resolution
+
+        # input samples per tile: input, transposed and converted tile must fit into the memory limit
+        frame = self.header.frame_size
+        tile = int(options.Memory * 1024**2 / (3 * frame))
+        self.tile = max(self.decimation, tile - tile % self.decimation)
+
+        # output file names
+        path = options.Output or os.path.dirname(self.header.data_file)
+        base = os.path.splitext(os.path.basename(self.header.data_file))[0]
+        if self.format == "npy":
+            self.outfile = os.path.join(path, base + ".npy")
+            self.infofile = os.path.join(path, base + ".json")
+        else:
+            self.outfile = os.path.join(path, base + "_vec.eeg")
+            self.infofile = os.path.join(path, base + "_vec.vhdr")
+        self.data_offset = 0
+
+        # statistics
+        self.done = 0           #: converted input samples
+        self.worktime = 0.0     #: cumulated worker time in seconds
+        self.clipped = 0        #: number of clipped values
+
+    def get_segments(self, count):
+        ''' Split the recording into sample segments
+        @param count: requested number of segments
+        @return: list of _Segment objects
+        '''
+        last = self.out_samples * self.decimation
+        length = -(-last // max(1, count))
+        length = max(self.tile, -(-length // self.tile) * self.tile)
+        return [_Segment(self, first, min(first + length, last)) for first in range(0, last, length)]
+
+    def create_output(self):
+        ''' Create the output data file with full size and write header and marker files
+        '''
+        dtype = np.dtype(SAMPLE_TYPES[self.sample_type][0])
+        f = open(self.outfile, "wb")
+        try:
+            if self.format == "npy":
+                np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                         'fortran_order': False,
+                                                         'shape': (self.header.channels, self.out_samples)})
+                self.data_offset = f.tell()
+            f.truncate(self.data_offset + self.header.channels * self.out_samples * dtype.itemsize)
+        finally:
+            f.close()
+        if self.format == "npy":
+            self._write_info()
+        else:
+            self._write_vision_header()
+
+    def _get_resolution(self, channel):
+        if self.resolution is None:
+            return 1.0
+        return self.resolution[channel]
+
+    def _read_markers(self):
+        ''' Get the markers of the source recording, positions adjusted to decimation
+        @return: list of marker fields [type, description, position, points, channel, (date)]
+        '''
+        markers = []
+        if len(self.header.marker_file) == 0 or not os.path.exists(self.header.marker_file):
+            return markers
+        f = codecs.open(self.header.marker_file, "r", "utf-8")
+        try:
+            lines = f.read().splitlines()
+        finally:
+            f.close()
+        for line in lines:
+            if not line.startswith("Mk") or "=" not in line:
+                continue
+            fields = line.split("=", 1)[1].split(",")
+            try:
+                position = int(fields[2])
+                points = int(fields[3])
+            except (IndexError, ValueError):
+                continue
+            # Vision positions start at 1
+            fields[2] = str((position - 1) // self.decimation + 1)
+            fields[3] = str(max(1, -(-points // self.decimation)))
+            markers.append(fields)
+        return markers
+
+    def _write_info(self):
+        ''' Write the .json description of a .npy output file
+        '''
+        names = []
+        units = []
+        for info in self.header.channel_infos:
+            fields = info.split(",")
+            names.append(fields[0].replace("\\1", ","))
+            if len(fields) > 3 and len(fields[3]):
+                units.append(fields[3])
+            else:
+                units.append(u"µV")
+        markers = []
+        for fields in self._read_markers():
+            markers.append({"type": fields[0].replace("\\1", ","),
+                            "description": fields[1].replace("\\1", ","),
+                            "position": int(fields[2]) - 1,
+                            "points": int(fields[3]),
+                            "channel": int(fields[4]) if len(fields) > 4 and len(fields[4]) else 0})
+        info = {"source": os.path.basename(self.header.data_file),
+                "sample_rate": self.header.sample_rate / self.decimation,
+                "decimation": self.decimation,
+                "dtype": self.sample_type,
+                "channels": names,
+                "units": units,
+                "resolution": [self._get_resolution(ch) for ch in range(self.header.channels)],
+                "markers": markers}
+        f = open(self.infofile, "w")
+        try:
+            json.dump(info, f, indent=1)
+        finally:
+            f.close()
+
+    def _write_vision_header(self):
+        ''' Write header and marker file of a VECTORIZED output file
+        '''
+        crlf = u"\n"
+        markerfile = os.path.splitext(self.outfile)[0] + ".vmrk"
+        f = codecs.open(self.header.filename, "r", "utf-8")
+        try:
+            lines = f.read().splitlines()
+        finally:
+            f.close()
+
+        h = u""
+        section = ""
+        for line in lines:
+            s = line.strip()
+            if s.startswith("[") and s.endswith("]"):
+                section = s[1:-1]
+            key = None
+            if "=" in s and not s.startswith(";"):
+                key, value = s.split("=", 1)
+            if section == "Common Infos":
+                if key == "DataFile":
+                    line = u"DataFile=" + os.path.basename(self.outfile)
+                elif key == "MarkerFile":
+                    line = u"MarkerFile=" + os.path.basename(markerfile)
+                elif key == "DataOrientation":
+                    line = u"DataOrientation=VECTORIZED"
+                elif s.startswith("; Data orientation"):
+                    line = u"; Data orientation: VECTORIZED=ch1,pt1, ch1,pt2 ..."
+                elif key == "DataPoints":
+                    continue
+                elif key == "SamplingInterval":
+                    line = u"SamplingInterval=%.5f"%(self.header.sampling_interval * self.decimation)
+                elif key == "NumberOfChannels":
+                    line += crlf + u"DataPoints=%d"%(self.out_samples)
+            elif section == "Binary Infos" and key == "BinaryFormat":
+                line = u"BinaryFormat=" + SAMPLE_TYPES[self.sample_type][1]
+            elif section == "Channel Infos" and key != None and key.startswith("Ch"):
+                fields = value.split(",")
+                while len(fields) < 4:
+                    fields.append(u"")
+                scale = float(fields[2] or 1.0) * self._get_resolution(int(key[2:]) - 1)
+                fields[2] = u"%.9g"%(scale)
+                line = key + u"=" + u",".join(fields)
+            h += line + crlf
+        f = open(self.infofile, "w")
+        try:
+            f.write(h.encode('utf-8'))
+        finally:
+            f.close()
+
+        # marker file
+        h =  u"Brain Vision Data Exchange Marker File, Version 1.0" + crlf
+        h += crlf
+        h += u"[Common Infos]" + crlf
+        h += u"Codepage=UTF-8" + crlf
+        h += u"DataFile=" + os.path.basename(self.outfile) + crlf
+        h += crlf
+        h += u"[Marker Infos]" + crlf
+        h += u"; Each entry: Mk<Marker number>=<Type>,<Description>,<Position in data points>," + crlf
+        h += u"; <Size in data points>, <Channel number (0 = marker is related to all channels)>" + crlf
+        h += u"; Fields are delimited by commas, some fields might be omitted (empty)." + crlf
+        h += u"; Commas in type or description text are coded as \"\\1\"." + crlf
+        for nr, fields in enumerate(self._read_markers()):
+            h += u"Mk%d=%s"%(nr + 1, u",".join(fields)) + crlf
+        f = open(markerfile, "w")
+        try:
+            f.write(h.encode('utf-8'))
+        finally:
+            f.close()
+
+
+def _read_tiles(segment):
+    ''' Read the segment tile by tile and decimate it
+    @return: generator of (first output sample, tile array samples x channels)
+    '''
+    f = open(segment.infile, "rb")
+    try:
+        first = segment.first
+        while first < segment.last:
+            count = min(segment.tile, segment.last - first)
+            f.seek(first * segment.channels * 4)
+            d = np.fromfile(f, np.float32, count * segment.channels).reshape(-1, segment.channels)
+            if segment.decimation > 1:
+                d = d.reshape(-1, segment.decimation, segment.channels).mean(axis=1)
+            yield first // segment.decimation, d
+            first += count
+    finally:
+        f.close()
+
+def _transpose(d):
+    ''' Get the channel-major copy of a tile (samples x channels), block by block
+    '''
+    out = np.empty((d.shape[1], d.shape[0]), d.dtype)
+    for s in range(0, d.shape[0], _TRANSPOSE_BLOCK):
+        out[:, s:s+_TRANSPOSE_BLOCK] = d[s:s+_TRANSPOSE_BLOCK].T
+    return out
+
+def _scan_segment(segment):
+    ''' Worker: get the maximum absolute value per channel
+    @return: job index, maximum values
+    '''
+    peak = np.zeros(segment.channels)
+    for first, d in _read_tiles(segment):
+        peak = np.maximum(peak, np.abs(d).max(axis=0))
+    return segment.index, peak
+
+def _convert_segment(segment):
+    ''' Worker: convert a segment into the channel-major output file
+    @return: job index, converted input samples, clipped values, worker time in seconds
+    '''
+    t = time.time()
+    dtype = SAMPLE_TYPES[segment.sample_type][0]
+    itemsize = np.dtype(dtype).itemsize
+    clipped = 0
+    f = open(segment.outfile, "r+b")
+    try:
+        for first, d in _read_tiles(segment):
+            tile = _transpose(d)
+            if segment.resolution is not None:
+                tile = np.round(tile / segment.resolution[:, np.newaxis])
+                limits = np.iinfo(dtype)
+                clipped += np.count_nonzero((tile < limits.min) | (tile > limits.max))
+                np.clip(tile, limits.min, limits.max, out=tile)
+            tile = tile.astype(dtype)
+            # each channel is a contiguous run in the output file
+            for ch in range(segment.channels):
+                f.seek(segment.offset + (ch * segment.out_samples + first) * itemsize)
+                tile[ch].tofile(f)
+    finally:
+        f.close()
+    return segment.index, segment.last - segment.first, clipped, time.time() - t
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] recording.vhdr ...")
+    parser.add_option("-f", "--format", dest="Format", type="choice", choices=["npy", "vectorized"], default="npy",
+                      help="output format npy or vectorized [default: %default]")
+    parser.add_option("-o", "--output", dest="Output", default="",
+                      help="output folder [default: folder of the recording]")
+    parser.add_option("-j", "--jobs", dest="Jobs", type="int", default=multiprocessing.cpu_count(),
+                      help="number of worker processes [default: %default]")
+    parser.add_option("-d", "--decimate", dest="Decimation", type="int", default=1,
+                      help="decimation factor, boxcar average [default: %default]")
+    parser.add_option("-q", "--quantize", dest="Quantize", type="choice", choices=sorted(SAMPLE_TYPES.keys()),
+                      default="float32", help="output sample type float32, int16 or int32 [default: %default]")
+    parser.add_option("-r", "--resolution", dest="Resolution", type="float", default=0.0,
+                      help="quantization resolution per bit, 0 = maximum range per channel [default: %default]")
+    parser.add_option("-m", "--memory", dest="Memory", type="float", default=64.0,
+                      help="tile memory per worker in MB [default: %default]")
+    options, files = parser.parse_args(args[1:])
+    if len(files) == 0:
+        parser.print_help()
+        return 1
+
+    ret = 0
+    jobs = []
+    for filename in files:
+        try:
+            job = ConversionJob(len(jobs), filename, options)
+            if job.out_samples == 0:
+                raise Exception("no data")
+            jobs.append(job)
+        except Exception as e:
+            print "%s: %s"%(filename, str(e))
+            ret = 1
+    if len(jobs) == 0:
+        return ret
+
+    workers = max(1, options.Jobs)
+    segments = []
+    for job in jobs:
+        segments += job.get_segments(2 * workers)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        imap = pool.imap_unordered
+    else:
+        pool = None
+        imap = map
+    t = time.time()
+    try:
+        # get the quantization resolution from the maximum values
+        scan = [s for s in segments if jobs[s.index].sample_type != "float32" and jobs[s.index].resolution is None]
+        if len(scan):
+            peaks = {}
+            for index, peak in imap(_scan_segment, scan):
+                peaks[index] = np.maximum(peaks.get(index, 0), peak)
+            for index, peak in peaks.items():
+                job = jobs[index]
+                limit = np.iinfo(SAMPLE_TYPES[job.sample_type][0]).max
+                job.resolution = np.where(peak > 0, peak / limit, 1.0)
+            for segment in scan:
+                segment.resolution = jobs[segment.index].resolution
+
+        for job in jobs:
+            job.create_output()
+        for segment in segments:
+            segment.offset = jobs[segment.index].data_offset
+
+        for index, samples, clipped, worktime in imap(_convert_segment, segments):
+            job = jobs[index]
+            job.done += samples
+            job.clipped += clipped
+            job.worktime += worktime
+            if job.done == job.out_samples * job.decimation:
+                size = job.done * job.header.frame_size / 1024.0**2
+                print "%s -> %s: %d channels, %d samples, %.1fMB, %.1fMB/s per worker%s"%(os.path.basename(job.header.data_file),
+                                                                                           os.path.basename(job.outfile),
+                                                                                           job.header.channels,
+                                                                                           job.out_samples,
+                                                                                           size, size / max(job.worktime, 1e-6),
+                                                                                           ", %d values clipped"%(job.clipped) if job.clipped else "")
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - t
+    total = sum([job.done * job.header.frame_size for job in jobs]) / 1024.0**2
+    print "%d files, %.1fMB in %.1fs, %.1fMB/s with %d workers"%(len(jobs), total, elapsed, total / max(elapsed, 1e-6), workers)
+    return ret
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+'''
+Data File Writers
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Output strategies for the data file of L{storage.StorageVision}. A writer is
+created with the data file name and provides write(), sync() and close().
+write() takes a contiguous numpy array and returns the number of bytes written.
+
+@version: 1.0
+'''
+
+import os
+import sys
+import io
+import mmap
+import time
+import platform
+import ctypes as ct
+import numpy as np
+
+from tools.journal import sync_file
+
+_libc = None
+
+def _clib():
+    ''' Load and configure the C runtime library
+    '''
+    global _libc
+    if _libc != None:
+        return _libc
+    try:
+        libc = ct.cdll.msvcrt # Windows
+    except:
+        libc = ct.CDLL("libc.so.6") # Linux
+
+    # set error handling for C library
+    def errcheck(res, func, args):
+        if not res:
+            raise IOError
+        return res
+    if platform.system() == 'Windows':
+        libc.w_fopen = libc._wfopen
+        libc.w_fopen.argtypes = [ct.c_wchar_p, ct.c_wchar_p]
+        libc.w_fileno = libc._fileno
+    else:
+        libc.w_fopen = libc.fopen
+        libc.w_fopen.argtypes = [ct.c_char_p, ct.c_char_p]
+        libc.w_fileno = libc.fileno
+    libc.w_fopen.restype = ct.c_void_p
+    libc.w_fopen.errcheck = errcheck
+    libc.fwrite.argtypes = [ct.c_void_p, ct.c_size_t, ct.c_size_t, ct.c_void_p]
+    libc.fflush.argtypes = [ct.c_void_p]
+    libc.fclose.argtypes = [ct.c_void_p]
+    libc.w_fileno.argtypes = [ct.c_void_p]
+    _libc = libc
+    return _libc
+
+
+class ClibWriter(object):
+    ''' Write through the C runtime library (fwrite), default for StorageVision
+    '''
+    def __init__(self, filename):
+        ''' Create the data file
+        @param filename: fully qualified file name
+        '''
+        self.filename = filename
+        self.libc = _clib()
+        if platform.system() == 'Windows':
+            self.handle = self.libc.w_fopen(unicode(filename), u"wb")
+        else:
+            self.handle = self.libc.w_fopen(filename.encode(sys.getfilesystemencoding()), "wb")
+
+    def write(self, data):
+        ''' Write a contiguous numpy array
+        @return: number of bytes written
+        '''
+        nitems = self.libc.fwrite(data.ctypes.data, data.itemsize, data.size, self.handle)
+        return nitems * data.itemsize
+
+    def sync(self):
+        ''' Flush the clib and OS buffers to disk
+        '''
+        self.libc.fflush(self.handle)
+        fd = self.libc.w_fileno(self.handle)
+        if platform.system() == 'Windows':
+            # the file descriptor belongs to msvcrt, not to the Python runtime
+            self.libc._commit(fd)
+        else:
+            sync_file(fd)
+
+    def close(self):
+        self.libc.fclose(self.handle)
+
+
+class BufferedWriter(object):
+    ''' Write through a Python buffered file object with a large buffer
+    '''
+    def __init__(self, filename, buffersize=4*1024**2):
+        ''' Create the data file
+        @param filename: fully qualified file name
+        @param buffersize: write buffer size in bytes
+        '''
+        self.filename = filename
+        self.file = io.open(filename, "wb", buffering=buffersize)
+
+    def write(self, data):
+        ''' Write a contiguous numpy array
+        @return: number of bytes written
+        '''
+        self.file.write(data.data)
+        return data.nbytes
+
+    def sync(self):
+        self.file.flush()
+        sync_file(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class MmapWriter(object):
+    ''' Copy into a memory mapped file, growing in fixed size chunks.
+    The file is truncated to the written size on close. After a crash the file
+    may have a zero padded tail, the recording journal holds the valid size.
+    '''
+    def __init__(self, filename, chunksize=64*1024**2):
+        ''' Create the data file
+        @param filename: fully qualified file name
+        @param chunksize: file growth in bytes, multiple of the allocation granularity
+        '''
+        self.filename = filename
+        self.chunksize = chunksize
+        self.file = open(filename, "w+b")
+        self.size = 0           #: bytes written
+        self.mapped = 0         #: size of the mapped file
+        self.map = None
+        self.view = None        #: numpy byte view of the mapping
+
+    def _grow(self, size):
+        ''' Extend the file and remap it
+        @param size: minimum required file size
+        '''
+        mapped = (size // self.chunksize + 1) * self.chunksize
+        self._unmap()
+        self.file.truncate(mapped)
+        self.map = mmap.mmap(self.file.fileno(), mapped)
+        self.view = np.frombuffer(self.map, np.uint8)
+        self.mapped = mapped
+
+    def _unmap(self):
+        if self.map != None:
+            self.view = None
+            self.map.close()
+            self.map = None
+
+    def write(self, data):
+        ''' Copy a contiguous numpy array into the mapping
+        @return: number of bytes written
+        '''
+        nbytes = data.nbytes
+        if self.size + nbytes > self.mapped:
+            self._grow(self.size + nbytes)
+        self.view[self.size:self.size+nbytes] = data.reshape(-1).view(np.uint8)
+        self.size += nbytes
+        return nbytes
+
+    def sync(self):
+        if self.map != None:
+            self.map.flush()
+        sync_file(self.file.fileno())
+
+    def close(self):
+        if self.map != None:
+            self.map.flush()
+        self._unmap()
+        self.file.truncate(self.size)
+        self.file.close()
+
+
+class SlowWriter(object):
+    ''' Writer shim simulating a slow or stalling disk. Each write is delayed by a
+    constant latency and limited to a maximum bandwidth, additionally a latency spike
+    is inserted at a fixed interval (e.g. flash controller garbage collection or
+    an external drive spinning up).
+    '''
+    def __init__(self, writer, latency=0.0, bandwidth=0.0, spike=0.0, interval=0.0):
+        ''' Wrap a data file writer
+        @param writer: writer object
+        @param latency: additional latency per write in seconds
+        @param bandwidth: maximum bandwidth in bytes per second (0 = unlimited)
+        @param spike: spike latency in seconds
+        @param interval: spike interval in seconds (0 = no spikes)
+        '''
+        self.writer = writer
+        self.filename = writer.filename
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.spike = spike
+        self.interval = interval
+        self.spike_timer = time.time()
+
+    def write(self, data):
+        delay = self.latency
+        if self.bandwidth > 0:
+            delay += data.nbytes / float(self.bandwidth)
+        if self.interval > 0 and time.time() - self.spike_timer >= self.interval:
+            delay += self.spike
+            self.spike_timer = time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return self.writer.write(data)
+
+    def sync(self):
+        self.writer.sync()
+
+    def close(self):
+        self.writer.close()
+
+
+#: available writers by name
+writers = {"fwrite": ClibWriter,
+           "buffered": BufferedWriter,
+           "mmap": MmapWriter}
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+'''
+Recording Journal and Recovery Tool
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+The journal (.vjrn) holds two alternating fixed size records. Each record
+contains the number of samples and markers that have been synced to disk,
+the corresponding data and marker file offsets and a CRC32. A torn write can
+only destroy the record being written, the other one stays valid.
+
+Recover a recording after a crash::
+
+    python -m tools.journal [--keep-unsynced] [--dry-run] recording.vhdr
+
+@version: 1.0
+'''
+
+import os
+import sys
+import time
+import shutil
+import zlib
+from struct import Struct
+from optparse import OptionParser
+
+from tools.vision import VisionHeader, header_from_data_file
+from tools.checksum import checksum_from_data_file, truncate_checksums
+
+
+# journal record: magic, sequence, flags, channels, samples, data offset, markers, marker offset, time
+_RECORD = Struct("<8sLLLQQLQd")
+_CRC = Struct("<L")
+_MAGIC = "PYCJRNL1"
+_SLOT_SIZE = 64
+
+class JournalFlags:
+    ''' Journal record flags
+    @ivar CLOSED: recording files have been closed regularly
+    '''
+    CLOSED = 0x0001
+
+
+class JournalRecord(object):
+    ''' Content of a single journal record
+    '''
+    def __init__(self, sequence=0, flags=0, channels=0, samples=0, data_offset=0,
+                 markers=0, marker_offset=0, timestamp=0.0):
+        self.sequence = sequence            #: record sequence number
+        self.flags = flags                  #: JournalFlags
+        self.channels = channels            #: number of channels
+        self.samples = samples              #: samples synced to data file
+        self.data_offset = data_offset      #: synced data file size in bytes
+        self.markers = markers              #: markers synced to marker file
+        self.marker_offset = marker_offset  #: synced marker file size in bytes
+        self.timestamp = timestamp          #: time of sync (seconds since epoch)
+
+    def pack(self):
+        ''' Get the binary record including CRC, padded to the slot size
+        '''
+        rec = _RECORD.pack(_MAGIC, self.sequence, self.flags, self.channels,
+                           self.samples, self.data_offset, self.markers,
+                           self.marker_offset, self.timestamp)
+        rec += _CRC.pack(zlib.crc32(rec) & 0xFFFFFFFF)
+        return rec + "\0" * (_SLOT_SIZE - len(rec))
+
+    def unpack(cls, raw):
+        ''' Create a record from binary slot data
+        @return: JournalRecord or None if the record is not valid
+        '''
+        size = _RECORD.size + _CRC.size
+        if len(raw) < size:
+            return None
+        crc, = _CRC.unpack(raw[_RECORD.size:size])
+        if crc != zlib.crc32(raw[:_RECORD.size]) & 0xFFFFFFFF:
+            return None
+        values = _RECORD.unpack(raw[:_RECORD.size])
+        if values[0] != _MAGIC:
+            return None
+        return cls(*values[1:])
+    unpack = classmethod(unpack)
+
+
+class RecordingJournal(object):
+    ''' Periodically synced recording journal, used by the storage module
+    '''
+    def __init__(self, filename, channels):
+        ''' Create the journal file
+        @param filename: journal file name (.vjrn)
+        @param channels: number of recorded channels
+        '''
+        self.filename = filename
+        self.channels = channels
+        self.sequence = 0
+        self.syncs = 0              #: number of journal updates
+        self.synctime = 0.0         #: cumulated sync time in seconds
+        self.synctime_max = 0.0     #: maximum sync time in seconds
+        self.file = open(filename, "w+b")
+        self.file.write("\0" * (2 * _SLOT_SIZE))
+        self.file.flush()
+
+    def update(self, samples, data_offset, markers, marker_offset, flags=0):
+        ''' Write the next record to the alternate slot and sync it to disk.
+        The caller has to sync the data and marker files before.
+        '''
+        rec = JournalRecord(self.sequence, flags, self.channels, samples, data_offset,
+                            markers, marker_offset, time.time())
+        self.file.seek((self.sequence % 2) * _SLOT_SIZE)
+        self.file.write(rec.pack())
+        self.file.flush()
+        sync_file(self.file.fileno())
+        self.sequence += 1
+
+    def add_synctime(self, synctime):
+        ''' Update the sync time statistics
+        @param synctime: time in seconds used for the last sync of all files
+        '''
+        self.syncs += 1
+        self.synctime += synctime
+        self.synctime_max = max(self.synctime_max, synctime)
+
+    def get_statistics(self, duration):
+        ''' Get the sync cost as log text
+        @param duration: recording duration in seconds
+        '''
+        if self.syncs == 0:
+            return "journal: no syncs"
+        mean = self.synctime / self.syncs
+        if duration > 0:
+            load = self.synctime / duration * 100.0
+        else:
+            load = 0.0
+        return "journal: %d syncs, %.1fms mean, %.1fms max, %.2f%% of recording time"%(self.syncs,
+                                                                                        mean * 1000.0,
+                                                                                        self.synctime_max * 1000.0,
+                                                                                        load)
+
+    def close(self):
+        self.file.close()
+
+    def read(cls, filename):
+        ''' Get the latest valid record from a journal file
+        @param filename: journal file name
+        @return: JournalRecord or None
+        '''
+        f = open(filename, "rb")
+        try:
+            raw = f.read(2 * _SLOT_SIZE)
+        finally:
+            f.close()
+        records = [JournalRecord.unpack(raw[s:s+_SLOT_SIZE]) for s in (0, _SLOT_SIZE)]
+        records = [r for r in records if r != None]
+        if len(records) == 0:
+            return None
+        return max(records, key=lambda r: r.sequence)
+    read = classmethod(read)
+
+
+def journal_from_data_file(filename):
+    ''' Get the journal file name for a data, marker or header file name
+    '''
+    return os.path.splitext(filename)[0] + ".vjrn"
+
+
+def sync_file(fd):
+    ''' Flush the OS buffers of a file descriptor to disk.
+    fdatasync() is used where available because it skips the metadata update.
+    '''
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+def repair_markers(markerfile, samples):
+    ''' Remove torn and out of range marker entries and renumber the remaining markers
+    @param markerfile: marker file name
+    @param samples: number of samples in the data file
+    @return: number of valid markers, number of removed entries
+    '''
+    f = open(markerfile, "rb")
+    try:
+        raw = f.read()
+    finally:
+        f.close()
+    # keep the line terminator of the original file
+    crlf = "\r\n" if "\r\n" in raw else "\n"
+    # the last line is torn if it is not terminated
+    lines = raw.split("\n")
+    torn = lines.pop()
+    removed = 1 if len(torn.strip()) else 0
+
+    header = []
+    markers = []
+    for line in lines:
+        line = line.rstrip("\r")
+        if not line.startswith("Mk"):
+            if len(markers) == 0:
+                header.append(line)
+            continue
+        try:
+            key, value = line.split("=", 1)
+            int(key[2:])
+            fields = value.split(",")
+            position = int(fields[2])
+            int(fields[3])
+            int(fields[4])
+        except Exception:
+            removed += 1
+            continue
+        if position > samples:
+            removed += 1
+            continue
+        markers.append(value)
+
+    # the first marker has to be a new segment marker
+    if len(markers) == 0 or not markers[0].startswith("New Segment,"):
+        markers.insert(0, "New Segment,,1,1,0")
+
+    # keep a copy of the original file, then rewrite it
+    shutil.copyfile(markerfile, markerfile + ".bak")
+    f = open(markerfile, "wb")
+    try:
+        for line in header:
+            f.write(line + crlf)
+        for nr, value in enumerate(markers):
+            f.write("Mk%d=%s"%(nr + 1, value) + crlf)
+        f.flush()
+        sync_file(f.fileno())
+    finally:
+        f.close()
+    return len(markers), removed
+
+
+def recover(filename, keep_unsynced=False, dry_run=False):
+    ''' Truncate the data file to the last consistent sample and repair the marker file
+    @param filename: header, data or marker file name of the recording
+    @param keep_unsynced: keep complete samples written after the last journal update
+    @param dry_run: report only, don't modify any file
+    @return: report as list of text lines
+    '''
+    header = VisionHeader(header_from_data_file(filename))
+    report = []
+    frame = header.frame_size
+    size = os.path.getsize(header.data_file)
+    complete = size // frame * frame
+    target = complete
+
+    journalfile = journal_from_data_file(header.data_file)
+    record = None
+    if os.path.exists(journalfile):
+        record = RecordingJournal.read(journalfile)
+    if record == None:
+        report.append("no valid journal record, using the last complete sample")
+    else:
+        if record.channels != header.channels:
+            raise Exception("journal channel count %d doesn't match header (%d)"%(record.channels, header.channels))
+        if record.flags & JournalFlags.CLOSED:
+            report.append("recording has been closed regularly")
+        report.append("journal: %d samples, %d markers synced at %s"%(record.samples, record.markers,
+                                                                      time.strftime("%Y-%m-%d %H:%M:%S",
+                                                                                    time.localtime(record.timestamp))))
+        if not keep_unsynced:
+            target = min(complete, record.data_offset)
+
+    report.append("data file: %d bytes, %d complete samples, truncate to %d samples (%d bytes removed)"%(size,
+                                                                                                           size // frame,
+                                                                                                           target // frame,
+                                                                                                           size - target))
+    if dry_run:
+        return report
+
+    if target != size:
+        f = open(header.data_file, "r+b")
+        try:
+            f.truncate(target)
+            f.flush()
+            sync_file(f.fileno())
+        finally:
+            f.close()
+
+    checksumfile = checksum_from_data_file(header.data_file)
+    if os.path.exists(checksumfile) and target < size:
+        removed = truncate_checksums(checksumfile, target, size)
+        report.append("checksum file: %d checksums removed"%(removed))
+
+    if len(header.marker_file) and os.path.exists(header.marker_file):
+        markers, removed = repair_markers(header.marker_file, target // frame)
+        report.append("marker file: %d markers, %d entries removed"%(markers, removed))
+    else:
+        report.append("marker file not found")
+    return report
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] recording.vhdr ...")
+    parser.add_option("-k", "--keep-unsynced", dest="KeepUnsynced", action="store_true", default=False,
+                      help="keep complete samples written after the last journal update")
+    parser.add_option("-n", "--dry-run", dest="DryRun", action="store_true", default=False,
+                      help="report only, don't modify files")
+    options, files = parser.parse_args(args[1:])
+    if len(files) == 0:
+        parser.print_help()
+        return 1
+    ret = 0
+    for filename in files:
+        print filename
+        try:
+            for line in recover(filename, options.KeepUnsynced, options.DryRun):
+                print "    " + line
+        except Exception as e:
+            print "    failed: " + str(e)
+            ret = 1
+    return ret
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
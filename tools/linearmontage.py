@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+'''
+Linear Channel Montage
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Channel selection, reference subtraction and derivations compiled into a
+single linear operator (output = W * input). The operator is built once when
+the channel configuration changes and applied to each data block either as
+one gather-subtract pass (selection and averaged reference) or as one
+sparse-dense product (arbitrary derivations).
+
+The derivation builders return sparse weight matrices (outputs x inputs):
+    - L{bipolar}: difference of channel pairs
+    - L{common_average}: channels minus the average of all channels
+    - L{laplacian}: center channel minus the weighted average of its neighbours
+    - L{weight_matrix}: custom weights
+
+@version: 1.0
+'''
+
+import numpy as np
+from scipy import sparse
+
+
+def weight_matrix(rows, inputs):
+    ''' Build a sparse weight matrix from row definitions
+    @param rows: list of dictionaries {input index: weight}, one for each output channel
+    @param inputs: number of input channels
+    @return: sparse matrix (outputs x inputs)
+    '''
+    r, c, w = [], [], []
+    for row, weights in enumerate(rows):
+        for col, weight in weights.items():
+            r.append(row)
+            c.append(col)
+            w.append(weight)
+    # duplicate entries are summed up
+    return sparse.coo_matrix((w, (r, c)), shape=(len(rows), inputs)).tocsr()
+
+
+def bipolar(pairs, inputs):
+    ''' Bipolar derivations
+    @param pairs: list of (positive, negative) input indices
+    @param inputs: number of input channels
+    @return: sparse matrix (pairs x inputs)
+    '''
+    return weight_matrix([{p: 1.0, n: -1.0} for p, n in pairs], inputs)
+
+
+def common_average(indices, inputs, average=None):
+    ''' Common average reference
+    @param indices: input indices of the output channels
+    @param inputs: number of input channels
+    @param average: input indices of the averaged channels, None = indices
+    @return: sparse matrix (indices x inputs)
+    '''
+    if average is None:
+        average = indices
+    rows = []
+    for idx in indices:
+        weights = dict([(a, -1.0 / len(average)) for a in average])
+        weights[idx] = weights.get(idx, 0.0) + 1.0
+        rows.append(weights)
+    return weight_matrix(rows, inputs)
+
+
+def laplacian(center, neighbours, inputs, weights=None):
+    ''' Surface Laplacian (Hjorth) derivation of a single channel
+    @param center: input index of the center channel
+    @param neighbours: input indices of the neighbour channels
+    @param inputs: number of input channels
+    @param weights: neighbour weights, e.g. inverse distances, normalized to a sum of 1, None = equal weights
+    @return: sparse matrix (1 x inputs)
+    '''
+    if weights is None:
+        weights = np.ones(len(neighbours))
+    weights = np.asarray(weights, dtype=np.float64)
+    weights = weights / weights.sum()
+    row = {center: 1.0}
+    for n, w in zip(neighbours, weights):
+        row[n] = row.get(n, 0.0) - w
+    return weight_matrix([row], inputs)
+
+
+class LinearMontage(object):
+    ''' Precompiled channel operator: selection, averaged reference and re-referencing
+    or arbitrary sparse weights
+    '''
+    def __init__(self, inputs, indices=None, ref=None, rereference=None, weights=None):
+        ''' Compile the operator
+        @param inputs: number of input channels
+        @param indices: input channel index of each output channel, None = all input channels
+        @param ref: input indices of the reference channels, the reference is the average of these channels
+        @param rereference: input indices of the channels to subtract the reference from, None = all
+        @param weights: weight matrix (outputs x inputs), replaces indices and reference
+        '''
+        self.inputs = inputs
+        self.weights = None
+        if weights is not None:
+            self.weights = sparse.csr_matrix(weights, dtype=np.float64)
+            if self.weights.shape[1] != inputs:
+                raise ValueError("weight matrix has %d columns, expected %d"%(self.weights.shape[1], inputs))
+            self.indices = None
+            self.ref = np.array([], dtype=np.intp)
+            self.rows = self.ref
+            self.subtract = False
+            self.selection = False
+            self.identity = False
+            return
+
+        if indices is None:
+            indices = np.arange(inputs)
+        self.indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+        if ref is None:
+            ref = []
+        self.ref = np.asarray(ref, dtype=np.intp).reshape(-1)
+
+        # output rows to subtract the reference from
+        if len(self.ref) == 0:
+            rows = np.array([], dtype=np.intp)
+        elif rereference is None:
+            rows = np.arange(len(self.indices))
+        else:
+            rows = np.nonzero(np.in1d(self.indices, np.asarray(rereference, dtype=np.intp)))[0]
+        self.rows = self._as_slice(rows)
+        self.subtract = len(rows) > 0
+
+        # keep the input block if the operator doesn't change anything
+        self.selection = np.array_equal(self.indices, np.arange(inputs))
+        self.identity = self.selection and not self.subtract
+
+    @staticmethod
+    def _as_slice(indices):
+        ''' Contiguous rows are addressed as slice, subtraction works in place without temporary copies
+        @param indices: sorted index array
+        @return: slice or index array
+        '''
+        if len(indices) and np.all(np.diff(indices) == 1):
+            return slice(int(indices[0]), int(indices[-1]) + 1)
+        return indices
+
+    @property
+    def outputs(self):
+        ''' Number of output channels
+        '''
+        if self.weights is not None:
+            return self.weights.shape[0]
+        return len(self.indices)
+
+    def sparse_matrix(self):
+        ''' Get the operator as sparse weight matrix
+        @return: sparse matrix (outputs x inputs)
+        '''
+        if self.weights is not None:
+            return self.weights
+        rows = [np.arange(self.outputs)]
+        cols = [self.indices]
+        values = [np.ones(self.outputs)]
+        if self.subtract:
+            sub = np.arange(self.outputs)[self.rows]
+            rows.append(np.repeat(sub, len(self.ref)))
+            cols.append(np.tile(self.ref, len(sub)))
+            values.append(np.empty(len(sub) * len(self.ref)))
+            values[-1].fill(-1.0 / len(self.ref))
+        m = sparse.coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                              shape=(self.outputs, self.inputs))
+        return m.tocsr()
+
+    def matrix(self):
+        ''' Get the operator as dense weight matrix
+        @return: array (outputs x inputs)
+        '''
+        return self.sparse_matrix().toarray()
+
+    def derive(self, weights, keep=True):
+        ''' Combine the outputs of this operator with derivation weights into a single operator
+        @param weights: derivation weight matrix (derivations x outputs) or list of matrices
+        @param keep: keep the outputs of this operator in front of the derived channels
+        @return: LinearMontage, applied as one sparse-dense product
+        '''
+        if isinstance(weights, list):
+            weights = sparse.vstack(weights)
+        m = self.sparse_matrix()
+        d = sparse.csr_matrix(weights, dtype=np.float64) * m
+        if keep:
+            d = sparse.vstack([m, d])
+        return LinearMontage(self.inputs, weights=d)
+
+    def apply(self, data, inplace=False):
+        ''' Apply the operator to a data block
+        @param data: array (inputs x points)
+        @param inplace: input data may be overwritten if the operator selects all channels
+        @return: array (outputs x points)
+        '''
+        if self.identity:
+            return data
+        if self.weights is not None:
+            return self.weights.dot(data)
+        reference = None
+        if self.subtract:
+            if len(self.ref) == 1:
+                reference = data[self.ref[0]]
+            else:
+                reference = np.mean(data.take(self.ref, axis=0), 0)
+        if self.selection and inplace:
+            if len(self.ref) == 1:
+                reference = reference.copy()
+            out = data
+        else:
+            out = data.take(self.indices, axis=0)
+        if self.subtract:
+            out[self.rows] -= reference
+        return out
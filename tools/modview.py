@@ -223,7 +223,7 @@ class _DataTableModel(Qt.QAbstractTableModel):
         variable_name = self.columns[column]['variable']
         # get variable value
         if hasattr(data, variable_name):
-            d = Qt.QVariant(vars(data)[variable_name])
+            d = Qt.QVariant(getattr(data, variable_name))
             # get value from combobox list values?
             if self.columns[column].has_key('indexed') and self.cblist.has_key(variable_name):
                 idx, ok = d.toInt()
@@ -259,18 +259,18 @@ class _DataTableModel(Qt.QAbstractTableModel):
             
         # set variable value
         if hasattr(data, variable_name):
-            t = type(vars(data)[variable_name])
+            t = type(getattr(data, variable_name))
             if t is bool:
-                vars(data)[variable_name] = value.toBool()
+                setattr(data, variable_name, value.toBool())
                 return True
             elif t is float:
-                vars(data)[variable_name] = value.toDouble()[0]
+                setattr(data, variable_name, value.toDouble()[0])
                 return True
             elif t is int:
-                vars(data)[variable_name] = value.toInt()[0]
+                setattr(data, variable_name, value.toInt()[0])
                 return True
             elif t in types.StringTypes:
-                vars(data)[variable_name] = "%s" % value.toString()
+                setattr(data, variable_name, "%s" % value.toString())
                 return True
             else:
                 return False
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+'''
+Linear Montage Benchmark
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Measures the time per data block of the L{tools.linearmontage.LinearMontage}
+operators for different channel counts. Each montage is applied as dense
+matrix product, as sparse-dense product and, for the averaged reference, as
+gather-subtract kernel. All methods are checked against the dense result::
+
+    python -m tools.montagebench [options] [result.json]
+
+@version: 1.0
+'''
+
+import sys
+import time
+import json
+from optparse import OptionParser
+
+import numpy as np
+from scipy import sparse
+
+from tools.linearmontage import LinearMontage, bipolar, common_average, laplacian
+
+#: channel counts for the available actiChamp module configurations
+CHANNELS = [32, 64, 96, 128, 160]
+#: benchmarked montages
+MONTAGES = ["reference", "bipolar", "car", "laplacian"]
+
+
+def create_montage(name, channels):
+    ''' Create a montage operator for the benchmark
+    @param name: montage name, see MONTAGES
+    @param channels: number of input channels
+    @return: LinearMontage
+    '''
+    if name == "reference":
+        # two averaged reference channels at the end, removed from the output
+        return LinearMontage(channels, np.arange(channels - 2), [channels - 2, channels - 1])
+    if name == "bipolar":
+        # chain of neighbouring channels
+        weights = bipolar([(n, n + 1) for n in range(channels - 1)], channels)
+    elif name == "car":
+        weights = common_average(range(channels), channels)
+    elif name == "laplacian":
+        # channels arranged on a ring, four neighbours each
+        weights = sparse.vstack([laplacian(n, [(n + d) % channels for d in (-2, -1, 1, 2)], channels)
+                                 for n in range(channels)])
+    else:
+        raise ValueError("unknown montage '%s'"%(name))
+    return LinearMontage(channels, weights=weights)
+
+
+def _measure(function, repeat):
+    ''' Get the median execution time in ms
+    '''
+    times = []
+    for n in range(repeat):
+        t = time.time()
+        function()
+        times.append(time.time() - t)
+    return round(np.median(times) * 1000.0, 4)
+
+
+def run(options, channels, montages):
+    ''' Run all combinations of channel counts and montages
+    @return: list of result dictionaries
+    '''
+    points = max(1, int(options.Rate * options.Block / 1000.0))
+    results = []
+    for count in channels:
+        data = np.random.uniform(-1000.0, 1000.0, (count, points))
+        for name in montages:
+            op = create_montage(name, count)
+            dense = op.matrix()
+            weights = op.sparse_matrix()
+            expected = np.dot(dense, data)
+            result = {"montage": name, "channels": count, "outputs": op.outputs, "points": points,
+                      "nonzero": int(weights.nnz), "density": round(weights.nnz / float(dense.size), 4)}
+            methods = {"dense": lambda: np.dot(dense, data),
+                       "sparse": lambda: weights.dot(data)}
+            if op.weights is None:
+                methods["gather"] = lambda: op.apply(data)
+            for method, function in methods.items():
+                if not np.allclose(function(), expected):
+                    raise Exception("%s %d channels: %s result differs"%(name, count, method))
+                result[method + "_ms"] = _measure(function, options.Repeat)
+            results.append(result)
+    return results
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] [result.json]")
+    parser.add_option("-c", "--channels", dest="Channels", default=",".join([str(c) for c in CHANNELS]),
+                      help="channel counts, comma separated [default: %default]")
+    parser.add_option("-m", "--montages", dest="Montages", default=",".join(MONTAGES),
+                      help="montages, comma separated [default: %default]")
+    parser.add_option("-r", "--rate", dest="Rate", type="float", default=10000.0,
+                      help="sample rate in Hz [default: %default]")
+    parser.add_option("-b", "--block", dest="Block", type="float", default=60.0,
+                      help="amplifier block interval in ms [default: %default]")
+    parser.add_option("-n", "--repeat", dest="Repeat", type="int", default=50,
+                      help="repetitions per measurement [default: %default]")
+    options, files = parser.parse_args(args[1:])
+    try:
+        channels = [int(c) for c in options.Channels.split(",")]
+    except ValueError as e:
+        parser.error(str(e))
+    montages = options.Montages.split(",")
+    for name in montages:
+        if name not in MONTAGES:
+            parser.error("unknown montage '%s', available: %s"%(name, ", ".join(MONTAGES)))
+    if min(channels) < 4 or options.Repeat < 1:
+        parser.error("at least 4 channels and 1 repetition required")
+
+    results = run(options, channels, montages)
+    if len(files):
+        f = open(files[0], "w")
+        try:
+            f.write(json.dumps(results, indent=2, sort_keys=True))
+        finally:
+            f.close()
+
+    print "%-10s %8s %8s %8s %10s %10s %10s"%("montage", "channels", "outputs", "density",
+                                             "dense ms", "sparse ms", "gather ms")
+    for r in results:
+        gather = "%10.4f"%(r["gather_ms"]) if "gather_ms" in r else "%10s"%("-")
+        print "%-10s %8d %8d %8.4f %10.4f %10.4f %s"%(r["montage"], r["channels"], r["outputs"], r["density"],
+                                                      r["dense_ms"], r["sparse_ms"], gather)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
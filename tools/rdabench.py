@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+'''
+RDA Server Load Generator and Multi Client Benchmark
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Runs L{rda_server.RDA_Server} without GUI and feeds it synthetic data blocks
+in real time. N client processes connect on the RDA port and parse the data
+messages. The first two channels carry the sample counter (low and high
+16 bits, exact in float32). Clients use it to measure the end to end latency
+from the end of a block to its reception.
+
+Measured values:
+    - server: process CPU load, process_input() time per block, client queue overruns
+    - clients: throughput, missing blocks, latency percentiles
+
+The results are written as JSON for regression comparison::
+
+    python -m tools.rdabench [options] [result.json]
+
+The RDA port (51244) must not be in use, i.e. PyCorder must not be running.
+
+@version: 1.0
+'''
+
+import os
+import sys
+import time
+import copy
+import json
+import datetime
+import multiprocessing
+from socket import *
+from struct import Struct
+from optparse import OptionParser
+
+import numpy as np
+
+from modbase import EEG_DataBlock, EEG_Marker, ModuleEvent, EventType
+from rda_server import RDA_Server, RDAMessageType
+
+
+_HEADER = Struct("<16sLL")
+_DATA = Struct("<LLL")
+_START = Struct("<Ld")
+
+
+def _percentiles(values):
+    ''' Get p50, p95, p99 and max in ms
+    '''
+    if len(values) == 0:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    p = np.percentile(values, [50, 95, 99, 100]) * 1000.0
+    return {"p50": round(p[0], 3), "p95": round(p[1], 3), "p99": round(p[2], 3), "max": round(p[3], 3)}
+
+
+def _recv_message(sock, header):
+    ''' Receive a complete message
+    @param header: preallocated header buffer (24 bytes)
+    @return: message type, message data (bytearray)
+    '''
+    view = memoryview(header)
+    received = 0
+    while received < len(header):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise EOFError
+        received += n
+    guid, size, type = _HEADER.unpack_from(header)
+    data = bytearray(size - _HEADER.size)
+    view = memoryview(data)
+    received = 0
+    while received < len(data):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise EOFError
+        received += n
+    return type, data
+
+
+def _client_process(index, port, start_time, delay, timeout, results):
+    ''' RDA client process, parses all messages until the server stops
+    @param index: client number
+    @param port: RDA server port
+    @param start_time: multiprocessing.Value, time of sample counter 0
+    @param delay: additional processing time per data message in seconds (slow client)
+    @param timeout: maximum run time in seconds
+    @param results: multiprocessing.Queue for the result dictionary
+    '''
+    result = {"client": index, "blocks": 0, "missing": 0, "bytes": 0, "points": 0}
+    latency = []
+    sock = socket(AF_INET, SOCK_STREAM)
+    end = time.time() + timeout
+    while True:
+        try:
+            sock.connect(("localhost", port))
+            break
+        except error:
+            if time.time() > end:
+                result["error"] = "connection failed"
+                results.put(result)
+                return
+            time.sleep(0.05)
+    sock.settimeout(max(1.0, end - time.time()))
+
+    header = bytearray(_HEADER.size)
+    channels = 0
+    rate = 1.0
+    last = None
+    first = None
+    try:
+        while time.time() < end:
+            type, data = _recv_message(sock, header)
+            if type == RDAMessageType.START:
+                channels, interval = _START.unpack_from(data)
+                rate = 1e6 / interval
+            elif type == RDAMessageType.DATA32 and channels > 0:
+                now = time.time()
+                block, points, markers = _DATA.unpack_from(data)
+                samples = np.frombuffer(data, np.float32, points * channels, _DATA.size).reshape(points, channels)
+                # sample counter of the last point, the block has been complete at its end
+                counter = int(samples[-1, 1]) * 65536 + int(samples[-1, 0])
+                latency.append(now - (start_time.value + (counter + 1) / rate))
+                if last != None and block != last + 1:
+                    result["missing"] += block - last - 1
+                last = block
+                if first == None:
+                    first = now
+                result["blocks"] += 1
+                result["points"] += points
+                result["bytes"] += len(data) + _HEADER.size
+                if delay > 0:
+                    time.sleep(delay)
+            elif type == RDAMessageType.STOP:
+                break
+    except (EOFError, error) as e:
+        result["error"] = str(e) or "connection closed"
+    sock.close()
+    elapsed = time.time() - first if first != None else 0.0
+    result["mb_per_s"] = round(result["bytes"] / 1024.0**2 / max(elapsed, 1e-9), 3)
+    result["latency_ms"] = _percentiles(latency)
+    results.put(result)
+
+
+def run(options):
+    ''' Stream synthetic data to the client processes
+    @param options: command line options
+    @return: result dictionary
+    '''
+    server = RDA_Server()
+    server.replay_length = 0.0
+    server.showClientErrors = True
+    overruns = [0]
+    send_event = server.send_event
+    def count_event(event):
+        if event.type == EventType.ERROR and "FULL" in str(event.info):
+            overruns[0] += 1
+        else:
+            send_event(event)
+    server.send_event = count_event
+
+    channels = max(2, options.Channels)
+    params = EEG_DataBlock(channels, 0)
+    params.sample_rate = options.Rate
+    start_time = multiprocessing.Value("d", 0.0)
+    results = multiprocessing.Queue()
+    clients = []
+    try:
+        server.process_update(params)
+        timeout = options.Duration + 30.0
+        for n in range(options.Clients):
+            delay = options.Delay / 1000.0 if n < options.Slow else 0.0
+            p = multiprocessing.Process(target=_client_process,
+                                        args=(n, server.PORT, start_time, delay, timeout, results))
+            p.start()
+            clients.append(p)
+
+        # wait for all clients, including the replay hold time
+        end = time.time() + 10.0
+        while len(server.clients) < options.Clients and time.time() < end:
+            time.sleep(0.05)
+        time.sleep(0.2)
+        connected = len(server.clients)
+
+        points = max(1, int(options.Rate * options.Block / 1000.0))
+        blocktime = points / options.Rate
+        blocks = max(1, int(options.Duration / blocktime))
+        block = copy.copy(params)
+        block.eeg_channels = np.random.uniform(-1000.0, 1000.0, (channels, points))
+        marker_interval = max(1, int(1.0 / blocktime))
+        process = []
+
+        server.process_start()
+        t0 = time.time()
+        start_time.value = t0
+        cpu0 = sum(os.times()[:2])
+        for n in xrange(blocks):
+            counter = np.arange(n * points, (n + 1) * points, dtype=np.uint64)
+            # keep the amplifier pace, the block is complete at its last sample
+            wait = t0 + (n + 1) * blocktime - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            block.eeg_channels[0] = counter % 65536
+            block.eeg_channels[1] = counter // 65536
+            block.sample_channel = counter.reshape(1, -1)
+            block.block_time = datetime.datetime.now()
+            block.markers = []
+            if n % marker_interval == 0:
+                block.markers = [EEG_Marker(type="Stimulus", description="S  1", position=n * points)]
+            t = time.time()
+            server.process_input(block)
+            process.append(time.time() - t)
+        elapsed = time.time() - t0
+        cpu = sum(os.times()[:2]) - cpu0
+        server.process_stop()
+
+        client_results = []
+        for p in clients:
+            try:
+                client_results.append(results.get(timeout=options.Duration + 30.0))
+            except Exception:
+                break
+    finally:
+        server.terminate()
+        for p in clients:
+            p.join(5.0)
+            if p.is_alive():
+                p.terminate()
+
+    client_results.sort(key=lambda r: r["client"])
+    return {"config": {"rate": options.Rate, "channels": channels, "clients": options.Clients,
+                       "connected": connected, "block_ms": options.Block, "duration": options.Duration,
+                       "slow_clients": options.Slow, "slow_delay_ms": options.Delay},
+            "server": {"blocks": blocks,
+                       "cpu_percent": round(cpu / elapsed * 100.0, 2),
+                       "mb_per_s": round(blocks * points * channels * 4 / 1024.0**2 / elapsed, 3),
+                       "process_ms": _percentiles(process),
+                       "overruns": overruns[0]},
+            "clients": client_results}
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] [result.json]")
+    parser.add_option("-r", "--rate", dest="Rate", type="float", default=100000.0,
+                      help="sample rate in Hz [default: %default]")
+    parser.add_option("-c", "--channels", dest="Channels", type="int", default=64,
+                      help="number of channels, at least 2 [default: %default]")
+    parser.add_option("-n", "--clients", dest="Clients", type="int", default=4,
+                      help="number of client processes [default: %default]")
+    parser.add_option("-d", "--duration", dest="Duration", type="float", default=10.0,
+                      help="streaming time in seconds [default: %default]")
+    parser.add_option("-b", "--block", dest="Block", type="float", default=60.0,
+                      help="amplifier block interval in ms [default: %default]")
+    parser.add_option("--slow", dest="Slow", type="int", default=0,
+                      help="number of slow clients [default: %default]")
+    parser.add_option("--delay", dest="Delay", type="float", default=100.0,
+                      help="slow client processing time per message in ms [default: %default]")
+    options, files = parser.parse_args(args[1:])
+    if options.Clients < 1 or options.Rate <= 0 or options.Duration <= 0:
+        parser.error("clients, rate and duration have to be greater than 0")
+
+    result = run(options)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if len(files):
+        f = open(files[0], "w")
+        try:
+            f.write(text)
+        finally:
+            f.close()
+    else:
+        print text
+
+    server = result["server"]
+    print >> sys.stderr, "server: CPU %.1f%%, process_input p95 %.2fms, %d overruns"%(server["cpu_percent"],
+                                                                                   server["process_ms"]["p95"],
+                                                                                   server["overruns"])
+    missing = 0
+    for client in result["clients"]:
+        print >> sys.stderr, "client %d: %d blocks, %d missing, %.1f MB/s, latency p50 %.1fms p99 %.1fms"%(
+                                client["client"], client["blocks"], client["missing"], client["mb_per_s"],
+                                client["latency_ms"]["p50"], client["latency_ms"]["p99"])
+        missing += client["missing"]
+    if len(result["clients"]) < options.Clients or server["overruns"] or missing:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
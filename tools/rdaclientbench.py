@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+'''
+RDA Client Throughput Benchmark
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+A local server thread sends prebuilt RDA data messages as fast as possible.
+The receive thread of L{rda_client.RDA_Client} reads them and each message is
+decoded by process_input() in the same thread, so the measured rate is the
+receive and decode throughput of the client without the module queues::
+
+    python -m tools.rdaclientbench [options]
+
+@version: 1.0
+'''
+
+import os
+import sys
+import time
+import threading
+from socket import *
+from struct import Struct
+from binascii import unhexlify
+from optparse import OptionParser
+
+import numpy as np
+from PyQt4 import Qt
+
+from modbase import EEG_DataBlock
+from rda_client import RDA_Client, RDAMessageType, _MSG_GUID
+
+
+class _DataServer(threading.Thread):
+    ''' Local RDA server sending a fixed number of data messages
+    '''
+    def __init__(self, channels, points, blocks, markers, data16):
+        ''' Build the message payload and open the server socket
+        @param channels: number of channels
+        @param points: data points per message
+        @param blocks: number of messages
+        @param markers: markers per message
+        @param data16: send 16-bit instead of float data
+        '''
+        threading.Thread.__init__(self)
+        self.blocks = blocks
+        self.points = points
+        self.markercount = markers
+        if data16:
+            self.type = RDAMessageType.DATA16
+            data = np.random.randint(-32768, 32767, (points, channels)).astype("<i2")
+        else:
+            self.type = RDAMessageType.DATA32
+            data = np.random.uniform(-1000.0, 1000.0, (points, channels)).astype("<f4")
+        marker = Struct("<LlLl")
+        text = "Stimulus\0S  1\0"
+        mkr = "".join([marker.pack(marker.size + len(text), n * points // max(1, markers), 1, -1) + text
+                       for n in range(markers)])
+        self.payload = data.tostring() + mkr   #: data and markers, shared by all messages
+        self.header = Struct("<16sLLLLL")       #: RDA header, block number, points, markers
+        self.size = self.header.size + len(self.payload)
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.bind(("localhost", 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        client, addr = self.sock.accept()
+        guid = unhexlify(_MSG_GUID)
+        try:
+            for block in xrange(self.blocks):
+                client.sendall(self.header.pack(guid, self.size, self.type, block, self.points, self.markercount))
+                client.sendall(self.payload)
+        except error:
+            pass
+        client.close()
+        self.sock.close()
+
+
+class BenchmarkResult(object):
+    ''' Measurement results of a single benchmark run
+    '''
+    def __init__(self):
+        self.blocks = 0         #: received messages
+        self.samples = 0        #: data points delivered by process_output()
+        self.markers = 0        #: markers delivered by process_output()
+        self.bytes = 0          #: received message bytes
+        self.elapsed = 0.0      #: time from the first to the last message in s
+        self.cpu = 0.0          #: process CPU time in s
+        self.t0 = 0.0           #: time of the first message
+        self.cpu0 = 0.0         #: process CPU time at the first message
+
+    def get_text(self, channels):
+        rate = self.bytes / 1024.0**2 / max(self.elapsed, 1e-9)
+        return "%d blocks, %d points, %d markers in %.2fs: %.1f MB/s, %.0f points/s (%d ch), CPU %.0f%%"%(
+                    self.blocks, self.samples, self.markers, self.elapsed, rate,
+                    self.samples / max(self.elapsed, 1e-9), channels,
+                    self.cpu / max(self.elapsed, 1e-9) * 100.0)
+
+
+def run(options):
+    ''' Receive and decode the configured number of blocks
+    @param options: command line options
+    @return: BenchmarkResult
+    '''
+    result = BenchmarkResult()
+    server = _DataServer(options.Channels, options.Points, options.Blocks, options.Markers, options.Data16)
+
+    # configure the client as after a START message, without module threads
+    client = RDA_Client()
+    client.data = EEG_DataBlock(options.Channels, 0)
+    client.data.sample_rate = options.Rate
+    client.resolutions = np.ones(options.Channels)
+    client.process_start()
+    client.serverDataValid = True
+
+    # decode each message in the receive thread
+    done = threading.Event()
+    def decode(message):
+        if result.blocks == 0:
+            result.t0 = time.time()
+            result.cpu0 = sum(os.times()[:2])
+        client.process_input(message)
+        output = client.process_output()
+        if output != None:
+            result.samples += output.eeg_channels.shape[1]
+            result.markers += len(output.markers)
+        result.blocks += 1
+        result.bytes += len(message.Data) + 24
+        if result.blocks == options.Blocks:
+            result.elapsed = time.time() - result.t0
+            result.cpu = sum(os.times()[:2]) - result.cpu0
+            done.set()
+    client._transmit_data = decode
+
+    server.start()
+    client.ADDR = ("localhost", server.port)
+    client.clientsock = socket(AF_INET, SOCK_STREAM)
+    client.client_thread_state = 1
+    client.client_thread_running = True
+    thread = threading.Thread(target=client._client_thread)
+    thread.start()
+    try:
+        done.wait(options.Timeout)
+    finally:
+        client.client_thread_running = False
+        thread.join()
+        client.clientsock.close()
+        server.join()
+    return result
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-c", "--channels", dest="Channels", type="int", default=64,
+                      help="number of channels [default: %default]")
+    parser.add_option("-p", "--points", dest="Points", type="int", default=500,
+                      help="data points per message [default: %default]")
+    parser.add_option("-n", "--blocks", dest="Blocks", type="int", default=2000,
+                      help="number of messages [default: %default]")
+    parser.add_option("-m", "--markers", dest="Markers", type="int", default=1,
+                      help="markers per message [default: %default]")
+    parser.add_option("-r", "--rate", dest="Rate", type="float", default=10000.0,
+                      help="sample rate in Hz, sets the client block size [default: %default]")
+    parser.add_option("--data16", dest="Data16", action="store_true", default=False,
+                      help="send 16-bit data messages")
+    parser.add_option("-t", "--timeout", dest="Timeout", type="float", default=60.0,
+                      help="maximum run time in seconds [default: %default]")
+    options, rest = parser.parse_args(args[1:])
+    if options.Channels < 1 or options.Points < 1 or options.Blocks < 1:
+        parser.error("channels, points and blocks have to be greater than 0")
+
+    # the module online configuration pane requires an application object
+    app = Qt.QApplication(args)
+    result = run(options)
+    print result.get_text(options.Channels)
+    return 0 if result.blocks == options.Blocks else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
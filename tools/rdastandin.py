@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+'''
+RDA Server Stand-In
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Serves synthetic RDA data streams on local ports, e.g. to test the
+L{rda_aggregator.RDA_Aggregator} without recording PCs. All streams carry a
+10 Hz sine and sync markers derived from the wall clock, so aligned streams
+show the same phase and markers at the same merged position. Start delays,
+send jitter and dropped blocks can be configured per run::
+
+    python -m tools.rdastandin --ports 51244,51245 --delay 0,0.3 --jitter 20
+
+@version: 1.0
+'''
+
+import sys
+import time
+import random
+import threading
+from socket import *
+from struct import Struct
+from binascii import unhexlify
+from optparse import OptionParser
+
+import numpy as np
+
+from rda_client import RDAMessageType, _MSG_GUID
+
+
+_HEADER = Struct("<16sLL")
+_GUID = unhexlify(_MSG_GUID)
+
+
+class StandIn(threading.Thread):
+    ''' Synthetic RDA server on a single port, serves one client at a time
+    '''
+    def __init__(self, port, delay, options):
+        ''' Open the server socket
+        @param port: TCP port
+        @param delay: delay between connection and START message in seconds
+        @param options: command line options
+        '''
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.delay = delay
+        self.options = options
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.sock.bind(("localhost", port))
+        self.sock.listen(1)
+
+    def _message(self, type, payload=""):
+        return _HEADER.pack(_GUID, _HEADER.size + len(payload), type) + payload
+
+    def _start_message(self):
+        channels = self.options.Channels
+        names = "".join(["P%d_Ch%d\0"%(self.port, n + 1) for n in range(channels)])
+        payload = Struct("<Ld").pack(channels, 1e6 / self.options.Rate)
+        payload += np.ones(channels).astype("<f8").tostring() + names
+        return self._message(RDAMessageType.START, payload)
+
+    def _data_message(self, block, t0, first, points):
+        ''' Build a data message, sine and sync markers are derived from the wall clock
+        @param block: block number
+        @param t0: wall clock time of the first sample
+        @param first: stream sample index of the first point
+        @param points: number of points
+        '''
+        rate = self.options.Rate
+        t = t0 + np.arange(first, first + points) / rate
+        data = np.repeat(100.0 * np.sin(2 * np.pi * 10.0 * t)[:, np.newaxis], self.options.Channels, axis=1)
+        markers = ""
+        count = 0
+        if self.options.Sync > 0:
+            # include the previous point to find period changes at the first point
+            periods = np.floor((t0 + np.arange(first - 1, first + points) / rate) / self.options.Sync)
+            for position in np.nonzero(np.diff(periods))[0]:
+                text = "Stimulus\0%s\0"%(self.options.Marker)
+                markers += Struct("<LlLl").pack(16 + len(text), position, 1, -1) + text
+                count += 1
+        payload = Struct("<LLL").pack(block, points, count) + data.astype("<f4").tostring() + markers
+        return self._message(RDAMessageType.DATA32, payload)
+
+    def run(self):
+        while True:
+            client, addr = self.sock.accept()
+            try:
+                self._serve(client)
+            except error:
+                pass
+            client.close()
+
+    def _serve(self, client):
+        time.sleep(self.delay)
+        client.sendall(self._start_message())
+        points = max(1, int(self.options.Rate * self.options.Block / 1000.0))
+        blocktime = points / self.options.Rate
+        t0 = time.time()
+        block = 0
+        while True:
+            block += 1
+            # keep the amplifier pace, jitter delays single blocks only
+            wait = t0 + block * blocktime - time.time()
+            if self.options.Jitter > 0:
+                wait += random.uniform(0.0, self.options.Jitter / 1000.0)
+            if wait > 0:
+                time.sleep(wait)
+            if random.random() < self.options.Drop:
+                continue
+            client.sendall(self._data_message(block, t0, (block - 1) * points, points))
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-p", "--ports", dest="Ports", default="51244,51245",
+                      help="server ports, comma separated [default: %default]")
+    parser.add_option("-d", "--delay", dest="Delay", default="0",
+                      help="START delay in seconds for each port, comma separated [default: %default]")
+    parser.add_option("-c", "--channels", dest="Channels", type="int", default=8,
+                      help="channels per server [default: %default]")
+    parser.add_option("-r", "--rate", dest="Rate", type="float", default=1000.0,
+                      help="sample rate in Hz [default: %default]")
+    parser.add_option("-b", "--block", dest="Block", type="float", default=20.0,
+                      help="block interval in ms [default: %default]")
+    parser.add_option("-j", "--jitter", dest="Jitter", type="float", default=0.0,
+                      help="maximum send jitter in ms [default: %default]")
+    parser.add_option("--drop", dest="Drop", type="float", default=0.0,
+                      help="probability of a dropped block [default: %default]")
+    parser.add_option("-s", "--sync", dest="Sync", type="float", default=1.0,
+                      help="sync marker interval in seconds, 0 = off [default: %default]")
+    parser.add_option("-m", "--marker", dest="Marker", default="Sync",
+                      help="sync marker description [default: %default]")
+    options, rest = parser.parse_args(args[1:])
+    try:
+        ports = [int(p) for p in options.Ports.split(",")]
+        delays = [float(d) for d in options.Delay.split(",")]
+    except ValueError as e:
+        parser.error(str(e))
+    delays += [delays[-1]] * (len(ports) - len(delays))
+
+    for port, delay in zip(ports, delays):
+        StandIn(port, delay, options).start()
+        print "RDA stand-in on port %d, START delay %.2fs"%(port, delay)
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+'''
+Shared Memory Ring Buffer
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Ring buffer in a memory mapped file (/dev/shm where available), written by
+L{shm_output.SHM_Output} and read by any number of consumers on the same host.
+This module depends on numpy only, consumers don't need PyQt.
+
+File layout, all values little endian:
+    - header (4096 bytes): static configuration and the writer position
+    - channel table: name, group, input and unit of each channel
+    - marker ring: position (sample counter), points, channel, type, description
+    - sample counter ring: uint64 for each point
+    - data ring: float32 (points, channels) in µV
+
+The writer copies a block into the rings and then advances the write
+position, so everything below the write position is complete. A reader
+gets numpy views into the mapping without copying. Views are valid until
+the writer wraps around, L{ShmRingReader.check} tells whether the views
+read last have been overwritten meanwhile.
+
+Readers wait on the notify word with a futex on Linux, other platforms poll.
+If the channel configuration changes the writer marks the file as closed and
+replaces it, readers have to open the new file.
+
+Monitor a ring::
+
+    python -m tools.shmring [ring name]
+
+@version: 1.0
+'''
+
+import os
+import sys
+import time
+import mmap
+import tempfile
+import platform
+import ctypes as ct
+from struct import Struct
+from optparse import OptionParser
+
+import numpy as np
+
+
+# header: magic, version, channels, capacity (points), marker capacity, sample rate
+_HEADER = Struct("<8sLLLLd")
+_MAGIC = "PYCSHM01"
+_VERSION = 1
+_HEADER_SIZE = 4096
+# writer state, 8 byte aligned
+_OFS_FLAGS = 64         #: uint32 ShmFlags
+_OFS_NOTIFY = 68        #: uint32, incremented for each block (futex word)
+_OFS_POSITION = 72      #: uint64, number of points written
+_OFS_BLOCKS = 80        #: uint64, number of blocks written
+_OFS_MARKERS = 88       #: uint64, number of markers written
+_UINT32 = Struct("<L")
+_UINT64 = Struct("<Q")
+# channel table entry: name, group, input, unit
+_CHANNEL = Struct("<32sLL8s")
+# marker ring entry: position, points, channel, type, description
+_MARKER = Struct("<QLl32s32s")
+
+#: default shared memory folder
+SHM_PATH = "/dev/shm"
+
+class ShmFlags:
+    ''' Writer state flags
+    '''
+    CLOSED = 0x0001     #: writer closed or replaced this file
+    RUNNING = 0x0002    #: data acquisition is running
+
+
+def ring_path(name):
+    ''' Get the file name of a ring buffer
+    @param name: ring name
+    '''
+    if os.path.isdir(SHM_PATH):
+        path = SHM_PATH
+    else:
+        path = tempfile.gettempdir()
+    return os.path.join(path, "pycorder_%s.shm"%(name))
+
+
+#: maximum waiting time in seconds for readers to release a file on Windows
+RELEASE_TIMEOUT = 2.0
+
+
+def _remove_file(filename, timeout=0.0):
+    ''' Remove a file if it exists
+    @param timeout: time in seconds to wait for other processes to release a mapped file (Windows)
+    '''
+    end = time.time() + timeout
+    while os.path.exists(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            if time.time() >= end:
+                raise
+            time.sleep(0.01)
+
+
+def _align(size):
+    return (size + 63) // 64 * 64
+
+
+def _layout(channels, capacity, marker_capacity):
+    ''' Get the region offsets
+    @return: channel table, marker ring, sample counter ring, data ring offsets and file size
+    '''
+    chtable = _HEADER_SIZE
+    markers = chtable + _align(channels * _CHANNEL.size)
+    samples = markers + _align(marker_capacity * _MARKER.size)
+    data = samples + _align(capacity * 8)
+    size = data + _align(capacity * channels * 4)
+    return chtable, markers, samples, data, size
+
+
+class _Futex(object):
+    ''' Wait for and wake waiters on a 32 bit word in shared memory (Linux only)
+    '''
+    _SYSCALLS = {"x86_64": 202, "amd64": 202, "i386": 240, "i686": 240,
+                 "aarch64": 98, "armv7l": 240}
+    FUTEX_WAIT = 0
+    FUTEX_WAKE = 1
+
+    class _Timespec(ct.Structure):
+        _fields_ = [("tv_sec", ct.c_long), ("tv_nsec", ct.c_long)]
+
+    def __init__(self):
+        if platform.system() != "Linux" or platform.machine() not in self._SYSCALLS:
+            raise OSError("futex not available")
+        self.number = self._SYSCALLS[platform.machine()]
+        self.libc = ct.CDLL(None, use_errno=True)
+        self.libc.syscall.restype = ct.c_long
+
+    def wait(self, address, value, timeout):
+        ''' Sleep while the word at address is equal to value
+        @param timeout: maximum waiting time in seconds
+        '''
+        ts = self._Timespec(int(timeout), int((timeout % 1.0) * 1e9))
+        self.libc.syscall(ct.c_long(self.number), ct.c_void_p(address), ct.c_int(self.FUTEX_WAIT),
+                          ct.c_int(value), ct.byref(ts), None, ct.c_int(0))
+
+    def wake(self, address):
+        ''' Wake all waiters
+        '''
+        self.libc.syscall(ct.c_long(self.number), ct.c_void_p(address), ct.c_int(self.FUTEX_WAKE),
+                          ct.c_int(0x7fffffff), None, None, ct.c_int(0))
+
+def _get_futex():
+    try:
+        return _Futex()
+    except Exception:
+        return None
+
+
+class ShmRingWriter(object):
+    ''' Create a ring buffer file and publish data blocks
+    '''
+    def __init__(self, name, channels, sample_rate, capacity, marker_capacity=1024):
+        ''' Create or replace the ring buffer file
+        @param name: ring name
+        @param channels: list of channel tuples (name, group, input, unit)
+        @param sample_rate: sample rate in Hz
+        @param capacity: ring size in points
+        @param marker_capacity: marker ring size
+        '''
+        self.filename = ring_path(name)
+        self.channels = len(channels)
+        self.capacity = max(1, int(capacity))
+        self.marker_capacity = max(1, int(marker_capacity))
+        chtable, markers, samples, data, size = _layout(self.channels, self.capacity, self.marker_capacity)
+        self.marker_offset = markers
+        self.position = 0       #: number of points written
+        self.blocks = 0         #: number of blocks written
+        self.markers = 0        #: number of markers written
+        self.flags = 0
+        self.map = None
+        self.sample_ring = self.data_ring = None
+
+        if os.name == "nt":
+            # mapped files can't be renamed or replaced on Windows, the previous writer has to be
+            # closed before and its readers have to release the file
+            _remove_file(self.filename, RELEASE_TIMEOUT)
+            filename = self.filename
+        else:
+            # create the new file beside the old one and replace it, readers never see a partial file
+            filename = self.filename + ".%d"%(os.getpid())
+        created = False
+        try:
+            f = open(filename, "w+b")
+            created = True
+            try:
+                f.truncate(size)
+                self.map = mmap.mmap(f.fileno(), size)
+            finally:
+                f.close()
+            for n, (chname, group, input, unit) in enumerate(channels):
+                _CHANNEL.pack_into(self.map, chtable + n * _CHANNEL.size, chname.encode("utf-8")[:31],
+                                   group, input, unit.encode("utf-8")[:7])
+            # readers check the magic, the header is written last
+            _HEADER.pack_into(self.map, 0, _MAGIC, _VERSION, self.channels, self.capacity,
+                              self.marker_capacity, sample_rate)
+            self.sample_ring = np.frombuffer(self.map, np.uint64, self.capacity, samples)
+            self.data_ring = np.frombuffer(self.map, np.float32, self.capacity * self.channels, data)
+            self.data_ring = self.data_ring.reshape(self.capacity, self.channels)
+            self.futex = _get_futex()
+            self.notify_address = np.frombuffer(self.map, np.uint32, 1, _OFS_NOTIFY).ctypes.data
+            if filename != self.filename:
+                os.rename(filename, self.filename)
+        except:
+            self.sample_ring = self.data_ring = None
+            if self.map != None:
+                self.map.close()
+                self.map = None
+            if created:
+                try:
+                    _remove_file(filename)
+                except OSError:
+                    pass
+            raise
+
+    def write(self, data, samples, markers=[]):
+        ''' Copy a data block into the ring and advance the write position
+        @param data: channel data (channels, points)
+        @param samples: sample counter (points)
+        @param markers: list of EEG_Marker objects with absolute positions
+        '''
+        points = data.shape[1]
+        # a block larger than the ring keeps only the last points
+        if points > self.capacity:
+            data = data[:, -self.capacity:]
+            samples = samples[-self.capacity:]
+            self.position += points - self.capacity
+            points = self.capacity
+        index = self.position % self.capacity
+        first = min(points, self.capacity - index)
+        self.data_ring[index:index+first] = data[:, :first].T
+        self.sample_ring[index:index+first] = samples[:first]
+        if first < points:
+            self.data_ring[:points-first] = data[:, first:].T
+            self.sample_ring[:points-first] = samples[first:]
+
+        for marker in markers:
+            offset = self.marker_offset + (self.markers % self.marker_capacity) * _MARKER.size
+            _MARKER.pack_into(self.map, offset, marker.position, marker.points, marker.channel,
+                              unicode(marker.type).encode("utf-8")[:31],
+                              unicode(marker.description).encode("utf-8")[:31])
+            self.markers += 1
+
+        # publish the block, the write position is updated after the data
+        self.position += points
+        self.blocks += 1
+        _UINT64.pack_into(self.map, _OFS_MARKERS, self.markers)
+        _UINT64.pack_into(self.map, _OFS_BLOCKS, self.blocks)
+        _UINT64.pack_into(self.map, _OFS_POSITION, self.position)
+        self._notify()
+
+    def set_running(self, running):
+        ''' Set the acquisition state
+        '''
+        if running:
+            self.flags |= ShmFlags.RUNNING
+        else:
+            self.flags &= ~ShmFlags.RUNNING
+        _UINT32.pack_into(self.map, _OFS_FLAGS, self.flags)
+        self._notify()
+
+    def _notify(self):
+        notify, = _UINT32.unpack_from(self.map, _OFS_NOTIFY)
+        _UINT32.pack_into(self.map, _OFS_NOTIFY, (notify + 1) & 0xFFFFFFFF)
+        if self.futex != None:
+            self.futex.wake(self.notify_address)
+
+    def close(self, remove=True):
+        ''' Mark the file as closed and release the mapping
+        @param remove: remove the file, False if it has already been replaced
+        '''
+        if self.map == None:
+            return
+        self.flags |= ShmFlags.CLOSED
+        _UINT32.pack_into(self.map, _OFS_FLAGS, self.flags)
+        self._notify()
+        self.sample_ring = self.data_ring = None
+        self.map.close()
+        self.map = None
+        if remove and os.path.exists(self.filename):
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+
+class ShmRingReader(object):
+    ''' Read data blocks from a ring buffer file without copying
+    '''
+    def __init__(self, name, oldest=False):
+        ''' Open the ring buffer file
+        @param name: ring name
+        @param oldest: start at the oldest available point instead of the current write position
+        '''
+        self.filename = ring_path(name)
+        f = open(self.filename, "rb")
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        magic, version, self.channels, self.capacity, \
+            self.marker_capacity, self.sample_rate = _HEADER.unpack_from(self.map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise Exception("%s is not a valid ring buffer file"%(self.filename))
+        chtable, self.marker_offset, samples, data, size = _layout(self.channels, self.capacity,
+                                                                   self.marker_capacity)
+        self.channel_properties = []   #: list of tuples (name, group, input, unit)
+        for n in range(self.channels):
+            chname, group, input, unit = _CHANNEL.unpack_from(self.map, chtable + n * _CHANNEL.size)
+            self.channel_properties.append((chname.rstrip("\0").decode("utf-8"), group, input,
+                                            unit.rstrip("\0").decode("utf-8")))
+        self.sample_ring = np.frombuffer(self.map, np.uint64, self.capacity, samples)
+        self.data_ring = np.frombuffer(self.map, np.float32, self.capacity * self.channels, data)
+        self.data_ring = self.data_ring.reshape(self.capacity, self.channels)
+        self.futex = _get_futex()
+        self.notify_address = np.frombuffer(self.map, np.uint32, 1, _OFS_NOTIFY).ctypes.data
+
+        position = self.get_position()
+        if oldest:
+            self.position = max(0, position - self.capacity)    #: next point to read
+        else:
+            self.position = position
+        self.marker_position = self._get(_UINT64, _OFS_MARKERS)    #: next marker to read
+        self.read_start = self.position     #: first point of the last read
+        self.overruns = 0       #: number of overruns
+        self.lost = 0           #: number of points lost by overruns
+
+    def _get(self, struct, offset):
+        return struct.unpack_from(self.map, offset)[0]
+
+    def get_position(self):
+        ''' Get the writer position (number of points written)
+        '''
+        return self._get(_UINT64, _OFS_POSITION)
+
+    def get_flags(self):
+        return self._get(_UINT32, _OFS_FLAGS)
+
+    def closed(self):
+        ''' Check if the writer has closed or replaced the file, open a new reader then
+        '''
+        return bool(self.get_flags() & ShmFlags.CLOSED)
+
+    def wait(self, timeout=1.0):
+        ''' Wait for new data
+        @param timeout: maximum waiting time in seconds
+        @return: True if new data is available
+        '''
+        end = time.time() + timeout
+        while True:
+            notify = self._get(_UINT32, _OFS_NOTIFY)
+            if self.get_position() != self.position or self.closed():
+                return True
+            remaining = end - time.time()
+            if remaining <= 0:
+                return False
+            if self.futex != None:
+                self.futex.wait(self.notify_address, notify, remaining)
+            else:
+                time.sleep(min(remaining, 0.001))
+
+    def read(self):
+        ''' Get the points written since the last read. Skips overwritten points.
+        @return: list of up to two segments (sample counter (points), data (points, channels)),
+        numpy views into the shared memory
+        '''
+        position = self.get_position()
+        if position - self.position > self.capacity:
+            # slow reader, the oldest points have been overwritten
+            self.overruns += 1
+            self.lost += position - self.capacity - self.position
+            self.position = position - self.capacity
+        self.read_start = self.position
+        segments = []
+        while self.position < position:
+            index = self.position % self.capacity
+            n = min(position - self.position, self.capacity - index)
+            segments.append((self.sample_ring[index:index+n], self.data_ring[index:index+n]))
+            self.position += n
+        return segments
+
+    def check(self):
+        ''' Check the views of the last read, call it after processing them
+        @return: False if the writer has overwritten the views meanwhile
+        '''
+        return self.get_position() - self.capacity <= self.read_start
+
+    def read_markers(self):
+        ''' Get the markers written since the last call
+        @return: list of tuples (position, points, channel, type, description)
+        '''
+        count = self._get(_UINT64, _OFS_MARKERS)
+        if count - self.marker_position > self.marker_capacity:
+            self.marker_position = count - self.marker_capacity
+        markers = []
+        for n in range(self.marker_position, count):
+            offset = self.marker_offset + (n % self.marker_capacity) * _MARKER.size
+            position, points, channel, type, description = _MARKER.unpack_from(self.map, offset)
+            markers.append((position, points, channel, type.rstrip("\0").decode("utf-8"),
+                            description.rstrip("\0").decode("utf-8")))
+        self.marker_position = count
+        return markers
+
+    def close(self):
+        self.sample_ring = self.data_ring = None
+        self.map.close()
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] [ring name]")
+    parser.add_option("-i", "--interval", dest="Interval", type="float", default=1.0,
+                      help="report interval in seconds [default: %default]")
+    options, names = parser.parse_args(args[1:])
+    name = names[0] if len(names) else "pycorder"
+    try:
+        reader = ShmRingReader(name)
+    except Exception as e:
+        print "%s: %s"%(ring_path(name), str(e))
+        return 1
+    print "%s: %d channels, %.0f Hz, %d points"%(reader.filename, reader.channels,
+                                                reader.sample_rate, reader.capacity)
+    points = 0
+    markers = 0
+    t = time.time()
+    try:
+        while True:
+            if reader.closed():
+                print "ring closed by writer"
+                break
+            if reader.wait(options.Interval):
+                for samples, data in reader.read():
+                    points += len(samples)
+                markers += len(reader.read_markers())
+            if time.time() - t >= options.Interval:
+                print "%.0f points/s, %d markers, %d overruns, %d points lost"%(points / (time.time() - t),
+                                                                                markers, reader.overruns,
+                                                                                reader.lost)
+                sys.stdout.flush()
+                points = 0
+                t = time.time()
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+'''
+Storage Write Path Benchmark
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Drives L{storage.StorageVision} without GUI, feeding simulated amplifier data
+blocks in real time. For each sample rate, channel count and data file writer
+the sustained throughput, the per block write latency and the peak input queue
+depth are measured. A slow writer shim can add latency, bandwidth limits and
+periodic stalls to find out how much disk stall the input queue can absorb::
+
+    python -m tools.storagebench [options] [output path]
+
+@version: 1.0
+'''
+
+import os
+import sys
+import time
+import copy
+import datetime
+import tempfile
+from optparse import OptionParser
+
+import numpy as np
+
+from modbase import EEG_DataBlock, EEG_Marker
+from storage import StorageVision
+from tools.datawriter import SlowWriter, writers
+
+#: sample rates supported by the amplifier module
+SAMPLE_RATES = [100000.0, 50000.0, 25000.0, 10000.0, 5000.0, 2000.0, 1000.0, 500.0, 200.0]
+#: channel counts for the available actiChamp module configurations
+CHANNELS = [32, 64, 96, 128, 160]
+#: maximum number of channels at 100kHz
+MAX_CHANNELS_100KHZ = 64
+
+
+class _HeadlessPane(object):
+    ''' Replaces the storage online configuration pane, no GUI required
+    '''
+    def __init__(self):
+        self.pushButtonRecord = self
+
+    def setEnabled(self, enabled):
+        pass
+
+    def set_recording_state(self, on):
+        pass
+
+    def set_filename(self, path, file, time=0):
+        pass
+
+
+class BenchmarkResult(object):
+    ''' Measurement results of a single benchmark run
+    '''
+    def __init__(self, writer, rate, channels):
+        self.writer = writer            #: writer name
+        self.rate = rate                #: sample rate in Hz
+        self.channels = channels        #: number of channels
+        self.required = rate * channels * 4 / 1024.0**2    #: required data rate in MB/s
+        self.throughput = 0.0           #: sustained data rate in MB/s
+        self.latency = []               #: write latency per block in seconds
+        self.queue_peak = 0             #: peak input queue depth
+        self.queue_size = 0             #: input queue size
+        self.overruns = 0               #: number of blocks lost by queue overrun
+        self.write_error = False        #: storage module stopped recording
+
+    def percentile(self, p):
+        ''' Get a write latency percentile in ms
+        '''
+        if len(self.latency) == 0:
+            return 0.0
+        return np.percentile(self.latency, p) * 1000.0
+
+    def get_line(self):
+        ''' Get the result as table line
+        '''
+        return "%-9s %7.0f %4d %8.2f %8.2f %7.2f %7.2f %7.2f %7.2f %5d/%-4d %5d%s"%(self.writer, self.rate, self.channels,
+                                                                                  self.required, self.throughput,
+                                                                                  self.percentile(50), self.percentile(95),
+                                                                                  self.percentile(99), self.percentile(100),
+                                                                                  self.queue_peak, self.queue_size,
+                                                                                  self.overruns,
+                                                                                  "  write error" if self.write_error else "")
+
+    def get_header(cls):
+        return "%-9s %7s %4s %8s %8s %7s %7s %7s %7s %10s %5s"%("writer", "rate", "ch", "req MB/s", "MB/s",
+                                                                "p50 ms", "p95 ms", "p99 ms", "max ms",
+                                                                "queue", "lost")
+    get_header = classmethod(get_header)
+
+
+def run(path, writer, rate, channels, options):
+    ''' Record simulated data for the configured duration
+    @param path: output folder
+    @param writer: writer name (tools.datawriter.writers)
+    @param rate: sample rate in Hz
+    @param channels: number of channels
+    @param options: command line options
+    @return: BenchmarkResult
+    '''
+    result = BenchmarkResult(writer, rate, channels)
+
+    # data file writer, optionally wrapped by the slow writer shim
+    writer_class = writers[writer]
+    if options.Latency or options.Bandwidth or options.Spike:
+        def factory(filename):
+            return SlowWriter(writer_class(filename),
+                              latency=options.Latency / 1000.0,
+                              bandwidth=options.Bandwidth * 1024.0**2,
+                              spike=options.Spike / 1000.0,
+                              interval=options.SpikeInterval)
+    else:
+        factory = writer_class
+
+    storage = StorageVision(queuesize=options.QueueSize)
+    storage.online_cfg = _HeadlessPane()
+    storage.writer_factory = factory
+    storage.journal_interval = options.Journal
+    result.queue_size = options.QueueSize
+
+    # measure the processing time of each block
+    process_input = storage.process_input
+    def timed_input(datablock):
+        t = time.time()
+        process_input(datablock)
+        result.latency.append(time.time() - t)
+    storage.process_input = timed_input
+
+    params = EEG_DataBlock(channels, 0)
+    params.sample_rate = rate
+    storage.process_update(params)
+
+    samples = max(1, int(rate * options.Block / 1000.0))
+    blocktime = samples / rate
+    blocks = max(1, int(options.Duration / blocktime))
+    data = np.random.uniform(-1000.0, 1000.0, (channels, samples))
+    marker_interval = max(1, int(1.0 / blocktime))
+
+    storage.file_name = os.path.join(path, "storagebench_%s_%d_%d.eeg"%(writer, rate, channels))
+    storage.start()
+    try:
+        storage._prepare_recording()
+        t0 = time.time()
+        for n in xrange(blocks):
+            block = copy.copy(params)
+            block.eeg_channels = data
+            block.sample_channel = np.arange(n * samples, (n + 1) * samples, dtype=np.uint64).reshape(1, -1)
+            block.block_time = datetime.datetime.now()
+            if n % marker_interval == 0:
+                block.markers = [EEG_Marker(type="Stimulus", description="S  1", position=n * samples)]
+            if storage._input_queue.full():
+                result.overruns += 1
+            storage._transmit_data(block)
+            result.queue_peak = max(result.queue_peak, storage.receive_data_available())
+            # keep the amplifier pace
+            wait = t0 + (n + 1) * blocktime - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+        # wait until all blocks are written
+        while storage.receive_data_available():
+            time.sleep(0.001)
+        storage._thLock.acquire()
+        elapsed = time.time() - t0
+        storage._thLock.release()
+        result.throughput = storage.data_bytes_written / 1024.0**2 / elapsed
+        result.write_error = storage.write_error
+    finally:
+        storage.stop()
+        if not options.Keep:
+            name = os.path.splitext(storage.file_name)[0]
+            for ext in [".eeg", ".vhdr", ".vmrk", ".vjrn", ".vcrc"]:
+                if os.path.exists(name + ext):
+                    os.remove(name + ext)
+    return result
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] [output path]")
+    parser.add_option("-r", "--rates", dest="Rates", default=",".join(["%d"%r for r in SAMPLE_RATES]),
+                      help="sample rates in Hz, comma separated [default: all]")
+    parser.add_option("-c", "--channels", dest="Channels", default=",".join([str(c) for c in CHANNELS]),
+                      help="channel counts, comma separated [default: %default]")
+    parser.add_option("-w", "--writers", dest="Writers", default="fwrite,buffered,mmap",
+                      help="data file writers, comma separated [default: %default]")
+    parser.add_option("-d", "--duration", dest="Duration", type="float", default=5.0,
+                      help="recording time per run in seconds [default: %default]")
+    parser.add_option("-b", "--block", dest="Block", type="float", default=60.0,
+                      help="amplifier block interval in ms [default: %default]")
+    parser.add_option("-q", "--queuesize", dest="QueueSize", type="int", default=50,
+                      help="storage input queue size in blocks [default: %default]")
+    parser.add_option("-j", "--journal", dest="Journal", type="float", default=1.0,
+                      help="journal sync interval in seconds, 0 = off [default: %default]")
+    parser.add_option("--latency", dest="Latency", type="float", default=0.0,
+                      help="slow writer: latency per write in ms")
+    parser.add_option("--bandwidth", dest="Bandwidth", type="float", default=0.0,
+                      help="slow writer: bandwidth limit in MB/s")
+    parser.add_option("--spike", dest="Spike", type="float", default=0.0,
+                      help="slow writer: latency spike in ms")
+    parser.add_option("--spike-interval", dest="SpikeInterval", type="float", default=5.0,
+                      help="slow writer: latency spike interval in seconds [default: %default]")
+    parser.add_option("-k", "--keep", dest="Keep", action="store_true", default=False,
+                      help="keep the recorded files")
+    options, paths = parser.parse_args(args[1:])
+
+    try:
+        rates = [float(r) for r in options.Rates.split(",")]
+        channels = [int(c) for c in options.Channels.split(",")]
+    except ValueError as e:
+        parser.error(str(e))
+    names = options.Writers.split(",")
+    for name in names:
+        if name not in writers:
+            parser.error("unknown writer '%s', available: %s"%(name, ", ".join(sorted(writers.keys()))))
+    if len(paths):
+        path = paths[0]
+    else:
+        path = tempfile.gettempdir()
+
+    print "output path: %s, block interval %.0fms, queue size %d (%.1fs stall buffer)"%(path, options.Block,
+                                                                                       options.QueueSize,
+                                                                                       options.QueueSize * options.Block / 1000.0)
+    print BenchmarkResult.get_header()
+    overruns = 0
+    for name in names:
+        for rate in rates:
+            for ch in channels:
+                if rate >= 100000.0 and ch > MAX_CHANNELS_100KHZ:
+                    continue
+                result = run(path, name, rate, ch, options)
+                print result.get_line()
+                sys.stdout.flush()
+                overruns += result.overruns
+    return 1 if overruns else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
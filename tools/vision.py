@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+'''
+Vision Data Exchange Format Helpers
+
+PyCorder ActiChamp Recorder
+
+------------------------------------------------------------
+
+This file is part of PyCorder
+
+PyCorder is free software: you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCorder. If not, see <http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------
+
+Read access to the header and marker files written by L{storage.StorageVision},
+shared by the offline tools. Only the subset of the format written by PyCorder is
+supported (BINARY, IEEE_FLOAT_32).
+
+@version: 1.0
+'''
+
+import os
+import codecs
+
+
+class VisionHeader(object):
+    ''' Content of a Vision header file (.vhdr)
+    '''
+    def __init__(self, filename):
+        ''' Parse the header file
+        @param filename: fully qualified header file name (.vhdr)
+        '''
+        self.filename = filename            #: header file name
+        self.path = os.path.split(filename)[0]
+        self.data_file = ""                 #: fully qualified data file name
+        self.marker_file = ""               #: fully qualified marker file name
+        self.data_format = "BINARY"         #: data format
+        self.orientation = "MULTIPLEXED"    #: data orientation
+        self.binary_format = "IEEE_FLOAT_32"#: binary sample format
+        self.channels = 0                   #: number of channels
+        self.sampling_interval = 0.0        #: sampling interval in µs
+        self.channel_infos = []             #: raw "Chn=" entries of the [Channel Infos] section
+        self.sections = {}                  #: all sections as {name: [lines]}
+        self._read()
+
+    def _read(self):
+        f = codecs.open(self.filename, "r", "utf-8")
+        try:
+            lines = f.read().splitlines()
+        finally:
+            f.close()
+        section = ""
+        for line in lines:
+            line = line.strip()
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1]
+                self.sections[section] = []
+                continue
+            if len(line) == 0 or line.startswith(";") or len(section) == 0:
+                continue
+            self.sections[section].append(line)
+            if "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            if section == "Common Infos":
+                if key == "DataFile":
+                    self.data_file = os.path.join(self.path, value)
+                elif key == "MarkerFile":
+                    self.marker_file = os.path.join(self.path, value)
+                elif key == "DataFormat":
+                    self.data_format = value
+                elif key == "DataOrientation":
+                    self.orientation = value
+                elif key == "NumberOfChannels":
+                    self.channels = int(value)
+                elif key == "SamplingInterval":
+                    self.sampling_interval = float(value)
+            elif section == "Binary Infos":
+                if key == "BinaryFormat":
+                    self.binary_format = value
+            elif section == "Channel Infos":
+                self.channel_infos.append(value)
+
+        if self.channels == 0 or len(self.data_file) == 0:
+            raise Exception("%s is not a valid Vision header file"%(self.filename))
+        if self.data_format != "BINARY" or self.binary_format != "IEEE_FLOAT_32":
+            raise Exception("%s: unsupported data format %s/%s"%(self.filename, self.data_format, self.binary_format))
+
+    @property
+    def sample_rate(self):
+        ''' Sampling rate in Hz
+        '''
+        if self.sampling_interval <= 0:
+            return 0.0
+        return 1.0e6 / self.sampling_interval
+
+    @property
+    def frame_size(self):
+        ''' Number of bytes for one sample of all channels
+        '''
+        return self.channels * 4
+
+    def get_samples(self):
+        ''' Get the number of complete samples in the data file
+        '''
+        return os.path.getsize(self.data_file) // self.frame_size
+
+
+def header_from_data_file(filename):
+    ''' Get the header file name for a data, marker or header file name
+    @param filename: .eeg, .vmrk or .vhdr file name
+    @return: header file name
+    '''
+    return os.path.splitext(filename)[0] + ".vhdr"
+
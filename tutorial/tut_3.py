@@ -134,7 +134,9 @@ class TUT_3(ModuleBase):
                 self.signalPane.data_queue.put(bufcopy, False) 
             #print bufcopy.shape[1]
             
-        # set different color for selected channels
+        # set different color for selected channels,
+        # shared channel properties are read-only, so we need our own copy
+        self.data.unshare_properties()
         selected = self.data.channel_properties[self.channel_index]
         for ch in selected:
             ch.color = Qt.Qt.darkYellow